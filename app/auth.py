@@ -0,0 +1,145 @@
+"""Device authentication for ingest endpoints.
+
+Devices present either a static API token (configured through
+``DEVICE_TOKENS="uuid:token,..."`` and stored only as SHA-256 digests) or a
+signed JWT whose subject is the device uuid, issued with
+``python -m app.auth <uuid>`` using ``DEVICE_TOKEN_SECRET``. Tokens are read
+from ``Authorization: Bearer``, ``X-Device-Token`` or a ``token`` query
+parameter. Set ``DEVICE_AUTH_REQUIRED=1`` to reject requests without one.
+
+Pairing and registration requests carry ``ADMIN_TOKEN`` the same way. When
+no admin token is configured they are allowed only while device
+authentication is optional.
+"""
+from typing import Mapping, Optional, Tuple
+from collections import OrderedDict
+import argparse
+import hmac
+import os
+import time
+from fastapi import HTTPException
+from jose import jwt, JWTError
+from .device_manager import device_manager, DeviceManager, hash_token
+
+ALGORITHM = "HS256"
+
+class DeviceAuth:
+    """Verifies device tokens, caching results so repeat checks are a dict hit"""
+
+    def __init__(self, registry: DeviceManager, secret: Optional[str] = None, required: bool = False,
+                 cache_size: int = 4096, cache_ttl: float = 60.0, negative_ttl: float = 5.0,
+                 admin_token: Optional[str] = None):
+        self.registry = registry
+        self.secret = secret
+        self.required = required
+        self.admin_hash = hash_token(admin_token) if admin_token else None
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.negative_ttl = negative_ttl
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, bool]]" = OrderedDict()
+    
+    def issue_token(self, uuid: str, expires_in: Optional[int] = None) -> str:
+        """Create a signed token for a device"""
+        if not self.secret:
+            raise RuntimeError("DEVICE_TOKEN_SECRET is not set")
+        claims = {"sub": uuid, "iat": int(time.time())}
+        if expires_in:
+            claims["exp"] = int(time.time()) + expires_in
+        return jwt.encode(claims, self.secret, algorithm=ALGORITHM)
+    
+    def _verify_signed(self, uuid: str, token: str) -> Tuple[bool, float]:
+        if not self.secret or token.count(".") != 2:
+            return False, 0.0
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=[ALGORITHM])
+        except JWTError:
+            return False, 0.0
+        return claims.get("sub") == uuid, float(claims.get("exp", 0))
+    
+    def verify(self, uuid: str, token: str) -> bool:
+        """Whether ``token`` authenticates ``uuid``"""
+        key = (uuid, token)
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        
+        valid = self.registry.check_token(uuid, token)
+        ttl = self.cache_ttl
+        if not valid:
+            valid, expires = self._verify_signed(uuid, token)
+            if valid and expires:
+                # Never cache a signed token past its expiry
+                ttl = min(ttl, expires - time.time())
+        if not valid:
+            ttl = self.negative_ttl
+        
+        self._cache[key] = (now + ttl, valid)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return valid
+    
+    def invalidate(self, uuid: str):
+        """Drop cached results for a device, e.g. after its token changed"""
+        for key in [key for key in self._cache if key[0] == uuid]:
+            del self._cache[key]
+    
+    @staticmethod
+    def token_from(headers: Mapping[str, str], query: Mapping[str, str]) -> Optional[str]:
+        """Extract a token from request headers or query parameters"""
+        authorization = headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            return authorization[7:].strip()
+        return headers.get("x-device-token") or query.get("token")
+    
+    def is_authorized(self, uuid: str, headers: Mapping[str, str], query: Mapping[str, str]) -> bool:
+        token = self.token_from(headers, query)
+        if token is None:
+            return not self.required
+        return self.verify(uuid, token)
+    
+    def check(self, uuid: str, headers: Mapping[str, str], query: Mapping[str, str]):
+        """Raise 401 unless the request is allowed to act as ``uuid``"""
+        if not self.is_authorized(uuid, headers, query):
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid or missing device token",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+
+    def check_admin(self, headers: Mapping[str, str], query: Mapping[str, str]):
+        """Raise 401 unless the request carries the admin token"""
+        if self.admin_hash is None:
+            allowed = not self.required
+        else:
+            token = self.token_from(headers, query)
+            allowed = token is not None and hmac.compare_digest(self.admin_hash, hash_token(token))
+        if not allowed:
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid or missing admin token",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+
+def load_static_tokens(registry: DeviceManager, spec: str):
+    """Load ``uuid:token`` pairs into the registry's hashed-token table"""
+    for pair in filter(None, (item.strip() for item in spec.split(","))):
+        uuid, _, token = pair.partition(":")
+        registry.set_token(uuid, token)
+
+# Global device auth instance
+device_auth = DeviceAuth(
+    device_manager,
+    secret=os.getenv("DEVICE_TOKEN_SECRET"),
+    required=os.getenv("DEVICE_AUTH_REQUIRED", "") in ("1", "true", "yes"),
+    admin_token=os.getenv("ADMIN_TOKEN")
+)
+load_static_tokens(device_manager, os.getenv("DEVICE_TOKENS", ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Issue a signed device token")
+    parser.add_argument("uuid")
+    parser.add_argument("--expires-in", type=int, default=None, help="lifetime in seconds")
+    args = parser.parse_args()
+    print(device_auth.issue_token(args.uuid, args.expires_in))
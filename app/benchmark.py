@@ -0,0 +1,308 @@
+"""Latency benchmarks for the hot request paths.
+
+Run with ``python -m app.benchmark``. Requests are sent to the app
+in-process through the ASGI transport, so no server or network is needed.
+The ``fleet`` suite replays the traffic pattern of ``helmet_module.ino``
+and ``bike module.ino`` for many simulated devices at once.
+"""
+from collections import defaultdict
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+import tracemalloc
+import httpx
+from . import main
+from .data_manager import DataManager, DeviceStatus
+from .device_manager import DeviceManager, DeviceType
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Return the ``pct`` percentile of ``samples`` (nearest rank)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(name: str, samples: List[float], elapsed: float) -> Dict:
+    """Build a result row with throughput and latency percentiles in ms"""
+    return {
+        "name": name,
+        "requests": len(samples),
+        "rps": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(samples, 50) * 1000,
+        "p95_ms": percentile(samples, 95) * 1000,
+        "p99_ms": percentile(samples, 99) * 1000,
+    }
+
+def print_results(results: List[Dict]):
+    print(f"{'benchmark':<32}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for row in results:
+        print(f"{row['name']:<32}{row['requests']:>10}{row['rps']:>10.0f}"
+              f"{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}{row['p99_ms']:>10.3f}")
+
+async def bench_webhook(devices: int = 10000, requests: int = 5000) -> Dict:
+    """Measure /bikemodule_webhook latency with ``devices`` registered helmets"""
+    main.data_manager = DataManager(tempfile.mkdtemp())
+    for i in range(devices):
+        await main.data_manager.update_device_status(DeviceStatus(
+            uuid=f"helmet-{i:05d}",
+            status="drunken" if i % 10 == 0 else "not_drunken",
+            timestamp="2025-01-01T00:00:00"
+        ))
+    
+    samples = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        for i in range(requests):
+            uuid = f"helmet-{(i * 7919) % devices:05d}"
+            t0 = time.perf_counter()
+            await client.get("/bikemodule_webhook", params={"uuid": uuid})
+            samples.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - started
+    return summarize(f"webhook ({devices} devices)", samples, elapsed)
+
+async def bench_registry(devices: int = 100000, lookups: int = 100000) -> List[Dict]:
+    """Measure device registry memory, lookups and paging with ``devices`` entries"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    registry = DeviceManager()
+    for i in range(devices):
+        device_type = DeviceType.BIKE if i % 2 else DeviceType.HELMET
+        await registry.register_device(f"device-{i:06d}", device_type, group=f"fleet-{i % 100}")
+    per_device = (tracemalloc.get_traced_memory()[0] - before) / devices
+    tracemalloc.stop()
+    print(f"registry memory: {per_device:.0f} bytes per device ({devices} devices)")
+    
+    samples = []
+    started = time.perf_counter()
+    for i in range(lookups):
+        t0 = time.perf_counter()
+        await registry.get_status(f"device-{(i * 7919) % devices:06d}")
+        samples.append(time.perf_counter() - t0)
+    results = [summarize(f"status lookup ({devices} devices)", samples, time.perf_counter() - started)]
+    
+    samples = []
+    started = time.perf_counter()
+    for i in range(1000):
+        t0 = time.perf_counter()
+        registry.list_devices(DeviceType.BIKE, f"fleet-{i % 100}", offset=100, limit=100)
+        samples.append(time.perf_counter() - t0)
+    results.append(summarize(f"group page ({devices} devices)", samples, time.perf_counter() - started))
+    return results
+
+# Seconds a simulated bike waits for a command before the run fails
+COMMAND_TIMEOUT = 10
+
+class ASGIWebSocket:
+    """Minimal in-process WebSocket client speaking ASGI to the app"""
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        self._accepted = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": self.path,
+            "raw_path": self.path.encode(),
+            "root_path": "",
+            "query_string": b"",
+            "headers": [(b"host", b"bench")],
+            "client": ("127.0.0.1", 0),
+            "server": ("bench", 80),
+            "subprotocols": [],
+        }
+        await self._outbox.put({"type": "websocket.connect"})
+        self._task = asyncio.create_task(self.app(scope, self._outbox.get, self._on_send))
+        await self._accepted.wait()
+
+    async def _on_send(self, message: Dict):
+        if message["type"] == "websocket.accept":
+            self._accepted.set()
+        elif message["type"] == "websocket.send":
+            await self.inbox.put((time.perf_counter(), message.get("text")))
+        elif message["type"] == "websocket.close":
+            raise RuntimeError(f"{self.path} closed with code {message.get('code')}")
+
+    async def close(self):
+        await self._outbox.put({"type": "websocket.disconnect", "code": 1000})
+        if self._task:
+            await self._task
+
+class FleetDevice:
+    """One helmet and its paired bike, replaying the firmware main loops"""
+
+    def __init__(self, client: httpx.AsyncClient, index: int, samples: Dict[str, List[float]]):
+        self.client = client
+        self.helmet = f"helmet-{index:03d}"
+        self.bike = f"bike-{index:03d}"
+        self.samples = samples
+        self.socket = ASGIWebSocket(main.app, f"/ws/{self.bike}")
+        # The server only sends 302 when the helmet's status changes
+        self.allowed = False
+
+    async def timed(self, name: str, method: str, url: str, **kwargs) -> float:
+        t0 = time.perf_counter()
+        response = await self.client.request(method, url, **kwargs)
+        self.samples[name].append(time.perf_counter() - t0)
+        # A real client would wait on the network here; give other devices a turn
+        await asyncio.sleep(0)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} returned {response.status_code}")
+        return t0
+
+    async def helmet_log(self, level: str, message: str):
+        await self.timed("POST /PostLogs", "POST", "/PostLogs",
+                         json={"device": self.helmet, "level": level, "message": message})
+
+    async def bike_log(self, level: str, message: str):
+        await self.timed("POST /log", "POST", "/log",
+                         json={"device": self.bike, "level": level, "message": message})
+
+    async def connect(self):
+        await self.timed("POST /pair", "POST", "/pair", params={"helmet": self.helmet, "bike": self.bike})
+        await self.socket.connect()
+        await self.bike_log("INFO", "WebSocket connected")
+
+    async def await_command(self, sent_at: float, expected: str):
+        """Wait for the bike to receive ``expected`` and react like the firmware"""
+        while True:
+            try:
+                received_at, message = await asyncio.wait_for(self.socket.inbox.get(), COMMAND_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"{self.bike} never received {expected}")
+            await self.bike_log("INFO", f"Received from server: {message}")
+            if message == expected:
+                self.samples[f"command {expected} to bike"].append(received_at - sent_at)
+                action = "Stop bike - Relay OFF" if expected == "304" else "Start bike - Relay ON"
+                await self.bike_log("ACTION", action)
+                return
+
+    async def post_gps(self, cycle: int):
+        await self.timed("POST /GPS", "POST", "/GPS", params={
+            "device": self.bike,
+            "latitude": 12.97 + cycle * 1e-4,
+            "longitude": 77.59 + cycle * 1e-4,
+            "timestamp": str(int(time.time() * 1000)),
+        })
+        await self.bike_log("INFO", "GPS Data posted via ip-api")
+
+    async def run(self, cycles: int, drunk_every: int, gps_every: int):
+        for cycle in range(cycles):
+            await self.helmet_log("INFO", "Helmet is not worn. Waiting...")
+            await self.helmet_log("INFO", "Helmet worn. Starting alcohol check...")
+            if drunk_every and cycle % drunk_every == drunk_every - 1:
+                level = 600 + cycle % 100
+                sent_at = await self.timed("POST /drunken", "POST", "/drunken", params={
+                    "uuid": self.helmet, "alcohol_level": level, "timestamp": str(cycle)
+                })
+                await self.await_command(sent_at, "304")
+                self.allowed = False
+                await self.helmet_log("ALERT", f"Drunken State Detected: {level}")
+            else:
+                sent_at = await self.timed("GET /not_drunken", "GET", "/not_drunken",
+                                           params={"uuid": self.helmet})
+                if not self.allowed:
+                    await self.await_command(sent_at, "302")
+                    self.allowed = True
+                await self.helmet_log("INFO", "Not Drunk State Detected: 120")
+            await self.helmet_log("INFO", "Holding state until helmet is removed...")
+            await self.helmet_log("INFO", "Helmet removed. Returning to idle...")
+            if gps_every and cycle % gps_every == 0:
+                await self.post_gps(cycle)
+
+async def background_load(client: httpx.AsyncClient, index: int, samples: Dict[str, List[float]],
+                          done: asyncio.Event, batch_size: int = 20):
+    """Post GPS batches and log lines back to back until ``done`` is set"""
+    device = f"tracker-{index:03d}"
+    sequence = 0
+    while not done.is_set():
+        fixes = [{"device": device, "latitude": 12.9 + i * 1e-5, "longitude": 77.5 + i * 1e-5}
+                 for i in range(batch_size)]
+        t0 = time.perf_counter()
+        await client.post("/GPS/batch", json=fixes)
+        samples["POST /GPS/batch (load)"].append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        await client.post("/log", json={"device": device, "level": "INFO", "message": f"tick {sequence}"})
+        samples["POST /log (load)"].append(time.perf_counter() - t0)
+        sequence += 1
+        await asyncio.sleep(0)
+
+async def bench_fleet(devices: int = 100, cycles: int = 20, drunk_every: int = 10,
+                      gps_every: int = 5, load_clients: int = 0) -> List[Dict]:
+    """Replay helmet and bike firmware traffic for ``devices`` helmet/bike pairs.
+
+    Every pair runs concurrently with no think time, so the figures describe
+    the app under sustained load rather than the real firmware cadence.
+    GPS fixes are posted every ``gps_every`` helmet cycles instead of every
+    five minutes. ``load_clients`` extra clients flood ``/GPS/batch`` and
+    ``/log`` meanwhile, to show how alert-to-bike command latency holds up.
+    """
+    main.data_manager = DataManager(tempfile.mkdtemp())
+    # Pairing goes through the pub/sub channels subscribed at startup
+    await main.startup_event()
+    samples: Dict[str, List[float]] = defaultdict(list)
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        fleet = [FleetDevice(client, i + 1, samples) for i in range(devices)]
+        for device in fleet:
+            await device.connect()
+        samples.clear()
+        done = asyncio.Event()
+        load = [asyncio.create_task(background_load(client, i, samples, done)) for i in range(load_clients)]
+        started = time.perf_counter()
+        await asyncio.gather(*(device.run(cycles, drunk_every, gps_every) for device in fleet))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await asyncio.gather(*load)
+        for device in fleet:
+            await device.socket.close()
+    await main.shutdown_event()
+    return [summarize(f"fleet {name}", samples[name], elapsed) for name in sorted(samples)]
+
+SUITES = ("webhook", "registry", "fleet")
+
+async def run(args) -> List[Dict]:
+    suites = args.suites.split(",")
+    results = []
+    if "webhook" in suites:
+        results.append(await bench_webhook(args.devices, args.requests))
+    if "registry" in suites:
+        results.extend(await bench_registry(args.registry_devices))
+    if "fleet" in suites:
+        results.extend(await bench_fleet(args.fleet_devices, args.cycles, load_clients=args.load_clients))
+    print_results(results)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smart Helmet System benchmarks")
+    parser.add_argument("--devices", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--registry-devices", type=int, default=100000)
+    parser.add_argument("--fleet-devices", type=int, default=100,
+                        help="helmet/bike pairs simulated by the fleet suite")
+    parser.add_argument("--cycles", type=int, default=20,
+                        help="helmet firmware loops run by each simulated pair")
+    parser.add_argument("--load-clients", type=int, default=10,
+                        help="clients flooding /GPS/batch and /log during the fleet suite")
+    parser.add_argument("--suites", default=",".join(SUITES),
+                        help=f"comma separated subset of {','.join(SUITES)}")
+    parser.add_argument("--max-p99-ms", type=float, default=None,
+                        help="exit non-zero when any p99 latency exceeds this")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    if args.max_p99_ms is not None:
+        slow = [row["name"] for row in results if row["p99_ms"] > args.max_p99_ms]
+        if slow:
+            print(f"p99 above {args.max_p99_ms} ms: {', '.join(slow)}")
+            sys.exit(1)
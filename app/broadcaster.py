@@ -0,0 +1,102 @@
+from typing import Dict, Optional
+import asyncio
+import json
+from fastapi import WebSocket
+from .metrics import metrics
+
+BROADCAST_SECONDS = metrics.histogram(
+    "broadcast_seconds", "Time encoding an event and queueing it for every client", ("event",))
+BROADCAST_DROPPED = metrics.counter(
+    "broadcast_dropped_total", "Messages dropped because a client queue was full")
+
+class ClientChannel:
+    """Outbound queue and sender task for one dashboard connection"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int, group: Optional[str] = None):
+        self.websocket = websocket
+        self.group = group  # only events for this device group, or all if None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.dropped = 0
+    
+    def offer(self, message: str):
+        """Queue a message, dropping the oldest one if the client is behind"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            BROADCAST_DROPPED.inc()
+        self.queue.put_nowait(message)
+
+class Broadcaster:
+    """Fans events out to dashboard WebSockets without blocking the caller.
+
+    Each event is serialized once and placed on a bounded queue per client;
+    a sender task per client drains its queue with a send timeout, so a slow
+    browser only ever delays itself.
+    """
+
+    def __init__(self, queue_size: int = 100, send_timeout: float = 2.0):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.clients: Dict[WebSocket, ClientChannel] = {}
+    
+    async def connect(self, websocket: WebSocket, group: Optional[str] = None):
+        """Accept a connection and start its sender task"""
+        await websocket.accept()
+        channel = ClientChannel(websocket, self.queue_size, group)
+        channel.task = asyncio.create_task(self._send_loop(channel))
+        self.clients[websocket] = channel
+    
+    def disconnect(self, websocket: WebSocket):
+        """Forget a connection and stop its sender task"""
+        channel = self.clients.pop(websocket, None)
+        if channel and channel.task and channel.task is not asyncio.current_task():
+            channel.task.cancel()
+    
+    @staticmethod
+    def _encode(event_type: str, data: Dict, version: Optional[int] = None) -> str:
+        message = {"type": event_type, "data": data}
+        if version is not None:
+            message["version"] = version
+        return json.dumps(message)
+    
+    def send(self, websocket: WebSocket, event_type: str, data: Dict):
+        """Queue an event for a single connection"""
+        channel = self.clients.get(websocket)
+        if channel:
+            channel.offer(self._encode(event_type, data))
+    
+    def publish(self, event_type: str, data: Dict, version: Optional[int] = None, group: Optional[str] = None):
+        """Queue an event for every connection subscribed to ``group``"""
+        if not self.clients:
+            return
+        with BROADCAST_SECONDS.time(event=event_type):
+            message = self._encode(event_type, data, version)
+            for channel in list(self.clients.values()):
+                if channel.group is None or channel.group == group:
+                    channel.offer(message)
+    
+    async def _send_loop(self, channel: ClientChannel):
+        try:
+            while True:
+                message = await channel.queue.get()
+                await asyncio.wait_for(channel.websocket.send_text(message), timeout=self.send_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Timed out or connection gone: drop the client
+            self.disconnect(channel.websocket)
+            try:
+                await channel.websocket.close()
+            except Exception:
+                pass
+    
+    async def close(self):
+        """Stop all sender tasks"""
+        for websocket in list(self.clients):
+            self.disconnect(websocket)
+
+# Global broadcaster instance
+broadcaster = Broadcaster()
+metrics.gauge("broadcast_clients", "Connected dashboard WebSockets",
+              func=lambda: len(broadcaster.clients))
@@ -0,0 +1,79 @@
+from typing import Dict, Optional
+import os
+from fastapi import WebSocket
+from .pubsub import PubSub, PubSubUnavailable, pubsub
+
+COMMAND_CHANNEL = "device-commands"
+
+class ConnectionManager:
+    """Routes commands to device WebSockets held by any worker.
+
+    Commands for sockets held by this process are sent directly; otherwise
+    they are published so the worker holding the socket delivers them. The
+    last command handed on for each device is remembered, so callers can
+    repeat one that failed or timed out.
+    """
+
+    def __init__(self, transport: PubSub):
+        self.active_connections: Dict[str, WebSocket] = {}  # device_id -> WebSocket
+        self.last_commands: Dict[str, str] = {}  # device_id -> last command sent or published
+        self.transport = transport
+        self.worker_id = f"{os.getpid()}"
+    
+    async def start(self):
+        await self.transport.subscribe(COMMAND_CHANNEL, self._on_command)
+    
+    async def connect(self, device_id: str, websocket: WebSocket):
+        await websocket.accept()
+        self.active_connections[device_id] = websocket
+    
+    def disconnect(self, device_id: str, websocket: WebSocket):
+        # A reconnected device has already replaced its old socket, which
+        # must not take the new one with it when it closes
+        if self.active_connections.get(device_id) is not websocket:
+            return
+        del self.active_connections[device_id]
+        self.last_commands.pop(device_id, None)
+    
+    def last_command(self, device_id: str) -> Optional[str]:
+        """The last command known to have reached or been routed to a device"""
+        return self.last_commands.get(device_id)
+    
+    async def _deliver(self, device_id: str, message: str) -> bool:
+        websocket = self.active_connections.get(device_id)
+        if websocket is None:
+            return False
+        try:
+            await websocket.send_text(message)
+            self.last_commands[device_id] = message
+            return True
+        except Exception as e:
+            print(f"Error sending to {device_id}: {e}")
+            self.disconnect(device_id, websocket)
+            return False
+    
+    async def send_to_device(self, device_id: str, message: str):
+        """Send a command to a device wherever its socket is connected"""
+        # Forgotten until this command is handed on, so a send that fails or
+        # is cancelled leaves no record of the previous one
+        self.last_commands.pop(device_id, None)
+        if await self._deliver(device_id, message):
+            return
+        try:
+            await self.transport.publish(COMMAND_CHANNEL, {
+                "device": device_id,
+                "message": message,
+                "origin": self.worker_id
+            })
+            self.last_commands[device_id] = message
+        except PubSubUnavailable as e:
+            # The bike is brought up to date when it reconnects (sync_bike)
+            print(f"Error routing command to {device_id}: {e}")
+    
+    async def _on_command(self, command: Dict):
+        if command.get("origin") == self.worker_id:
+            return
+        await self._deliver(command["device"], command["message"])
+
+# Global connection manager instance
+connection_manager = ConnectionManager(pubsub)
@@ -0,0 +1,50 @@
+from typing import Dict, List, Optional
+from collections import deque
+import uuid
+
+class DashboardCache:
+    """Versioned dashboard state with a journal of recent change events.
+
+    Every ingest event bumps ``version``. The rendered page is cached until
+    the next event, its ETag is derived from the version, and clients can
+    ask for just the events newer than the version they last saw.
+    """
+
+    def __init__(self, journal_size: int = 500):
+        # Distinguishes versions issued by different processes and restarts
+        self.instance = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.journal = deque(maxlen=journal_size)
+        self._page: Optional[bytes] = None
+        self._page_version = -1
+    
+    @property
+    def etag(self) -> str:
+        return f'"{self.instance}-{self.version}"'
+    
+    def record(self, event_type: str, data: Dict) -> int:
+        """Register a change event and invalidate the cached page"""
+        self.version += 1
+        self.journal.append({"version": self.version, "type": event_type, "data": data})
+        return self.version
+    
+    def delta(self, since: int) -> Optional[List[Dict]]:
+        """Events after ``since``, or None if they are no longer journaled"""
+        if since >= self.version:
+            return []
+        if not self.journal or since < self.journal[0]["version"] - 1:
+            return None
+        return [event for event in self.journal if event["version"] > since]
+    
+    def page(self) -> Optional[bytes]:
+        """The rendered page if it is still current"""
+        return self._page if self._page_version == self.version else None
+    
+    def store_page(self, body: bytes, version: int):
+        """Cache a page rendered from the state at ``version``"""
+        if version == self.version:
+            self._page = body
+            self._page_version = version
+
+# Global dashboard cache instance
+dashboard_cache = DashboardCache()
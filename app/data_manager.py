@@ -1,10 +1,27 @@
-import json
-import os
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from array import array
 from dataclasses import dataclass
 from datetime import datetime
+from itertools import islice
 import asyncio
+import time
 from pathlib import Path
+from .storage import StorageBackend, JSONLinesBackend, STORAGE_READ, create_backend
+from .pipeline import IngestPipeline, IngestLimit, PROTECTED_LEVELS, limits_from_env
+from .locks import RWLock
+from .track_store import TrackStore, to_epoch, parse_time
+from .log_index import LogIndex
+from .rollups import RollupStore
+from .geo_index import GridIndex, TripSegmenter
+from .device_manager import device_manager, DeviceType
+from .pubsub import pubsub
+
+# Workers sharing a store announce their flushes here
+STORE_CHANNEL = "store-changes"
+# Saved state holding the rollups and the log position they cover
+ROLLUP_STATE = "rollups"
+# Log rows read per query when folding a shared store's new rows into the rollups
+REPLAY_PAGE = 1000
 
 @dataclass
 class DeviceStatus:
@@ -22,98 +39,542 @@ class GPSData:
     ip_location: Optional[Dict] = None
 
 class DataManager:
-    def __init__(self, data_dir: str = "data"):
+    def __init__(self, data_dir: str = "data", backend: Optional[StorageBackend] = None,
+                 write_behind_interval: float = 1.0, status_shards: int = 16,
+                 ingest_limits: Optional[Dict[str, IngestLimit]] = None, log_dedupe_window: float = 30.0,
+                 log_dedupe_keys: int = 10000, follow_interval: float = 1.0):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
         
-        self.status_file = self.data_dir / "status.json"
-        self.logs_file = self.data_dir / "logs.json"
-        self.gps_file = self.data_dir / "gps.json"
+        self.backend = backend or JSONLinesBackend(self.data_dir)
+        self.pipeline = IngestPipeline(self.backend, limits=ingest_limits,
+                                       on_flush=self._announce if self.backend.shared else None)
+        
+        # Status keeps the latest entry per device in memory. Logs and GPS
+        # fixes are served from the log index and per-device columnar tracks,
+        # so their streams keep nothing in memory and retain more on disk.
+        self.status_log = self.backend.open_stream("status", retention=100000, key="uuid")
+        self.logs_log = self.backend.open_stream("logs", retention=100000, keep_tail=False)
+        self.gps_log = self.backend.open_stream("gps", retention=100000, keep_tail=False)
+        
+        self.log_index = LogIndex(retention=1000)
+        self.rollups = RollupStore()
+        self._replay_logs()
+        
+        # (device, level, message) -> when its window opened and the entry
+        # repeats are folded into, in the order windows opened
+        self.log_dedupe_window = log_dedupe_window
+        self.log_dedupe_keys = log_dedupe_keys
+        self._recent_logs: Dict[Tuple[str, str, str], Tuple[float, Optional[Dict]]] = {}
+        
+        self.tracks = TrackStore(capacity=1000)
+        self.geo = GridIndex()
+        self.trips = TripSegmenter()
+        with STORAGE_READ.time(stream="gps"):
+            # Only the newest fixes matter for tracks, positions and recent
+            # trips, however much history the store keeps
+            fixes = list(islice(self.gps_log.replay_reverse(), self.gps_log.retention))
+            self._track(reversed(fixes))
+        
+        # Registrations and pairings decide which bike a helmet's commands
+        # reach, so they are stored and restored into the device registry
+        self.devices_log = self.backend.open_stream("devices", retention=100000, key="uuid")
+        self.pairings_log = self.backend.open_stream("pairings", retention=100000, key="helmet")
+        for record in self.devices_log.records():
+            self.apply_registration(record)
+        for record in self.pairings_log.records():
+            self.apply_pairing(record)
+        
+        # Status registry served from memory, persisted by the write-behind task
+        self.statuses: Dict[str, DeviceStatus] = {
+            entry["uuid"]: DeviceStatus(**entry) for entry in self.status_log.records()
+        }
+        for status in self.statuses.values():
+            device_manager.record_status(status.uuid, status.status)
+        self._dirty_statuses: Set[str] = set()
+        self.write_behind_interval = write_behind_interval
+        self._write_behind: Optional[asyncio.Task] = None
+        
+        # Independent lock domains per stream; status updates are further
+        # sharded by device so unrelated devices never wait on each other
+        self.locks: Dict[str, RWLock] = {
+            "status": RWLock("status"),
+            "logs": RWLock("logs"),
+            "gps": RWLock("gps"),
+        }
+        self.status_shards: List[RWLock] = [RWLock(f"status-{i}") for i in range(status_shards)]
         
-        self._ensure_files_exist()
-        self.lock = asyncio.Lock()
-    
-    def _ensure_files_exist(self):
-        """Ensure all required JSON files exist with proper structure"""
-        if not self.status_file.exists():
-            self.status_file.write_text('[]')
-        if not self.logs_file.exists():
-            self.logs_file.write_text('[]')
-        if not self.gps_file.exists():
-            self.gps_file.write_text('[]')
+        # With a shared backend, records other workers store are applied
+        # here when they announce a flush, or every ``follow_interval``
+        # seconds; ``listeners`` are called with each such record
+        self.follow_interval = follow_interval
+        self.listeners: List[Callable[[str, Dict], None]] = []
+        self._store_changed: Optional[asyncio.Event] = None
+        self._follower: Optional[asyncio.Task] = None
+        # Streams flushed since the last announcement to the other workers
+        self._unannounced: Set[str] = set()
+        self._announce_wakeup: Optional[asyncio.Event] = None
+        self._announcer: Optional[asyncio.Task] = None
     
-    async def get_device_status(self, uuid: str) -> Optional[DeviceStatus]:
-        """Get current status of a device"""
-        async with self.lock:
-            data = json.loads(self.status_file.read_text())
-            for entry in data:
-                if entry["uuid"] == uuid:
-                    return DeviceStatus(**entry)
+    def _restore_rollups(self) -> Optional[int]:
+        """Load the rollups saved at the last shutdown.
+
+        Returns the log position they cover: the last ``seq`` of a local
+        store, or the last row id of a shared one.
+        """
+        state = self.backend.load_state(ROLLUP_STATE)
+        position = "row" if self.backend.shared else "seq"
+        if state is None or position not in state["through"] or not self.rollups.restore(state["rollups"]):
             return None
+        return state["through"][position]
     
-    async def update_device_status(self, status: DeviceStatus):
-        """Update device status"""
-        async with self.lock:
-            data = json.loads(self.status_file.read_text())
-            
-            # Remove existing entry if exists
-            data = [entry for entry in data if entry["uuid"] != status.uuid]
-            
-            # Add new entry
-            data.append(vars(status))
-            
-            # Keep only last 1000 entries
-            if len(data) > 1000:
-                data = data[-1000:]
-            
-            self.status_file.write_text(json.dumps(data, indent=2))
+    def _replay_logs(self):
+        """Rebuild the log index from the newest log entries and the rollups
+        from those saved at the last shutdown.
+
+        Only entries stored after the saved rollups are folded into them:
+        a shared store reads the rows after the saved position, and a local
+        one reads segments backwards from the end until the index is full
+        and it reaches entries the saved rollups already count. Without
+        saved rollups they are rebuilt from every entry inside their
+        horizon.
+        """
+        through = self._restore_rollups()
+        horizon = time.time() - self.rollups.horizon
+        recent: List[Dict] = []
+        with STORAGE_READ.time(stream="logs"):
+            if through is not None and self.backend.shared:
+                while True:
+                    through, entries = self.logs_log.read_page(through, REPLAY_PAGE)
+                    if not entries:
+                        break
+                    for entry in entries:
+                        self.rollups.add(entry)
+            for entry in self.logs_log.replay_reverse():
+                if through is None:
+                    fold = to_epoch(entry.get("timestamp")) >= horizon
+                else:
+                    fold = not self.backend.shared and entry.get("seq", 0) > through
+                if len(recent) < self.log_index.retention:
+                    recent.append(entry)
+                elif not fold:
+                    break
+                if fold:
+                    self.rollups.add(entry)
+                if self.backend.shared:
+                    # Workers number entries independently; renumber in store order
+                    entry.pop("seq", None)
+        # The index wants entries in ingest order; coalesced entries are
+        # written when their window closes, after later entries
+        for entry in sorted(reversed(recent), key=lambda entry: entry.get("seq", 0)):
+            self.log_index.add(entry)
     
-    async def add_log(self, device: str, level: str, message: str):
-        """Add a new log entry"""
-        async with self.lock:
-            data = json.loads(self.logs_file.read_text())
-            
+    async def start(self):
+        """Start the ingest pipeline, status write-behind and, with a shared store, the follower"""
+        await self.pipeline.start()
+        if self._write_behind is None:
+            self._write_behind = asyncio.create_task(self._write_behind_statuses())
+        if self.backend.shared and self._follower is None:
+            self._store_changed = asyncio.Event()
+            self._announce_wakeup = asyncio.Event()
+            await pubsub.subscribe(STORE_CHANNEL, self._on_store_change)
+            self._follower = asyncio.create_task(self._follow())
+            self._announcer = asyncio.create_task(self._announce_flushes())
+    
+    def _announce(self, streams: Set[str]):
+        """Note streams the ingest writer has just flushed.
+
+        ``_announce_flushes`` tells the other workers, so a slow or
+        unreachable broker never holds up writes.
+        """
+        self._unannounced |= streams
+        if self._announce_wakeup is not None:
+            self._announce_wakeup.set()
+    
+    async def _announce_flushes(self):
+        """Tell the other workers this one has stored new records.
+
+        Flushes made while an announcement is being sent are folded into
+        the next one; if announcing fails the others still find the
+        records when they poll.
+        """
+        while True:
+            await self._announce_wakeup.wait()
+            self._announce_wakeup.clear()
+            streams, self._unannounced = self._unannounced, set()
+            try:
+                await pubsub.publish(STORE_CHANNEL, {"origin": self.backend.origin, "streams": sorted(streams)})
+            except Exception as e:
+                print(f"Error announcing stored records: {e}")
+    
+    async def _on_store_change(self, message: Dict):
+        if message.get("origin") != self.backend.origin and self._store_changed is not None:
+            self._store_changed.set()
+    
+    async def _follow(self):
+        """Apply other workers' records when they announce them, polling as a fallback"""
+        while True:
+            try:
+                await asyncio.wait_for(self._store_changed.wait(), timeout=self.follow_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._store_changed.clear()
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Error applying records from other workers: {e}")
+                await asyncio.sleep(1)
+    
+    async def sync(self):
+        """Apply registrations, pairings, status changes, logs and GPS fixes stored by other workers"""
+        for record in await self.backend.changes("devices"):
+            self.apply_registration(record)
+        for record in await self.backend.changes("pairings"):
+            self.apply_pairing(record)
+        statuses = []
+        for record in await self.backend.changes("status"):
+            status = DeviceStatus(**record)
+            async with self._status_shard(status.uuid).writer():
+                current = self.statuses.get(status.uuid)
+                self.statuses[status.uuid] = status
+                device_manager.record_status(status.uuid, status.status)
+            if current is None or current.status != status.status:
+                statuses.append(record)
+        logs = await self.backend.changes("logs")
+        if logs:
+            async with self.locks["logs"].writer():
+                for entry in logs:
+                    entry.pop("seq", None)
+                    self.log_index.add(entry)
+                    self.rollups.add(entry)
+        fixes = await self.backend.changes("gps")
+        if fixes:
+            async with self.locks["gps"].writer():
+                self._track(fixes)
+        for stream, records in (("status", statuses), ("logs", logs), ("gps", fixes)):
+            for record in records:
+                for listener in self.listeners:
+                    listener(stream, record)
+    
+    async def close(self, timeout: float = 5.0):
+        """Flush all pending records to disk.
+
+        ``timeout`` bounds the wait for a flush already in progress; records
+        still buffered after that are written before returning.
+        """
+        if self._write_behind is not None:
+            self._write_behind.cancel()
+            self._write_behind = None
+        for task in (self._follower, self._announcer):
+            if task is not None:
+                task.cancel()
+        self._follower = self._announcer = None
+        async with self.locks["status"].writer():
+            await self._snapshot_statuses()
+        async with self.locks["logs"].writer(), self.locks["gps"].writer():
+            self._release_repeats(force=True)
+            await self.pipeline.stop(timeout)
+            await self._save_rollups()
+            await self.backend.close()
+    
+    async def _save_rollups(self):
+        """Save the rollups with the log position they cover, so the next
+        start only folds in entries stored after it"""
+        if self.backend.shared:
+            # Count what other workers stored since the last sync; every row
+            # up to the position read is then in the rollups
+            for entry in await self.backend.changes("logs"):
+                self.rollups.add(entry)
+            through = {"row": self.logs_log.last_id}
+        else:
+            through = {"seq": self.log_index.last_seq}
+        try:
+            await self.backend.save_state(ROLLUP_STATE, {"through": through, "rollups": self.rollups.state()})
+        except Exception as e:
+            print(f"Error saving rollups: {e}")
+    
+    async def _write_behind_statuses(self):
+        """Periodically persist status entries changed since the last snapshot
+        and log entries whose de-duplication window has closed"""
+        while True:
+            await asyncio.sleep(self.write_behind_interval)
+            try:
+                async with self.locks["status"].writer():
+                    await self._snapshot_statuses()
+                if self._recent_logs:
+                    async with self.locks["logs"].writer():
+                        self._release_repeats()
+            except Exception as e:
+                print(f"Error persisting device status: {e}")
+    
+    def _release_repeats(self, force: bool = False):
+        """Close expired de-duplication windows, or all of them, writing their repeats"""
+        now = time.time()
+        for key, (opened, repeats) in list(self._recent_logs.items()):
+            # Windows are kept in the order they opened
+            if not force and now - opened < self.log_dedupe_window and len(self._recent_logs) <= self.log_dedupe_keys:
+                break
+            del self._recent_logs[key]
+            if repeats is not None:
+                self.pipeline.submit("logs", repeats)
+    
+    async def _snapshot_statuses(self):
+        dirty, self._dirty_statuses = self._dirty_statuses, set()
+        for uuid in dirty:
+            status = self.statuses.get(uuid)
+            if status:
+                self.pipeline.submit("status", vars(status))
+    
+    def _status_shard(self, uuid: str) -> RWLock:
+        return self.status_shards[hash(uuid) % len(self.status_shards)]
+    
+    def lock_stats(self) -> Dict[str, Dict]:
+        """Contention counters for every lock domain"""
+        stats = {name: lock.stats() for name, lock in self.locks.items()}
+        shards = [lock.stats() for lock in self.status_shards]
+        stats["status_shards"] = {
+            key: round(sum(shard[key] for shard in shards), 6) for key in shards[0]
+        }
+        return stats
+    
+    async def get_device_status(self, uuid: str) -> Optional[DeviceStatus]:
+        """Get current status of a device.
+
+        With a shared store the status is read from the store on the I/O
+        executor, so every worker answers with the latest status whichever
+        worker received it, without blocking the event loop.
+        """
+        if self.backend.shared:
+            record = await self.backend.executor.run(self.status_log.read_key, uuid)
+            return DeviceStatus(**record) if record else None
+        return self.statuses.get(uuid)
+    
+    async def get_device_statuses(self, uuids: List[str]) -> Dict[str, DeviceStatus]:
+        """Current statuses of several devices, by uuid; devices without one are left out.
+
+        With a shared store they are read in one batch on the I/O executor
+        rather than one round trip per device.
+        """
+        if self.backend.shared:
+            records = await self.backend.executor.run(self.status_log.read_keys, uuids)
+            return {uuid: DeviceStatus(**record) for uuid, record in records.items()}
+        return {uuid: self.statuses[uuid] for uuid in uuids if uuid in self.statuses}
+    
+    async def update_device_status(self, status: DeviceStatus) -> bool:
+        """Update device status; returns False if the status is unchanged.
+
+        An unchanged report only refreshes the timestamp and last-seen in
+        memory and is not written again.
+        """
+        async with self._status_shard(status.uuid).writer():
+            # Another worker may have changed it; compare against the store
+            current = await self.get_device_status(status.uuid)
+            device_manager.record_status(status.uuid, status.status)
+            if current is not None and (current.status, current.alcohol_level) == (status.status, status.alcohol_level):
+                self.statuses[status.uuid] = current
+                current.timestamp = status.timestamp
+                return False
+            self.statuses[status.uuid] = status
+            if not self.backend.shared:
+                self._dirty_statuses.add(status.uuid)
+                return True
+            # Other workers read statuses from the store; write it through
+            self.pipeline.submit("status", vars(status))
+        await self.backend.flush_stream("status")
+        return True
+    
+    @staticmethod
+    def apply_registration(record: Dict):
+        """Mirror a stored registration into the device registry"""
+        device_manager.add_device(record["uuid"], DeviceType(record["type"]), record.get("group"))
+    
+    @staticmethod
+    def apply_pairing(record: Dict):
+        """Mirror a stored pairing into the device registry; no bike means unpaired"""
+        if record.get("bike"):
+            device_manager.pair(record["helmet"], record["bike"])
+        else:
+            device_manager.unpair(record["helmet"])
+    
+    async def register_device(self, uuid: str, device_type: DeviceType, group: Optional[str] = None) -> Dict:
+        """Register a device and store the registration before returning"""
+        record = {"uuid": uuid, "type": device_type.value, "group": group, "timestamp": datetime.now().isoformat()}
+        self.apply_registration(record)
+        self.pipeline.submit("devices", record)
+        await self.backend.flush_stream("devices")
+        return record
+    
+    async def pair_devices(self, helmet: str, bike: Optional[str]) -> Dict:
+        """Pair a helmet with a bike, or unpair it, and store the pairing before returning"""
+        record = {"helmet": helmet, "bike": bike, "timestamp": datetime.now().isoformat()}
+        self.apply_pairing(record)
+        self.pipeline.submit("pairings", record)
+        await self.backend.flush_stream("pairings")
+        return record
+    
+    async def add_log(self, device: str, level: str, message: str, metadata: Optional[Dict] = None) -> Dict:
+        """Add a new log entry.
+
+        The first (device, level, message) entry is written at once and opens
+        a ``log_dedupe_window`` second window. Repeats inside the window are
+        collapsed into one entry whose ``count`` and ``last_timestamp`` grow
+        with each repeat; it is written when the window closes. SECURITY and
+        ERROR entries are never collapsed.
+        """
+        async with self.locks["logs"].writer():
+            now = datetime.now()
             log_entry = {
                 "device": device,
                 "level": level,
                 "message": message,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now.isoformat()
             }
+            if metadata:
+                log_entry["metadata"] = metadata
             
-            data.append(log_entry)
+            if self.log_dedupe_window <= 0 or level in PROTECTED_LEVELS:
+                self.log_index.add(log_entry)
+                self.rollups.add(log_entry)
+                self.pipeline.submit("logs", log_entry)
+                return log_entry
             
-            # Keep only last 1000 entries
-            if len(data) > 1000:
-                data = data[-1000:]
+            key = (device, level, message)
+            window = self._recent_logs.get(key)
+            if window is not None and now.timestamp() - window[0] < self.log_dedupe_window:
+                opened, repeats = window
+                self.rollups.add(log_entry)
+                if repeats is not None:
+                    repeats["count"] += 1
+                    repeats["last_timestamp"] = log_entry["timestamp"]
+                    return repeats
+                log_entry["count"] = 1
+                log_entry["last_timestamp"] = log_entry["timestamp"]
+                self.log_index.add(log_entry)
+                self._recent_logs[key] = (opened, log_entry)
+                return log_entry
             
-            self.logs_file.write_text(json.dumps(data, indent=2))
+            if window is not None:
+                del self._recent_logs[key]
+                if window[1] is not None:
+                    self.pipeline.submit("logs", window[1])
+            self.log_index.add(log_entry)
+            self.rollups.add(log_entry)
+            self.pipeline.submit("logs", log_entry)
+            self._recent_logs[key] = (now.timestamp(), None)
+            if len(self._recent_logs) > self.log_dedupe_keys:
+                self._release_repeats()
+            return log_entry
+    
+    def _track(self, entries: Iterable[Dict]):
+        # Trips are measured per device over whole columns of fixes
+        columns: Dict[str, Tuple[array, array, array]] = {}
+        for entry in entries:
+            device, latitude, longitude = entry["device"], entry["latitude"], entry["longitude"]
+            timestamp = to_epoch(entry["timestamp"])
+            self.tracks.add(device, latitude, longitude, timestamp)
+            self.geo.update(device, latitude, longitude, timestamp)
+            lats, lons, timestamps = columns.setdefault(device, (array("d"), array("d"), array("d")))
+            lats.append(latitude)
+            lons.append(longitude)
+            timestamps.append(timestamp)
+        for device, (lats, lons, timestamps) in columns.items():
+            self.trips.add_track(device, lats, lons, timestamps)
+    
+    async def track_gps_data(self, gps_data: GPSData):
+        """Make a fix visible to readers without persisting it yet"""
+        async with self.locks["gps"].writer():
+            self._track([vars(gps_data)])
+    
+    async def persist_gps_data(self, gps_data: GPSData):
+        """Persist a fix previously added with ``track_gps_data``"""
+        self.pipeline.submit("gps", vars(gps_data))
     
     async def add_gps_data(self, gps_data: GPSData):
         """Add new GPS data"""
-        async with self.lock:
-            data = json.loads(self.gps_file.read_text())
-            
-            data.append(vars(gps_data))
-            
-            # Keep only last 1000 entries
-            if len(data) > 1000:
-                data = data[-1000:]
-            
-            self.gps_file.write_text(json.dumps(data, indent=2))
+        await self.add_gps_batch([gps_data])
+    
+    async def add_gps_batch(self, batch: List[GPSData]):
+        """Add several GPS fixes under a single lock acquisition"""
+        async with self.locks["gps"].writer():
+            entries = [vars(gps_data) for gps_data in batch]
+            self._track(entries)
+            for entry in entries:
+                self.pipeline.submit("gps", entry)
     
     async def get_recent_logs(self, limit: int = 100) -> List[Dict]:
         """Get recent logs"""
-        async with self.lock:
-            data = json.loads(self.logs_file.read_text())
-            return data[-limit:]
+        async with self.locks["logs"].reader():
+            return self.log_index.recent(limit)
+    
+    async def query_logs(self, device: Optional[str] = None, level: Optional[str] = None,
+                         since: Optional[str] = None, until: Optional[str] = None,
+                         cursor: Optional[int] = None, limit: int = 100) -> List[Dict]:
+        """Get logs after ``cursor`` filtered by device, level and time range.
+
+        Workers number their in-memory entries independently, so with a
+        shared store the logs are read from it instead, on the I/O executor,
+        and cursors are the store's row ids, valid on every worker. Entries
+        appear there once flushed.
+        """
+        since_epoch = parse_time(since) if since else None
+        until_epoch = parse_time(until) if until else None
+        if self.backend.shared:
+            fields = {column: value for column, value in (("device", device), ("level", level)) if value}
+            return await self.backend.executor.run(self.logs_log.query, cursor, since_epoch, until_epoch,
+                                                   limit, **fields)
+        async with self.locks["logs"].reader():
+            return self.log_index.query(
+                device=device,
+                level=level,
+                since=since_epoch,
+                until=until_epoch,
+                cursor=cursor,
+                limit=limit
+            )
+    
+    async def get_rollups(self, device: Optional[str], resolution: str,
+                          since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """Rollup buckets for a device, or the whole fleet when ``device`` is None"""
+        async with self.locks["logs"].reader():
+            return self.rollups.query(
+                device, resolution,
+                since=parse_time(since) if since else None,
+                until=parse_time(until) if until else None
+            )
+    
+    async def get_rollup_summary(self, resolution: str, since: Optional[str] = None,
+                                 until: Optional[str] = None) -> Dict[str, Dict]:
+        """Per-device rollup totals over a time range"""
+        async with self.locks["logs"].reader():
+            return self.rollups.summary(
+                resolution,
+                since=parse_time(since) if since else None,
+                until=parse_time(until) if until else None
+            )
+    
+    async def find_nearby(self, latitude: float, longitude: float, limit: int = 10,
+                          radius_km: Optional[float] = None) -> List[Dict]:
+        """Devices closest to a point by their latest fix"""
+        async with self.locks["gps"].reader():
+            return self.geo.nearest(latitude, longitude, limit, radius_km)
+    
+    async def find_within(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+                          limit: int = 1000) -> List[Dict]:
+        """Devices whose latest fix lies inside a bounding box"""
+        async with self.locks["gps"].reader():
+            return self.geo.within(min_lat, min_lon, max_lat, max_lon, limit)
+    
+    async def get_trips(self, device: str, limit: int = 10) -> List[Dict]:
+        """A device's most recent trips, newest first"""
+        async with self.locks["gps"].reader():
+            return self.trips.recent(device, limit)
     
     async def get_recent_gps_data(self, device: Optional[str] = None, limit: int = 100) -> List[Dict]:
-        """Get recent GPS data, optionally filtered by device"""
-        async with self.lock:
-            data = json.loads(self.gps_file.read_text())
+        """Get recent GPS data for a device, or the latest fix of each device"""
+        async with self.locks["gps"].reader():
             if device:
-                data = [entry for entry in data if entry["device"] == device]
-            return data[-limit:]
+                return self.tracks.recent(device, limit)
+            return self.tracks.latest_positions(limit)
 
 # Global data manager instance
-data_manager = DataManager() 
\ No newline at end of file
+data_manager = DataManager(backend=create_backend(Path("data")), ingest_limits=limits_from_env())
\ No newline at end of file
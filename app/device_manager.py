@@ -1,6 +1,9 @@
-from typing import Dict, Optional
-from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from itertools import islice
 import asyncio
+import hashlib
+import hmac
+import time
 from dataclasses import dataclass
 from enum import Enum
 
@@ -14,66 +17,196 @@ class DeviceStatus(Enum):
     DRUNKEN = "drunken"
     OVERRIDE = "override"
 
-@dataclass
+# Status strings reported by the modules mapped to registry states
+STATUS_MAP = {
+    "safe": DeviceStatus.SAFE,
+    "not_drunken": DeviceStatus.SAFE,
+    "drunken": DeviceStatus.DRUNKEN,
+    "override": DeviceStatus.OVERRIDE,
+}
+
+DEFAULT_GROUP = "default"
+
+@dataclass(slots=True)
 class Device:
     uuid: str
     type: DeviceType
     status: DeviceStatus
-    last_seen: datetime
-    api_token: Optional[str] = None
+    last_seen: float  # epoch seconds
+    group: str = DEFAULT_GROUP
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
 
 class DeviceManager:
+    """Registry of devices indexed by type, group and helmet/bike pairing.
+
+    The type and group indexes are insertion-ordered dicts used as ordered
+    sets, so membership changes are O(1) and a page is a slice.
+    """
+
     def __init__(self):
         self.devices: Dict[str, Device] = {}
+        self.by_type: Dict[DeviceType, Dict[str, None]] = {device_type: {} for device_type in DeviceType}
+        self.by_group: Dict[str, Dict[str, None]] = {}
+        # helmet uuid -> bike uuid the helmet controls, and the reverse
+        self.pairings: Dict[str, str] = {}
+        self.paired_helmets: Dict[str, str] = {}
+        # uuid -> SHA-256 digest of the device's API token
+        self.token_hashes: Dict[str, str] = {}
         self.status_lock = asyncio.Lock()
+        self.pair("helmet-001", "bike-001")
+    
+    def _add(self, device: Device):
+        self.devices[device.uuid] = device
+        self.by_type[device.type][device.uuid] = None
+        self.by_group.setdefault(device.group, {})[device.uuid] = None
+    
+    def _set_group(self, device: Device, group: str):
+        if device.group == group:
+            return
+        members = self.by_group[device.group]
+        members.pop(device.uuid, None)
+        if not members:
+            del self.by_group[device.group]
+        device.group = group
+        self.by_group.setdefault(group, {})[device.uuid] = None
     
-    async def register_device(self, uuid: str, device_type: DeviceType, api_token: Optional[str] = None) -> Device:
+    def add_device(self, uuid: str, device_type: DeviceType, group: Optional[str] = None) -> Device:
+        """Add a device to the registry, or refresh and regroup an existing one"""
+        device = self.devices.get(uuid)
+        if device is None:
+            device = Device(
+                uuid=uuid,
+                type=device_type,
+                status=DeviceStatus.UNKNOWN,
+                last_seen=time.time(),
+                group=group or DEFAULT_GROUP
+            )
+            self._add(device)
+        else:
+            device.last_seen = time.time()
+            if group:
+                self._set_group(device, group)
+        return device
+    
+    async def register_device(self, uuid: str, device_type: DeviceType, api_token: Optional[str] = None,
+                              group: Optional[str] = None) -> Device:
         """Register a new device or update existing one"""
         async with self.status_lock:
-            if uuid not in self.devices:
-                self.devices[uuid] = Device(
-                    uuid=uuid,
-                    type=device_type,
-                    status=DeviceStatus.UNKNOWN,
-                    last_seen=datetime.now(),
-                    api_token=api_token
-                )
-            else:
-                self.devices[uuid].last_seen = datetime.now()
-                if api_token:
-                    self.devices[uuid].api_token = api_token
-            return self.devices[uuid]
+            device = self.add_device(uuid, device_type, group)
+            if api_token:
+                self.set_token(uuid, api_token)
+            return device
+    
+    def type_of(self, uuid: str) -> DeviceType:
+        """Registered type of a device, or the type its uuid suggests"""
+        device = self.devices.get(uuid)
+        if device is not None:
+            return device.type
+        return DeviceType.BIKE if "bike" in uuid else DeviceType.HELMET
+    
+    def record_status(self, uuid: str, status: str):
+        """Mirror a reported status string into the registry, registering the device if needed"""
+        device = self.devices.get(uuid)
+        if device is None:
+            device = Device(
+                uuid=uuid,
+                type=self.type_of(uuid),
+                status=DeviceStatus.UNKNOWN,
+                last_seen=time.time()
+            )
+            self._add(device)
+        device.status = STATUS_MAP.get(status, DeviceStatus.UNKNOWN)
+        device.last_seen = time.time()
     
     async def update_status(self, uuid: str, status: DeviceStatus) -> bool:
         """Update device status"""
-        async with self.status_lock:
-            if uuid in self.devices:
-                self.devices[uuid].status = status
-                self.devices[uuid].last_seen = datetime.now()
-                return True
+        device = self.devices.get(uuid)
+        if device is None:
             return False
+        device.status = status
+        device.last_seen = time.time()
+        return True
     
     async def get_status(self, uuid: str) -> Optional[DeviceStatus]:
         """Get device status"""
-        async with self.status_lock:
-            if uuid in self.devices:
-                return self.devices[uuid].status
-            return None
+        device = self.devices.get(uuid)
+        return device.status if device else None
     
     async def get_helmet_status(self) -> DeviceStatus:
-        """Get status of the first helmet device found"""
-        async with self.status_lock:
-            for device in self.devices.values():
-                if device.type == DeviceType.HELMET:
-                    return device.status
+        """Get status of the first registered helmet"""
+        helmets = self.by_type[DeviceType.HELMET]
+        if not helmets:
             return DeviceStatus.UNKNOWN
+        return self.devices[next(iter(helmets))].status
+    
+    def group_of(self, uuid: str) -> Optional[str]:
+        """Group of a registered device"""
+        device = self.devices.get(uuid)
+        return device.group if device else None
+    
+    def list_devices(self, device_type: Optional[DeviceType] = None, group: Optional[str] = None,
+                     offset: int = 0, limit: int = 100) -> List[Device]:
+        """A page of devices, optionally restricted to a type and/or group"""
+        if group is not None:
+            members: Iterable[str] = self.by_group.get(group, {})
+            if device_type is not None:
+                members = (uuid for uuid in members if self.devices[uuid].type == device_type)
+        elif device_type is not None:
+            members = self.by_type[device_type]
+        else:
+            members = self.devices
+        return [self.devices[uuid] for uuid in islice(members, offset, offset + limit)]
+    
+    def count(self, device_type: Optional[DeviceType] = None, group: Optional[str] = None) -> int:
+        """Number of devices of a type and/or in a group"""
+        if group is not None:
+            members = self.by_group.get(group, {})
+            if device_type is None:
+                return len(members)
+            return sum(1 for uuid in members if self.devices[uuid].type == device_type)
+        if device_type is not None:
+            return len(self.by_type[device_type])
+        return len(self.devices)
+    
+    def pair(self, helmet_uuid: str, bike_uuid: str):
+        """Pair a helmet with the bike it controls"""
+        self.unpair(helmet_uuid)
+        previous_helmet = self.paired_helmets.get(bike_uuid)
+        if previous_helmet:
+            self.pairings.pop(previous_helmet, None)
+        self.pairings[helmet_uuid] = bike_uuid
+        self.paired_helmets[bike_uuid] = helmet_uuid
+    
+    def unpair(self, helmet_uuid: str):
+        """Remove a helmet's pairing"""
+        bike_uuid = self.pairings.pop(helmet_uuid, None)
+        if bike_uuid:
+            self.paired_helmets.pop(bike_uuid, None)
+    
+    def get_paired_bike(self, helmet_uuid: str) -> Optional[str]:
+        """Get the bike controlled by a helmet"""
+        return self.pairings.get(helmet_uuid)
+    
+    def get_paired_helmet(self, bike_uuid: str) -> Optional[str]:
+        """Get the helmet controlling a bike"""
+        return self.paired_helmets.get(bike_uuid)
+    
+    def set_token(self, uuid: str, token: str):
+        """Store the digest of a device's API token"""
+        self.token_hashes[uuid] = hash_token(token)
+    
+    def check_token(self, uuid: str, token: str) -> bool:
+        """Constant-time comparison against the stored token digest"""
+        expected = self.token_hashes.get(uuid)
+        if expected is None:
+            return False
+        return hmac.compare_digest(expected, hash_token(token))
     
     async def verify_token(self, uuid: str, token: str) -> bool:
         """Verify device API token"""
-        async with self.status_lock:
-            if uuid in self.devices:
-                return self.devices[uuid].api_token == token
-            return False
+        return self.check_token(uuid, token)
 
 # Global device manager instance
-device_manager = DeviceManager() 
\ No newline at end of file
+device_manager = DeviceManager()
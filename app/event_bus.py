@@ -0,0 +1,145 @@
+from typing import Callable, Dict, List, Optional
+from enum import IntEnum
+import asyncio
+import inspect
+import os
+import time
+from .metrics import metrics
+
+class Lane(IntEnum):
+    """Event lanes, highest priority first"""
+    COMMAND = 0  # block/allow commands to bikes
+    PERSIST = 1  # log and status persistence
+    NOTIFY = 2   # dashboard broadcasts
+
+LANE_DEPTH = metrics.gauge("event_lane_depth", "Events waiting on each lane", ("lane",))
+LANE_WAIT = metrics.histogram("event_lane_wait_seconds", "Time from submit until an event starts", ("lane",))
+
+class EventBus:
+    """Runs work on prioritized lanes.
+
+    ``dispatch`` on the command lane runs the handler at once in the caller,
+    before anything else the caller does, rather than waiting for a task to
+    be scheduled behind other ready tasks. A handler still running after
+    ``command_timeout`` seconds, such as a send to a stalled bike socket, is
+    cancelled and the caller carries on. Everything else is queued per lane
+    and run by that lane's workers, which wait while any higher lane has
+    work queued. Within a lane with a single worker, events run in
+    submission order.
+    """
+
+    def __init__(self, workers: Optional[Dict[Lane, int]] = None, command_timeout: float = 5.0):
+        self.workers = workers or {Lane.PERSIST: 1, Lane.NOTIFY: 1}
+        self.command_timeout = command_timeout
+        self.queues: Dict[Lane, asyncio.Queue] = {}
+        self._idle: Dict[Lane, asyncio.Event] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.failed = 0
+
+    def _queue(self, lane: Lane) -> asyncio.Queue:
+        queue = self.queues.get(lane)
+        if queue is None:
+            queue = self.queues[lane] = asyncio.Queue()
+            self._idle[lane] = asyncio.Event()
+            self._idle[lane].set()
+        return queue
+
+    def submit(self, lane: Lane, func: Callable, *args):
+        """Queue ``func(*args)`` on a lower lane; coroutine functions are awaited"""
+        if lane == Lane.COMMAND:
+            raise ValueError("Command-lane handlers run through dispatch")
+        queue = self._queue(lane)
+        queue.put_nowait((time.perf_counter(), func, args))
+        self._idle[lane].clear()
+        LANE_DEPTH.set(queue.qsize(), lane=lane.name)
+
+    async def dispatch(self, lane: Lane, func: Callable, *args):
+        """Run a command-lane handler now, or queue work for a lower lane"""
+        if lane != Lane.COMMAND:
+            self.submit(lane, func, *args)
+            return
+        # asyncio.wait_for would move the handler into a new task, behind
+        # every other ready task, so the deadline cancels the caller instead
+        task = asyncio.current_task()
+        expired = False
+
+        def expire():
+            nonlocal expired
+            expired = True
+            task.cancel()
+
+        timer = asyncio.get_running_loop().call_later(self.command_timeout, expire)
+        try:
+            result = func(*args)
+            if inspect.isawaitable(result):
+                await result
+        except asyncio.CancelledError:
+            if not expired:
+                raise
+            if hasattr(task, "uncancel"):
+                task.uncancel()
+            self.failed += 1
+            print(f"Command {getattr(func, '__name__', func)} timed out after {self.command_timeout}s")
+        finally:
+            timer.cancel()
+
+    async def start(self):
+        if self._tasks:
+            return
+        for lane, count in self.workers.items():
+            self._queue(lane)
+            for _ in range(count):
+                self._tasks.append(asyncio.create_task(self._work(lane)))
+
+    async def _higher_drained(self, lane: Lane):
+        """Wait until no lane above ``lane`` has work queued"""
+        while True:
+            busy = [event for other, event in self._idle.items() if other < lane and not event.is_set()]
+            if not busy:
+                return
+            await busy[0].wait()
+
+    async def _work(self, lane: Lane):
+        queue = self.queues[lane]
+        while True:
+            submitted, func, args = await queue.get()
+            if queue.empty():
+                self._idle[lane].set()
+            try:
+                await self._higher_drained(lane)
+                LANE_WAIT.observe(time.perf_counter() - submitted, lane=lane.name)
+                LANE_DEPTH.set(queue.qsize(), lane=lane.name)
+                result = func(*args)
+                if inspect.isawaitable(result):
+                    await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                print(f"Error handling {lane.name.lower()} event {getattr(func, '__name__', func)}: {e}")
+            finally:
+                queue.task_done()
+
+    async def stop(self, timeout: float = 5.0):
+        """Let queued events finish, highest lane first, then stop the workers.
+
+        All lanes share one ``timeout`` second deadline; events still queued
+        when it passes are dropped.
+        """
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        for lane in sorted(self.queues):
+            try:
+                await asyncio.wait_for(self.queues[lane].join(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                print(f"Dropping {self.queues[lane].qsize()} queued {lane.name.lower()} events")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.queues = {}
+        self._idle = {}
+
+# Global event bus instance; COMMAND_TIMEOUT bounds each bike command
+event_bus = EventBus(command_timeout=float(os.getenv("COMMAND_TIMEOUT", "5")))
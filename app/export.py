@@ -0,0 +1,155 @@
+"""Streaming log exports read straight from the persisted segments.
+
+Records are read from disk a chunk at a time on the I/O executor and
+encoded as they go, so memory use does not depend on the export size.
+"""
+from typing import AsyncIterator, Dict, List, Optional
+import csv
+import io
+import json
+import zlib
+from .io_executor import io_executor
+from .storage import RecordStream, SegmentedLog, COMPACTED_MARKER, STORAGE_READ
+from .track_store import to_epoch, parse_time
+
+EXPORT_FIELDS = ["timestamp", "device", "level", "message"]
+
+class SegmentReader:
+    """Reads one segment file in chunks of lines"""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+    
+    def read_chunk(self, max_lines: int) -> List[str]:
+        if self.handle is None:
+            try:
+                self.handle = open(self.path, "r")
+            except FileNotFoundError:
+                # Dropped by retention since the export started
+                return []
+        lines = []
+        for line in self.handle:
+            lines.append(line)
+            if len(lines) >= max_lines:
+                break
+        return lines
+    
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+
+async def read_records(stream: RecordStream, chunk_lines: int = 1000) -> AsyncIterator[List[Dict]]:
+    """Yield the stream's records on disk in chunks, oldest first"""
+    if not isinstance(stream, SegmentedLog):
+        # Table-backed streams page through their rows by id
+        after = 0
+        while True:
+            with STORAGE_READ.time(stream=stream.name):
+                after, records = await io_executor.run(stream.read_page, after, chunk_lines)
+            if not records:
+                break
+            yield records
+        return
+    segments = await io_executor.run(stream.live_segments)
+    for segment in segments:
+        reader = SegmentReader(segment)
+        try:
+            while True:
+                with STORAGE_READ.time(stream=stream.name):
+                    lines = await io_executor.run(reader.read_chunk, chunk_lines)
+                    records = []
+                    for line in lines:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if not record.get(COMPACTED_MARKER):
+                            records.append(record)
+                if not lines:
+                    break
+                yield records
+        finally:
+            await io_executor.run(reader.close)
+
+async def filtered_records(stream: RecordStream, device: Optional[str] = None,
+                           since: Optional[str] = None, until: Optional[str] = None) -> AsyncIterator[List[Dict]]:
+    """Chunks of records matching the device and time-range filters"""
+    start = parse_time(since) if since else None
+    end = parse_time(until) if until else None
+    if not isinstance(stream, SegmentedLog) and (device or start is not None or end is not None):
+        # Tables filter through their (device, timestamp) index, in time order
+        position = None
+        while True:
+            with STORAGE_READ.time(stream=stream.name):
+                position, records = await io_executor.run(stream.read_range, device, start, end, position, 1000)
+            if not records:
+                break
+            yield records
+        return
+    async for chunk in read_records(stream):
+        matched = []
+        for record in chunk:
+            if device and record.get("device") != device:
+                continue
+            if start is not None or end is not None:
+                timestamp = to_epoch(record.get("timestamp"))
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+            matched.append(record)
+        if matched:
+            yield matched
+
+async def export_csv(chunks: AsyncIterator[List[Dict]]) -> AsyncIterator[str]:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["Timestamp", "Device", "Level", "Message"])
+    yield output.getvalue()
+    async for chunk in chunks:
+        output.seek(0)
+        output.truncate()
+        for record in chunk:
+            writer.writerow([record.get(field) for field in EXPORT_FIELDS])
+        yield output.getvalue()
+
+async def export_ndjson(chunks: AsyncIterator[List[Dict]]) -> AsyncIterator[str]:
+    async for chunk in chunks:
+        yield "".join(json.dumps(record) + "\n" for record in chunk)
+
+async def export_json(chunks: AsyncIterator[List[Dict]]) -> AsyncIterator[str]:
+    yield "["
+    first = True
+    async for chunk in chunks:
+        for record in chunk:
+            yield ("" if first else ",") + json.dumps(record)
+            first = False
+    yield "]"
+
+async def export_columnar(chunks: AsyncIterator[List[Dict]]) -> AsyncIterator[bytes]:
+    """Gzip-compressed row groups, one JSON object of column arrays per line.
+
+    Device and level columns are dictionary-encoded per row group, which
+    together with compression keeps analytics pulls small.
+    """
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    async for chunk in chunks:
+        group = {"rows": len(chunk)}
+        for field in EXPORT_FIELDS:
+            values = [record.get(field) for record in chunk]
+            if field in ("device", "level"):
+                dictionary = sorted({value for value in values if value is not None})
+                codes = {value: i for i, value in enumerate(dictionary)}
+                group[field] = {"dictionary": dictionary, "codes": [codes.get(value, -1) for value in values]}
+            else:
+                group[field] = values
+        data = compressor.compress((json.dumps(group) + "\n").encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv", "logs.csv"),
+    "ndjson": (export_ndjson, "application/x-ndjson", "logs.ndjson"),
+    "json": (export_json, "application/json", "logs.json"),
+    "columnar": (export_columnar, "application/gzip", "logs.columnar.json.gz"),
+}
@@ -0,0 +1,234 @@
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+from array import array
+from collections import deque
+from datetime import datetime
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+def path_km(lats: Sequence[float], lons: Sequence[float]) -> float:
+    """Length of the path through a run of points in kilometres.
+
+    Works over whole coordinate columns such as ``array('d')`` buffers: each
+    point's radians and cosine are computed once and shared by both legs it
+    belongs to, rather than once per leg as summing ``haversine_km`` does.
+    """
+    if len(lats) < 2:
+        return 0.0
+    phi = list(map(math.radians, lats))
+    lam = list(map(math.radians, lons))
+    cos_phi = list(map(math.cos, phi))
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    total = 0.0
+    for i in range(1, len(phi)):
+        a = sin((phi[i] - phi[i - 1]) / 2) ** 2 + cos_phi[i - 1] * cos_phi[i] * sin((lam[i] - lam[i - 1]) / 2) ** 2
+        total += asin(sqrt(min(1.0, a)))
+    return 2 * EARTH_RADIUS_KM * total
+
+def _iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+class GridIndex:
+    """Latest position of every device bucketed into lat/lon grid cells.
+
+    A cell is ``cell_deg`` degrees on each side (0.01° is about 1.1 km of
+    latitude), so bounding-box and nearest queries only look at the cells
+    around the query point instead of every device.
+    """
+
+    def __init__(self, cell_deg: float = 0.01):
+        self.cell_deg = cell_deg
+        self.cells: Dict[Tuple[int, int], Set[str]] = {}
+        self.positions: Dict[str, Tuple[float, float, float]] = {}
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_deg), math.floor(longitude / self.cell_deg)
+
+    def update(self, device: str, latitude: float, longitude: float, timestamp: float):
+        """Move a device to its newest position; older fixes are ignored"""
+        previous = self.positions.get(device)
+        if previous is not None:
+            if timestamp < previous[2]:
+                return
+            old_cell = self._cell(previous[0], previous[1])
+            if old_cell == self._cell(latitude, longitude):
+                self.positions[device] = (latitude, longitude, timestamp)
+                return
+            members = self.cells[old_cell]
+            members.discard(device)
+            if not members:
+                del self.cells[old_cell]
+        self.positions[device] = (latitude, longitude, timestamp)
+        self.cells.setdefault(self._cell(latitude, longitude), set()).add(device)
+
+    def _entry(self, device: str, distance: Optional[float] = None) -> Dict:
+        latitude, longitude, timestamp = self.positions[device]
+        entry = {
+            "device": device,
+            "latitude": latitude,
+            "longitude": longitude,
+            "timestamp": _iso(timestamp)
+        }
+        if distance is not None:
+            entry["distance_km"] = round(distance, 4)
+        return entry
+
+    def _cells_in(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+        lo_i, lo_j = self._cell(min_lat, min_lon)
+        hi_i, hi_j = self._cell(max_lat, max_lon)
+        if (hi_i - lo_i + 1) * (hi_j - lo_j + 1) > len(self.cells):
+            # Sparse fleet: walking the occupied cells is cheaper
+            return [cell for cell in self.cells if lo_i <= cell[0] <= hi_i and lo_j <= cell[1] <= hi_j]
+        return [(i, j) for i in range(lo_i, hi_i + 1) for j in range(lo_j, hi_j + 1) if (i, j) in self.cells]
+
+    def within(self, min_lat: float, min_lon: float, max_lat: float, max_lon: float,
+               limit: int = 1000) -> List[Dict]:
+        """Devices whose latest position lies inside the bounding box"""
+        found = []
+        for cell in self._cells_in(min_lat, min_lon, max_lat, max_lon):
+            for device in self.cells[cell]:
+                latitude, longitude, _ = self.positions[device]
+                if min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon:
+                    found.append(self._entry(device))
+                    if len(found) >= limit:
+                        return found
+        return found
+
+    def _scored(self, latitude: float, longitude: float, radius_km: Optional[float]) -> List[Tuple[float, str]]:
+        """``(distance, device)`` for every device within ``radius_km``, closest first"""
+        if radius_km is None:
+            candidates = self.positions.keys()
+        else:
+            # Degrees spanned by the radius; longitude degrees shrink towards the poles
+            dlat = radius_km / 111.0
+            dlon = radius_km / max(1e-6, 111.0 * math.cos(math.radians(latitude)))
+            candidates = [
+                device
+                for cell in self._cells_in(latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon)
+                for device in self.cells[cell]
+            ]
+        scored = []
+        for device in candidates:
+            lat, lon, _ = self.positions[device]
+            distance = haversine_km(latitude, longitude, lat, lon)
+            if radius_km is None or distance <= radius_km:
+                scored.append((distance, device))
+        scored.sort()
+        return scored
+
+    def nearest(self, latitude: float, longitude: float, limit: int = 10,
+                radius_km: Optional[float] = None) -> List[Dict]:
+        """Closest devices to a point, optionally no further than ``radius_km``"""
+        if radius_km is not None:
+            scored = self._scored(latitude, longitude, radius_km)
+        else:
+            # Widen the search until it holds ``limit`` devices; anything
+            # outside the radius is further away than everything inside it
+            search_km = 1.0
+            scored = self._scored(latitude, longitude, search_km)
+            while len(scored) < min(limit, len(self.positions)) and search_km < 1000:
+                search_km *= 4
+                scored = self._scored(latitude, longitude, search_km)
+            if len(scored) < min(limit, len(self.positions)):
+                scored = self._scored(latitude, longitude, None)
+        return [self._entry(device, distance) for distance, device in scored[:limit]]
+
+class Trip:
+    """One continuous stretch of a device's track"""
+
+    __slots__ = ("start", "end", "points", "distance_km", "start_lat", "start_lon", "end_lat", "end_lon")
+
+    def __init__(self, latitude: float, longitude: float, timestamp: float):
+        self.start = self.end = timestamp
+        self.points = 1
+        self.distance_km = 0.0
+        self.start_lat = self.end_lat = latitude
+        self.start_lon = self.end_lon = longitude
+
+    def extend(self, latitude: float, longitude: float, timestamp: float):
+        self.distance_km += haversine_km(self.end_lat, self.end_lon, latitude, longitude)
+        self.end = timestamp
+        self.end_lat, self.end_lon = latitude, longitude
+        self.points += 1
+
+    def extend_path(self, lats: Sequence[float], lons: Sequence[float], timestamp: float):
+        """Append a run of fixes at once; ``timestamp`` is that of the last one"""
+        path_lats, path_lons = array("d", (self.end_lat,)), array("d", (self.end_lon,))
+        path_lats.extend(lats)
+        path_lons.extend(lons)
+        self.distance_km += path_km(path_lats, path_lons)
+        self.end = timestamp
+        self.end_lat, self.end_lon = lats[-1], lons[-1]
+        self.points += len(lats)
+
+    def to_dict(self) -> Dict:
+        duration = self.end - self.start
+        return {
+            "start": _iso(self.start),
+            "end": _iso(self.end),
+            "duration_s": round(duration, 3),
+            "points": self.points,
+            "distance_km": round(self.distance_km, 4),
+            "avg_speed_kmh": round(self.distance_km / duration * 3600, 2) if duration > 0 else 0.0,
+            "from": {"latitude": self.start_lat, "longitude": self.start_lon},
+            "to": {"latitude": self.end_lat, "longitude": self.end_lon},
+        }
+
+class TripSegmenter:
+    """Splits each device's fixes into trips wherever the track has a time gap.
+
+    Trips are built incrementally as fixes arrive; each device keeps its
+    last ``max_trips`` trips. The default gap is two of the bike module's
+    five-minute GPS intervals. Fixes older than the device's latest one are
+    out of order and skipped.
+    """
+
+    def __init__(self, gap_seconds: float = 600.0, max_trips: int = 50):
+        self.gap_seconds = gap_seconds
+        self.max_trips = max_trips
+        self.trips: Dict[str, deque] = {}
+
+    def add(self, device: str, latitude: float, longitude: float, timestamp: float):
+        trips = self.trips.get(device)
+        if trips is None:
+            trips = self.trips[device] = deque(maxlen=self.max_trips)
+        current = trips[-1] if trips else None
+        if current is not None and timestamp < current.end:
+            return
+        if current is None or timestamp - current.end > self.gap_seconds:
+            trips.append(Trip(latitude, longitude, timestamp))
+        else:
+            current.extend(latitude, longitude, timestamp)
+
+    def add_track(self, device: str, lats: Sequence[float], lons: Sequence[float], timestamps: Sequence[float]):
+        """Add a device's fixes held column-wise, oldest first.
+
+        Gives the same trips as calling ``add`` for every fix, but each
+        unbroken run of fixes is measured with one ``path_km`` call.
+        """
+        count, start = len(timestamps), 0
+        while start < count:
+            self.add(device, lats[start], lons[start], timestamps[start])
+            current = self.trips[device][-1]
+            end, previous = start + 1, current.end
+            while end < count and previous <= timestamps[end] <= previous + self.gap_seconds:
+                previous = timestamps[end]
+                end += 1
+            if end > start + 1:
+                current.extend_path(lats[start + 1:end], lons[start + 1:end], previous)
+            start = end
+
+    def recent(self, device: str, limit: int = 10) -> List[Dict]:
+        """A device's most recent trips, newest first"""
+        trips = self.trips.get(device)
+        if not trips:
+            return []
+        return [trip.to_dict() for trip in list(trips)[-limit:][::-1]]
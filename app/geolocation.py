@@ -0,0 +1,105 @@
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import time
+import aiohttp
+
+class GeoProvider:
+    """Base class for IP geolocation providers"""
+
+    async def lookup(self, session: aiohttp.ClientSession, ip: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+class IPAPIProvider(GeoProvider):
+    """Looks up locations from ip-api.com (or a compatible stub server)"""
+
+    def __init__(self, base_url: str = "http://ip-api.com/json/"):
+        self.base_url = base_url
+    
+    async def lookup(self, session: aiohttp.ClientSession, ip: str) -> Optional[Dict]:
+        async with session.get(f"{self.base_url}{ip}") as response:
+            if response.status != 200:
+                return None
+            data = await response.json()
+            if data.get("status") == "fail":
+                return None
+            return data
+
+class GeoLocator:
+    """Shared-session IP geolocation with an LRU+TTL cache.
+
+    Failed lookups are cached for ``negative_ttl`` seconds, and concurrent
+    lookups of the same IP share one request.
+    """
+
+    def __init__(self, provider: Optional[GeoProvider] = None, cache_size: int = 1024,
+                 ttl: float = 3600.0, negative_ttl: float = 300.0, timeout: float = 5.0):
+        self.provider = provider or IPAPIProvider()
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.cache: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+    
+    def _cached(self, ip: str) -> Tuple[bool, Optional[Dict]]:
+        entry = self.cache.get(ip)
+        if entry is None:
+            return False, None
+        expires, location = entry
+        if expires < time.monotonic():
+            del self.cache[ip]
+            return False, None
+        self.cache.move_to_end(ip)
+        return True, location
+    
+    def _store(self, ip: str, location: Optional[Dict]):
+        ttl = self.ttl if location is not None else self.negative_ttl
+        self.cache[ip] = (time.monotonic() + ttl, location)
+        self.cache.move_to_end(ip)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+    
+    async def locate(self, ip: str) -> Optional[Dict]:
+        """Get the location of an IP, or None if it cannot be resolved"""
+        while True:
+            hit, location = self._cached(ip)
+            if hit:
+                return location
+            inflight = self._inflight.get(ip)
+            if inflight is None:
+                break
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                if not inflight.cancelled():
+                    raise
+                # The caller doing the lookup was cancelled; look it up ourselves
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[ip] = future
+        try:
+            try:
+                location = await self.provider.lookup(self._get_session(), ip)
+            except Exception as e:
+                print(f"Error fetching IP location: {e}")
+                location = None
+            self._store(ip, location)
+            future.set_result(location)
+            return location
+        finally:
+            del self._inflight[ip]
+            if not future.done():
+                # Cancelled mid-lookup; release the callers waiting on it
+                future.cancel()
+    
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
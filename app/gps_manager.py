@@ -1,75 +1,69 @@
-from typing import Dict, List, Optional
-import json
+from typing import List, Optional, Set
 import asyncio
 from datetime import datetime
-import os
-from dataclasses import dataclass
-import aiohttp
-from fastapi import HTTPException
-
-@dataclass
-class GPSData:
-    device: str
-    latitude: float
-    longitude: float
-    timestamp: str
-    ip_location: Optional[Dict] = None
+from .data_manager import data_manager, DataManager, GPSData
+from .geolocation import GeoLocator
 
 class GPSManager:
-    def __init__(self, file_path: str = "app/gps.json"):
-        self.file_path = file_path
-        self.gps_data: List[GPSData] = []
-        self.lock = asyncio.Lock()
-        self._load_data()
-    
-    def _load_data(self):
-        """Load GPS data from JSON file"""
-        if os.path.exists(self.file_path):
-            with open(self.file_path, 'r') as f:
-                data = json.load(f)
-                self.gps_data = [GPSData(**entry) for entry in data]
-    
-    def _save_data(self):
-        """Save GPS data to JSON file"""
-        with open(self.file_path, 'w') as f:
-            json.dump([vars(entry) for entry in self.gps_data], f, indent=2)
+    """Records GPS fixes enriched with IP location through the DataManager"""
+
+    def __init__(self, data: DataManager, locator: Optional[GeoLocator] = None):
+        self.data = data
+        self.locator = locator or GeoLocator()
+        self._enrichments: Set[asyncio.Task] = set()
     
-    async def add_gps_data(self, device: str, latitude: float, longitude: float, ip: Optional[str] = None) -> GPSData:
-        """Add new GPS data with optional IP location"""
-        async with self.lock:
-            ip_location = None
-            if ip:
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(f"http://ip-api.com/json/{ip}") as response:
-                            if response.status == 200:
-                                ip_location = await response.json()
-                except Exception as e:
-                    print(f"Error fetching IP location: {e}")
-            
-            gps_entry = GPSData(
-                device=device,
-                latitude=latitude,
-                longitude=longitude,
-                timestamp=datetime.now().isoformat(),
-                ip_location=ip_location
-            )
-            
-            self.gps_data.append(gps_entry)
-            # Keep only last 1000 entries
-            if len(self.gps_data) > 1000:
-                self.gps_data = self.gps_data[-1000:]
-            
-            self._save_data()
+    async def add_gps_data(self, device: str, latitude: float, longitude: float, ip: Optional[str] = None,
+                           timestamp: Optional[str] = None) -> GPSData:
+        """Add new GPS data; the IP location is filled in before it is persisted"""
+        gps_entry = GPSData(
+            device=device,
+            latitude=latitude,
+            longitude=longitude,
+            timestamp=timestamp or datetime.now().isoformat()
+        )
+        
+        if not ip:
+            await self.data.add_gps_data(gps_entry)
             return gps_entry
+        
+        # Visible to readers now, written once the location is known; its
+        # room in the ingest buffer is held until then
+        await self.data.track_gps_data(gps_entry)
+        self.data.pipeline.reserve("gps")
+        task = asyncio.create_task(self._enrich(gps_entry, ip))
+        self._enrichments.add(task)
+        task.add_done_callback(self._enrichments.discard)
+        return gps_entry
+    
+    async def _enrich(self, gps_entry: GPSData, ip: str):
+        """Attach the IP location to an entry and persist it"""
+        try:
+            gps_entry.ip_location = await self.locator.locate(ip)
+        finally:
+            await self.data.persist_gps_data(gps_entry)
+            self.data.pipeline.release("gps")
     
     def get_device_locations(self, device: str, limit: int = 10) -> List[GPSData]:
         """Get recent GPS locations for a device"""
-        return [entry for entry in self.gps_data if entry.device == device][-limit:]
+        return [GPSData(**entry) for entry in self.data.tracks.recent(device, limit)]
     
     def get_all_locations(self, limit: int = 100) -> List[GPSData]:
-        """Get recent GPS locations for all devices"""
-        return self.gps_data[-limit:]
+        """Get the latest GPS location of each recently seen device"""
+        return [GPSData(**entry) for entry in self.data.tracks.latest_positions(limit)]
+    
+    async def close(self, timeout: float = 5.0):
+        """Wait for pending enrichments and release the HTTP session.
+
+        Lookups still running after ``timeout`` seconds are cancelled; their
+        fixes are persisted without a location.
+        """
+        if self._enrichments:
+            pending = list(self._enrichments)
+            _, unfinished = await asyncio.wait(pending, timeout=timeout)
+            for task in unfinished:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await self.locator.close()
 
 # Global GPS manager instance
-gps_manager = GPSManager() 
\ No newline at end of file
+gps_manager = GPSManager(data_manager)
@@ -0,0 +1,50 @@
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+from .metrics import metrics
+
+class IOExecutor:
+    """Bounded thread pool for blocking file I/O.
+
+    At most ``max_queue`` jobs may be submitted at once; further callers wait
+    for a slot, which applies backpressure to ingest instead of letting
+    pending writes pile up in memory.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 64, thread_name_prefix: str = "io"):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.thread_name_prefix = thread_name_prefix
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.pending = 0
+    
+    def _ensure_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_queue)
+    
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run ``func`` on the I/O pool and return its result"""
+        self._ensure_pool()
+        async with self._slots:
+            self.pending += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+            finally:
+                self.pending -= 1
+    
+    def shutdown(self):
+        """Wait for running jobs and release the worker threads"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self._slots = None
+
+# Global I/O executor instance
+io_executor = IOExecutor()
+metrics.gauge("io_pending_jobs", "Jobs queued or running on the I/O executor",
+              func=lambda: io_executor.pending)
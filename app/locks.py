@@ -0,0 +1,79 @@
+from typing import Dict
+from contextlib import asynccontextmanager
+import asyncio
+import time
+from .metrics import metrics
+
+LOCK_WAIT = metrics.histogram("lock_wait_seconds", "Time spent acquiring a lock", ("lock",))
+
+class RWLock:
+    """Asyncio reader/writer lock that records time spent waiting.
+
+    Any number of readers may hold the lock together; a writer holds it
+    alone. Waiting writers block new readers so they cannot be starved.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._cond = asyncio.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+    
+    def _record(self, started: float, waited: bool):
+        self.acquisitions += 1
+        if waited or metrics.enabled:
+            elapsed = time.perf_counter() - started
+            LOCK_WAIT.observe(elapsed, lock=self.name)
+            if waited:
+                self.contended += 1
+                self.wait_seconds += elapsed
+    
+    @asynccontextmanager
+    async def reader(self):
+        """Hold the lock shared with other readers"""
+        started = time.perf_counter()
+        async with self._cond:
+            waited = self._writer or self._waiting_writers > 0
+            await self._cond.wait_for(lambda: not self._writer and self._waiting_writers == 0)
+            self._readers += 1
+        self._record(started, waited)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._cond.notify_all()
+    
+    @asynccontextmanager
+    async def writer(self):
+        """Hold the lock exclusively"""
+        started = time.perf_counter()
+        async with self._cond:
+            waited = self._writer or self._readers > 0
+            self._waiting_writers += 1
+            try:
+                await self._cond.wait_for(lambda: not self._writer and self._readers == 0)
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+        self._record(started, waited)
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+    
+    def stats(self) -> Dict:
+        """Acquisition and wait-time counters for this lock"""
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_seconds": round(self.wait_seconds, 6),
+        }
@@ -0,0 +1,136 @@
+from typing import Dict, List, Optional, Tuple
+from bisect import bisect_left, bisect_right, insort
+import math
+from .track_store import to_epoch
+
+class Postings:
+    """Sequence numbers of matching entries in ingest order, plus their
+    ``(timestamp, seq)`` pairs kept sorted by time.
+
+    Timestamps do not follow ingest order: collapsed repeats are stored
+    when their window closes and other workers' entries arrive late, so
+    time ranges are looked up in the time-sorted list.
+    """
+
+    __slots__ = ("seqs", "times", "by_time", "start")
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.times: List[float] = []
+        self.by_time: List[Tuple[float, int]] = []
+        self.start = 0  # entries before this offset have been evicted
+    
+    def add(self, seq: int, timestamp: float):
+        self.seqs.append(seq)
+        self.times.append(timestamp)
+        insort(self.by_time, (timestamp, seq))
+    
+    def evict_through(self, seq: int):
+        """Forget entries with a sequence number up to ``seq``"""
+        end = max(self.start, bisect_right(self.seqs, seq, self.start))
+        for i in range(self.start, end):
+            del self.by_time[bisect_left(self.by_time, (self.times[i], self.seqs[i]))]
+        self.start = end
+        # Trim lazily so eviction stays amortized O(1)
+        if self.start > 1024 and self.start * 2 > len(self.seqs):
+            del self.seqs[:self.start]
+            del self.times[:self.start]
+            self.start = 0
+    
+    def __len__(self):
+        return len(self.seqs) - self.start
+    
+    def select(self, after: Optional[int], since: Optional[float], until: Optional[float],
+               limit: int) -> List[int]:
+        """Up to ``limit`` sequence numbers within [since, until], in ingest order.
+
+        With cursor ``after`` these are the first ones after it; without a
+        cursor they are the newest ones.
+        """
+        if since is None and until is None:
+            if after is None:
+                return self.seqs[max(self.start, len(self.seqs) - limit):]
+            lo = max(self.start, bisect_right(self.seqs, after, self.start))
+            return self.seqs[lo:lo + limit]
+        lo = 0 if since is None else bisect_left(self.by_time, (since,))
+        hi = len(self.by_time) if until is None else bisect_right(self.by_time, (until, math.inf), lo)
+        seqs = sorted(seq for _, seq in self.by_time[lo:hi] if after is None or seq > after)
+        return seqs[:limit] if after is not None else seqs[-limit:]
+
+class LogIndex:
+    """Secondary indexes over retained log entries.
+
+    Every entry carries a monotonically increasing ``seq`` used as the
+    pagination cursor. Postings per device, level and (device, level) keep
+    entries in ingest order, so a filtered page is a bisection plus a
+    slice, O(log n + k); a time range is two bisections of the time-sorted
+    list and a sort of the k entries inside it.
+    """
+
+    def __init__(self, retention: int = 1000):
+        self.retention = retention
+        self.entries: Dict[int, Dict] = {}
+        self.all = Postings()
+        self.by_device: Dict[str, Postings] = {}
+        self.by_level: Dict[str, Postings] = {}
+        self.by_device_level: Dict[Tuple[str, str], Postings] = {}
+        self.last_seq = 0
+        self._oldest = 1
+    
+    def next_seq(self) -> int:
+        self.last_seq += 1
+        return self.last_seq
+    
+    def add(self, entry: Dict):
+        """Index an entry; entries without a ``seq`` get the next one"""
+        if "seq" not in entry:
+            entry["seq"] = self.next_seq()
+        seq = entry["seq"]
+        self.last_seq = max(self.last_seq, seq)
+        timestamp = to_epoch(entry["timestamp"])
+        device, level = entry["device"], entry["level"]
+        
+        self.entries[seq] = entry
+        self.all.add(seq, timestamp)
+        self.by_device.setdefault(device, Postings()).add(seq, timestamp)
+        self.by_level.setdefault(level, Postings()).add(seq, timestamp)
+        self.by_device_level.setdefault((device, level), Postings()).add(seq, timestamp)
+        
+        if len(self.entries) > self.retention:
+            self._evict()
+    
+    def _evict(self):
+        while len(self.entries) > self.retention:
+            oldest = self.all.seqs[self.all.start]
+            entry = self.entries.pop(oldest)
+            self.all.evict_through(oldest)
+            for postings, key in (
+                (self.by_device, entry["device"]),
+                (self.by_level, entry["level"]),
+                (self.by_device_level, (entry["device"], entry["level"])),
+            ):
+                postings[key].evict_through(oldest)
+                if not postings[key]:
+                    del postings[key]
+    
+    def recent(self, limit: int = 100) -> List[Dict]:
+        """The last ``limit`` entries, oldest first"""
+        start = max(self.all.start, len(self.all.seqs) - limit)
+        return [self.entries[seq] for seq in self.all.seqs[start:]]
+    
+    def query(self, device: Optional[str] = None, level: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None,
+              cursor: Optional[int] = None, limit: int = 100) -> List[Dict]:
+        """Entries matching the filters after ``cursor`` (the newest ones
+        without a cursor), oldest first"""
+        if device and level:
+            postings = self.by_device_level.get((device, level))
+        elif device:
+            postings = self.by_device.get(device)
+        elif level:
+            postings = self.by_level.get(level)
+        else:
+            postings = self.all
+        if not postings:
+            return []
+        return [self.entries[seq] for seq in postings.select(cursor, since, until, limit)]
@@ -1,22 +1,30 @@
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, HTTPException, Query, Body
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import List, Dict, Set, Optional
+from typing import List, Dict, Optional
 import os
-from pathlib import Path
-import asyncio
 import json
-import csv
-import io
-from .device_manager import device_manager, DeviceType, DeviceStatus
-from .log_manager import log_manager, LogLevel
-from .gps_manager import gps_manager, GPSData
-from twilio.rest import Client
+import time
+from .device_manager import device_manager, DeviceType
+from .gps_manager import gps_manager
 from pydantic import BaseModel
-from .data_manager import data_manager, DeviceStatus, GPSData
+from .data_manager import data_manager, DeviceStatus, GPSData as GPSRecord
+from .pipeline import IngestSaturated
+from .track_store import parse_time
+from .io_executor import io_executor
+from .broadcaster import broadcaster
+from .pubsub import pubsub, PubSubUnavailable
+from .connection_manager import connection_manager
+from .export import EXPORT_FORMATS, filtered_records
+from .dashboard import dashboard_cache
+from .auth import device_auth
+from .metrics import metrics, MetricsMiddleware
+from .event_bus import event_bus, Lane
+from .notifications import notifier
 
 # Create app directory if it doesn't exist
 os.makedirs("app/static", exist_ok=True)
@@ -33,19 +41,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request timing is only wired in when metrics are enabled
+if metrics.enabled:
+    app.add_middleware(MetricsMiddleware, registry=metrics)
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 templates = Jinja2Templates(directory="app/templates")
 
-# Initialize Twilio client
-# twilio_client = Client(
-#     os.getenv("TWILIO_ACCOUNT_SID"),
-#     os.getenv("TWILIO_AUTH_TOKEN")
-# )
-
-# WebSocket connections
-active_connections: Set[WebSocket] = set()
-
 class DrunkenAlert(BaseModel):
     uuid: str
     alcohol_level: int
@@ -57,22 +60,76 @@ class GPSData(BaseModel):
     longitude: float
     ip: Optional[str] = None
 
+class GPSFix(BaseModel):
+    device: str
+    latitude: float
+    longitude: float
+    timestamp: Optional[str] = None
+
 class LogEntry(BaseModel):
     device: str
     level: str
     message: str
     timestamp: Optional[str] = None
 
-async def broadcast_event(event_type: str, data: Dict):
+def publish_event(event_type: str, data: Dict):
+    """Record an event for the dashboard cache and fan it out to dashboards"""
+    version = dashboard_cache.record(event_type, data)
+    broadcaster.publish(event_type, data, version, device_manager.group_of(data.get("device")))
+
+def broadcast_event(event_type: str, data: Dict):
     """Broadcast event to all connected WebSocket clients"""
-    for connection in active_connections:
-        try:
-            await connection.send_json({
-                "type": event_type,
-                "data": data
-            })
-        except:
-            active_connections.remove(connection)
+    event_bus.submit(Lane.NOTIFY, publish_event, event_type, data)
+
+def relay_stored_record(stream: str, record: Dict):
+    """Push records stored by other workers to this worker's dashboards"""
+    if stream == "logs":
+        broadcast_event("log_update", record)
+    elif stream == "gps":
+        broadcast_event("gps_update", {
+            "device": record["device"],
+            "latitude": record["latitude"],
+            "longitude": record["longitude"],
+            "timestamp": record["timestamp"]
+        })
+    elif stream == "status":
+        broadcast_event("status_update", {
+            "device": record["uuid"],
+            "status": record["status"],
+            "timestamp": record["timestamp"]
+        })
+
+def authenticate(request: Request, device: str):
+    """Reject the request unless it may act as ``device``"""
+    device_auth.check(device, request.headers, request.query_params)
+
+@asynccontextmanager
+async def admission(stream: str, level: Optional[str] = None, count: int = 1):
+    """Hold room in a stream's ingest buffer while records are submitted, or answer 429 when it is saturated"""
+    try:
+        await data_manager.pipeline.admit(stream, level, count)
+    except IngestSaturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    try:
+        yield
+    finally:
+        data_manager.pipeline.release(stream, count)
+
+def check_time_range(since: Optional[str], until: Optional[str]):
+    """Reject ``since``/``until`` values that are neither ISO timestamps nor epoch seconds"""
+    for name, value in (("since", since), ("until", until)):
+        if value:
+            try:
+                parse_time(value)
+            except ValueError:
+                raise HTTPException(status_code=422, detail=f"Invalid {name}: {value}")
+
+async def log_event(device: str, level: str, message: str, metadata: Optional[Dict] = None):
+    """Add a log entry and push it to the dashboards"""
+    entry = await data_manager.add_log(device, level, message, metadata)
+    # A repeat folded into an entry is pushed again with its new count, so
+    # the dashboard version moves and the row is updated in place
+    broadcast_event("log_update", entry)
 
 # Custom datetime filter for Jinja2
 def format_datetime(value, format="%Y-%m-%d %H:%M:%S"):
@@ -89,68 +146,102 @@ def format_datetime(value, format="%Y-%m-%d %H:%M:%S"):
 
 templates.env.filters["datetime"] = format_datetime
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}  # device_id -> WebSocket
-
-    async def connect(self, device_id: str, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections[device_id] = websocket
-
-    def disconnect(self, device_id: str):
-        if device_id in self.active_connections:
-            del self.active_connections[device_id]
-
-    async def send_to_device(self, device_id: str, message: str):
-        if device_id in self.active_connections:
-            await self.active_connections[device_id].send_text(message)
-
-manager = ConnectionManager()
+# Devices shown per dashboard page, and sent to a /ws subscriber when it connects
+DASHBOARD_PAGE_SIZE = 100
+MAX_DASHBOARD_PAGE_SIZE = 1000
 
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
-    active_connections.add(websocket)
-    # Send current status for helmet and bike on connect
-    helmet_status = await data_manager.get_device_status("helmet-001")
-    bike_status = await data_manager.get_device_status("bike-001")
-    if helmet_status:
-        await websocket.send_json({
-            "type": "status_update",
-            "data": {
-                "device": "helmet-001",
-                "status": helmet_status.status,
-                "timestamp": helmet_status.timestamp
-            }
-        })
-    if bike_status:
-        await websocket.send_json({
-            "type": "status_update",
-            "data": {
-                "device": "bike-001",
-                "status": bike_status.status,
-                "timestamp": bike_status.timestamp
-            }
-        })
+async def websocket_endpoint(
+    websocket: WebSocket,
+    group: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=MAX_DASHBOARD_PAGE_SIZE)
+):
+    """Dashboard event stream, optionally limited to one device group"""
+    await broadcaster.connect(websocket, group)
+    # Send current status for the page of devices being viewed on connect
+    page = [device.uuid for device in device_manager.list_devices(group=group, offset=offset, limit=limit)]
+    statuses = await data_manager.get_device_statuses(page)
+    for uuid in page:
+        status = statuses.get(uuid)
+        if status:
+            broadcaster.send(websocket, "status_update", {
+                "device": uuid,
+                "status": status.status,
+                "timestamp": status.timestamp
+            })
     try:
         while True:
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        active_connections.remove(websocket)
+        broadcaster.disconnect(websocket)
+
+PAIRING_CHANNEL = "pairings"
+REGISTRATION_CHANNEL = "registrations"
+
+async def apply_pairing(message: Dict):
+    """Apply a pairing change published by any worker"""
+    data_manager.apply_pairing(message)
+
+async def apply_registration(message: Dict):
+    """Apply a device registration published by any worker"""
+    data_manager.apply_registration(message)
+
+async def announce(channel: str, message: Dict):
+    """Tell the other workers about a change this one has already stored.
+
+    If the broker is unreachable they still pick it up from a shared store.
+    """
+    try:
+        await pubsub.publish(channel, message)
+    except PubSubUnavailable as e:
+        print(f"Error announcing on {channel}: {e}")
+
+async def command_paired_bike(helmet_uuid: str, command: str):
+    """Send a command to the bike paired with a helmet"""
+    bike_uuid = device_manager.get_paired_bike(helmet_uuid)
+    if bike_uuid:
+        await connection_manager.send_to_device(bike_uuid, command)
+
+async def sync_bike(bike_uuid: str):
+    """Send a (re)connected bike the command matching its helmet's current status"""
+    helmet_uuid = device_manager.get_paired_helmet(bike_uuid)
+    status = await data_manager.get_device_status(helmet_uuid) if helmet_uuid else None
+    if status:
+        await connection_manager.send_to_device(bike_uuid, "304" if status.status == "drunken" else "302")
 
 @app.on_event("startup")
 async def startup_event():
-    # Start log processing task
-    asyncio.create_task(log_manager.process_logs())
+    data_manager.listeners.append(relay_stored_record)
+    await data_manager.start()
+    await event_bus.start()
+    await notifier.start()
+    await pubsub.subscribe(PAIRING_CHANNEL, apply_pairing)
+    await pubsub.subscribe(REGISTRATION_CHANNEL, apply_registration)
+    await connection_manager.start()
+    await pubsub.start()
+
+# Seconds shutdown waits for queued events, location lookups and in-flight
+# writes before flushing what is buffered and exiting
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", "10"))
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    await log_manager.stop()
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+    remaining = lambda: max(0.0, deadline - time.monotonic())
+    await event_bus.stop(timeout=remaining())
+    await broadcaster.close()
+    await gps_manager.close(timeout=remaining())
+    await notifier.close()
+    await data_manager.close(timeout=remaining())
+    await pubsub.close()
+    io_executor.shutdown()
 
 @app.post("/drunken")
-async def drunken_alert(uuid: str, alcohol_level: int, timestamp: str):
+async def drunken_alert(request: Request, uuid: str, alcohol_level: int, timestamp: str):
     """Handle alcohol detection alert"""
+    authenticate(request, uuid)
     status = DeviceStatus(
         uuid=uuid,
         status="drunken",
@@ -158,52 +249,54 @@ async def drunken_alert(uuid: str, alcohol_level: int, timestamp: str):
         alcohol_level=alcohol_level
     )
     
-    await data_manager.update_device_status(status)
-    await data_manager.add_log(uuid, "SECURITY", f"Alcohol detected: {alcohol_level}")
+    # The status is recorded first, so a stalled bike socket cannot keep it
+    # from being stored; the stop command then goes out ahead of the alert
+    # log, notifications and dashboards
+    changed = await data_manager.update_device_status(status)
+    await event_bus.dispatch(Lane.COMMAND, command_paired_bike, uuid, "304")
+    await event_bus.dispatch(Lane.PERSIST, log_event, uuid, "SECURITY", f"Alcohol detected: {alcohol_level}",
+                             {"status": "drunken", "alcohol_level": alcohol_level})
     
-    # Send SMS alert
-    # try:
-    #     twilio_client.messages.create(
-    #         body=f"🚨 ALERT: Alcohol detected in helmet {uuid} (Level: {alcohol_level})",
-    #         from_=os.getenv("TWILIO_PHONE_NUMBER"),
-    #         to=os.getenv("ALERT_PHONE_NUMBER")
-    #     )
-    # except Exception as e:
-    #     await data_manager.add_log(uuid, "ERROR", f"Failed to send SMS: {str(e)}")
+    # Queue the SMS alert; notification workers send and retry it
+    notifier.alert(uuid, f"🚨 ALERT: Alcohol detected in helmet {uuid} (Level: {alcohol_level})")
     
     # Broadcast status update
-    await broadcast_event("status_update", {
-        "device": uuid,
-        "status": "drunken",
-        "timestamp": timestamp
-    })
-    
-    # Send 304 to bike to block it
-    await manager.send_to_device("bike-001", "304")
+    if changed:
+        broadcast_event("status_update", {
+            "device": uuid,
+            "status": "drunken",
+            "timestamp": timestamp
+        })
     
     return {"status": "alert processed"}
 
 @app.get("/not_drunken")
-async def not_drunken(uuid: str = Query(...)):
+async def not_drunken(request: Request, uuid: str = Query(...)):
     """Handle safe helmet status update"""
+    authenticate(request, uuid)
     status = DeviceStatus(
         uuid=uuid,
         status="not_drunken",
         timestamp=datetime.now().isoformat()
     )
     
-    await data_manager.update_device_status(status)
-    await data_manager.add_log(uuid, "ACTION", "Helmet status: Safe")
-    
-    # Send 302 to bike to allow it
-    await manager.send_to_device("bike-001", "302")
+    # Record the status, then send 302 to bike to allow it before persisting
+    # or notifying. A bike already sent 302 is not told again, but one whose
+    # 302 failed or timed out is; sync_bike covers reconnects
+    changed = await data_manager.update_device_status(status)
+    bike_uuid = device_manager.get_paired_bike(uuid)
+    if changed or (bike_uuid and connection_manager.last_command(bike_uuid) != "302"):
+        await event_bus.dispatch(Lane.COMMAND, command_paired_bike, uuid, "302")
+    await event_bus.dispatch(Lane.PERSIST, log_event, uuid, "ACTION", "Helmet status: Safe",
+                             {"status": "not_drunken"})
     
     # Broadcast status update
-    await broadcast_event("status_update", {
-        "device": uuid,
-        "status": "not_drunken",
-        "timestamp": status.timestamp
-    })
+    if changed:
+        broadcast_event("status_update", {
+            "device": uuid,
+            "status": "not_drunken",
+            "timestamp": status.timestamp
+        })
     
     return {"status": "updated"}
 
@@ -230,19 +323,15 @@ async def bike_webhook(uuid: str = Query(...)):
     )
 
 @app.post("/GPS")
-async def update_gps(device: str, latitude: float, longitude: float, timestamp: str):
-    """Update GPS location"""
-    gps_data = GPSData(
-        device=device,
-        latitude=latitude,
-        longitude=longitude,
-        timestamp=timestamp
-    )
-    
-    await data_manager.add_gps_data(gps_data)
+async def update_gps(request: Request, device: str, latitude: float, longitude: float, timestamp: str,
+                     ip: Optional[str] = None):
+    """Update GPS location; with ``ip`` the fix is stored with that address's location"""
+    authenticate(request, device)
+    async with admission("gps"):
+        await gps_manager.add_gps_data(device, latitude, longitude, ip=ip, timestamp=timestamp)
     
     # Broadcast GPS update
-    await broadcast_event("gps_update", {
+    broadcast_event("gps_update", {
         "device": device,
         "latitude": latitude,
         "longitude": longitude,
@@ -251,86 +340,337 @@ async def update_gps(device: str, latitude: float, longitude: float, timestamp:
     
     return {"status": "updated"}
 
+def parse_gps_batch(body: bytes, content_type: str) -> List[GPSFix]:
+    """Parse a JSON array or NDJSON body of GPS fixes"""
+    try:
+        if "ndjson" in content_type:
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            items = json.loads(body)
+        if not isinstance(items, list):
+            raise ValueError("expected an array of fixes")
+        return [GPSFix(**item) for item in items]
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Invalid GPS batch: {e}")
+
+@app.post("/GPS/batch")
+async def update_gps_batch(request: Request):
+    """Ingest many GPS fixes at once (JSON array or application/x-ndjson)"""
+    fixes = parse_gps_batch(await request.body(), request.headers.get("content-type", ""))
+    for device in {fix.device for fix in fixes}:
+        authenticate(request, device)
+    now = datetime.now().isoformat()
+    batch = [
+        GPSRecord(
+            device=fix.device,
+            latitude=fix.latitude,
+            longitude=fix.longitude,
+            timestamp=fix.timestamp or now
+        )
+        for fix in fixes
+    ]
+    async with admission("gps", count=len(batch)):
+        await data_manager.add_gps_batch(batch)
+    
+    # Broadcast only the newest fix per device
+    latest = {record.device: record for record in batch}
+    for record in latest.values():
+        broadcast_event("gps_update", {
+            "device": record.device,
+            "latitude": record.latitude,
+            "longitude": record.longitude,
+            "timestamp": record.timestamp
+        })
+    
+    return {"status": "updated", "count": len(batch)}
+
+@app.get("/api/gps/nearby")
+async def gps_nearby(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0),
+    type: Optional[DeviceType] = None,
+    limit: int = Query(10, ge=1, le=1000)
+):
+    """Devices nearest to a point by their latest fix, optionally of one type"""
+    if type is None:
+        devices = await data_manager.find_nearby(latitude, longitude, limit, radius_km)
+    else:
+        # Over-fetch, then keep the devices of the requested type
+        candidates = await data_manager.find_nearby(latitude, longitude, limit * 4, radius_km)
+        devices = [d for d in candidates if device_manager.type_of(d["device"]) == type][:limit]
+    return {"devices": devices}
+
+@app.get("/api/gps/within")
+async def gps_within(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(1000, ge=1, le=10000)
+):
+    """Devices whose latest fix lies inside a bounding box"""
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=422, detail="min_lat/min_lon must not exceed max_lat/max_lon")
+    return {"devices": await data_manager.find_within(min_lat, min_lon, max_lat, max_lon, limit)}
+
+@app.get("/api/gps/{device}/trips")
+async def gps_trips(device: str, limit: int = Query(10, ge=1, le=50)):
+    """A device's most recent trips, split where its track has a time gap"""
+    return {"device": device, "trips": await data_manager.get_trips(device, limit)}
+
 @app.post("/log")
-async def add_log(log: LogEntry = Body(...)):
+async def add_log(request: Request, log: LogEntry = Body(...)):
     """Add new log entry"""
-    await data_manager.add_log(log.device, log.level, log.message)
+    authenticate(request, log.device)
+    async with admission("logs", log.level):
+        await log_event(log.device, log.level, log.message)
     return {"status": "logged"}
 
 @app.post("/PostLogs")
-async def post_logs(log: LogEntry = Body(...)):
+async def post_logs(request: Request, log: LogEntry = Body(...)):
     """Add new log entry"""
+    authenticate(request, log.device)
     # If no timestamp provided, use current time
     if not log.timestamp:
         log.timestamp = datetime.now().isoformat()
     
-    await data_manager.add_log(log.device, log.level, log.message)
+    async with admission("logs", log.level):
+        await log_event(log.device, log.level, log.message)
     return {"status": "logged"}
 
-@app.get("/dashboard")
-async def dashboard(request: Request):
-    """Render dashboard with current status and GPS data"""
-    # Get recent logs
+async def dashboard_snapshot(group: Optional[str] = None, offset: int = 0,
+                             limit: int = DASHBOARD_PAGE_SIZE) -> Dict:
+    """Current dashboard state: recent logs and the status and GPS of a page of devices"""
     logs = await data_manager.get_recent_logs()
+    if group is not None:
+        logs = [log for log in logs if device_manager.group_of(log["device"]) == group]
     
-    # Get recent GPS data for both devices
-    helmet_gps = await data_manager.get_recent_gps_data("helmet-001", limit=1)
-    bike_gps = await data_manager.get_recent_gps_data("bike-001", limit=1)
+    devices = []
+    page = device_manager.list_devices(group=group, offset=offset, limit=limit)
+    statuses = await data_manager.get_device_statuses([device.uuid for device in page])
+    for device in page:
+        gps = await data_manager.get_recent_gps_data(device.uuid, limit=1)
+        status = statuses.get(device.uuid)
+        devices.append({
+            "device": device.uuid,
+            "type": device.type.value,
+            "group": device.group,
+            "status": status.status if status else "unknown",
+            "gps": gps[0] if gps else None
+        })
     
-    # Get current status for both devices
-    helmet_status = await data_manager.get_device_status("helmet-001")
-    bike_status = await data_manager.get_device_status("bike-001")
+    return {
+        "logs": logs,
+        "devices": devices,
+        "total": device_manager.count(group=group),
+        "group": group,
+        "offset": offset,
+        "limit": limit
+    }
+
+@app.get("/dashboard")
+async def dashboard(
+    request: Request,
+    group: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=MAX_DASHBOARD_PAGE_SIZE)
+):
+    """Render the dashboard for a page of devices, optionally in one group"""
+    etag = dashboard_cache.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
     
-    return templates.TemplateResponse(
-        "dashboard.html",
-        {
-            "request": request,
-            "logs": logs,
-            "helmet_gps": helmet_gps[0] if helmet_gps else None,
-            "bike_gps": bike_gps[0] if bike_gps else None,
-            "helmet_status": helmet_status.status if helmet_status else "unknown",
-            "bike_status": bike_status.status if bike_status else "unknown",
-            "last_update": datetime.now().isoformat()
+    # Only the default view is cached; other pages are rendered per request
+    default_view = group is None and offset == 0 and limit == DASHBOARD_PAGE_SIZE
+    body = dashboard_cache.page() if default_view else None
+    if body is None:
+        version = dashboard_cache.version
+        context = await dashboard_snapshot(group, offset, limit)
+        body = templates.TemplateResponse(
+            "dashboard.html",
+            {
+                "request": request,
+                **context,
+                "dashboard_version": version,
+                "dashboard_instance": dashboard_cache.instance,
+                "last_update": datetime.now().isoformat()
+            }
+        ).body
+        if default_view:
+            dashboard_cache.store_page(body, version)
+        headers["ETag"] = f'"{dashboard_cache.instance}-{version}"'
+    return HTMLResponse(body, headers=headers)
+
+@app.get("/api/dashboard/delta")
+async def dashboard_delta(
+    since: int = 0,
+    instance: Optional[str] = None,
+    group: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DASHBOARD_PAGE_SIZE, ge=1, le=MAX_DASHBOARD_PAGE_SIZE)
+):
+    """Changes since a dashboard version, or a full snapshot if they are gone"""
+    events = None
+    if instance in (None, dashboard_cache.instance):
+        events = dashboard_cache.delta(since)
+    if events is not None:
+        if group is not None:
+            events = [event for event in events
+                      if device_manager.group_of(event["data"].get("device")) == group]
+        return {"instance": dashboard_cache.instance, "version": dashboard_cache.version, "events": events}
+    version = dashboard_cache.version
+    return {
+        "instance": dashboard_cache.instance,
+        "version": version,
+        "snapshot": await dashboard_snapshot(group, offset, limit)
+    }
+
+@app.get("/api/logs")
+async def query_logs(
+    device: Optional[str] = None,
+    level: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """The newest matching logs; pass the returned cursor to get only newer entries"""
+    check_time_range(since, until)
+    logs = await data_manager.query_logs(device, level, since, until, cursor, limit)
+    return {
+        "logs": logs,
+        "cursor": logs[-1]["seq"] if logs else cursor
+    }
+
+@app.get("/api/rollups")
+async def rollups(
+    device: Optional[str] = None,
+    resolution: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """Alcohol and activity rollups of a device, or of the fleet when no device is given"""
+    check_time_range(since, until)
+    buckets = await data_manager.get_rollups(device, resolution, since, until)
+    return {"device": device, "resolution": resolution, "buckets": buckets}
+
+@app.get("/api/rollups/summary")
+async def rollup_summary(
+    resolution: str = Query("1h", pattern="^(1m|1h|1d)$"),
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """Per-device rollup totals over a time range"""
+    check_time_range(since, until)
+    devices = await data_manager.get_rollup_summary(resolution, since, until)
+    return {"resolution": resolution, "devices": devices}
+
+@app.get("/stats/locks")
+async def lock_stats():
+    """Time spent waiting on each DataManager lock"""
+    return data_manager.lock_stats()
+
+@app.get("/stats/ingest")
+async def ingest_stats():
+    """Records waiting to be written, room reserved and records shed, per stream"""
+    pipeline = data_manager.pipeline
+    return {
+        stream: {
+            "pending": pipeline.pending.get(stream, 0),
+            "reserved": pipeline.reserved.get(stream, 0),
+            "max_pending": limit.max_pending,
+            "policy": limit.policy,
+            "shed": pipeline.shed.get(stream, 0),
         }
-    )
+        for stream, limit in pipeline.limits.items()
+    }
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics, when enabled with METRICS_ENABLED"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/export/logs")
-async def export_logs(format: str = "json"):
-    """Export logs in JSON or CSV format"""
-    logs = log_manager.get_recent_logs(limit=1000)
+async def export_logs(
+    format: str = "json",
+    device: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
+    """Stream persisted logs as JSON, CSV, NDJSON or gzip columnar row groups"""
+    if format.lower() not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format: {format}")
+    check_time_range(since, until)
+    encoder, media_type, filename = EXPORT_FORMATS[format.lower()]
     
-    if format.lower() == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Timestamp", "Device", "Level", "Message"])
-        for log in logs:
-            writer.writerow([
-                log.timestamp,
-                log.device,
-                log.level,
-                log.message
-            ])
-        return StreamingResponse(
-            iter([output.getvalue()]),
-            media_type="text/csv",
-            headers={"Content-Disposition": "attachment; filename=logs.csv"}
-        )
-    else:
-        return JSONResponse(
-            content=[vars(log) for log in logs],
-            headers={"Content-Disposition": "attachment; filename=logs.json"}
-        )
+    # Make sure everything logged so far is on disk
+    await data_manager.pipeline.flush()
+    chunks = filtered_records(data_manager.logs_log, device, since, until)
+    return StreamingResponse(
+        encoder(chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+@app.post("/pair")
+async def pair_devices(request: Request, helmet: str, bike: Optional[str] = None):
+    """Pair a helmet with a bike, or unpair it when no bike is given"""
+    device_auth.check_admin(request.headers, request.query_params)
+    await announce(PAIRING_CHANNEL, await data_manager.pair_devices(helmet, bike))
+    return {"helmet": helmet, "bike": bike}
+
+@app.post("/devices/{uuid}")
+async def register_device(request: Request, uuid: str, type: DeviceType, group: Optional[str] = None):
+    """Register a device, optionally assigning it to a group"""
+    device_auth.check_admin(request.headers, request.query_params)
+    await announce(REGISTRATION_CHANNEL, await data_manager.register_device(uuid, type, group))
+    return {"uuid": uuid, "type": type.value, "group": group}
+
+@app.get("/api/devices")
+async def list_devices(
+    type: Optional[DeviceType] = None,
+    group: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Page through registered devices by type and/or group"""
+    devices = device_manager.list_devices(type, group, offset, limit)
+    return {
+        "total": device_manager.count(type, group),
+        "offset": offset,
+        "devices": [
+            {
+                "uuid": device.uuid,
+                "type": device.type.value,
+                "status": device.status.value,
+                "group": device.group,
+                "last_seen": device.last_seen,
+                "paired_with": device_manager.get_paired_bike(device.uuid) or device_manager.get_paired_helmet(device.uuid)
+            }
+            for device in devices
+        ]
+    }
 
-@app.websocket("/ws/bike-001")
-async def bike_websocket(websocket: WebSocket):
-    """WebSocket endpoint for bike module"""
-    await manager.connect("bike-001", websocket)
+@app.websocket("/ws/{device_id}")
+async def device_websocket(websocket: WebSocket, device_id: str):
+    """WebSocket endpoint for bike modules"""
+    if not device_auth.is_authorized(device_id, websocket.headers, websocket.query_params):
+        await websocket.close(code=1008)
+        return
+    await connection_manager.connect(device_id, websocket)
+    await sync_bike(device_id)
     try:
         while True:
             # Keep connection alive
             await websocket.receive_text()
     except WebSocketDisconnect:
-        manager.disconnect("bike-001")
+        pass
+    finally:
+        connection_manager.disconnect(device_id, websocket)
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,330 @@
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from collections import deque
+import asyncio
+import os
+import random
+import time
+import uuid as uuidlib
+from .data_manager import data_manager, DataManager
+from .io_executor import IOExecutor
+from .metrics import metrics
+
+STREAM = "notifications"
+
+NOTIFICATIONS = metrics.counter("notifications_total", "Notification outcomes", ("status",))
+
+class NotificationProvider:
+    """Base class for outbound message providers"""
+
+    async def send(self, to: str, body: str):
+        """Deliver ``body`` to ``to``; raise on failure"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release anything the provider holds"""
+
+class TwilioProvider(NotificationProvider):
+    """Sends SMS through Twilio.
+
+    The blocking client runs on a small executor of its own, with a request
+    timeout, so a slow Twilio API never occupies the threads used for disk I/O.
+    """
+
+    def __init__(self, account_sid: str, auth_token: str, from_number: str,
+                 timeout: float = 10.0, max_workers: int = 2):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.from_number = from_number
+        self.timeout = timeout
+        self.executor = IOExecutor(max_workers=max_workers, max_queue=max_workers, thread_name_prefix="twilio")
+        self._client = None
+
+    def _create(self, to: str, body: str):
+        if self._client is None:
+            from twilio.rest import Client
+            from twilio.http.http_client import TwilioHttpClient
+            self._client = Client(self.account_sid, self.auth_token,
+                                  http_client=TwilioHttpClient(timeout=self.timeout))
+        self._client.messages.create(body=body, from_=self.from_number, to=to)
+
+    async def send(self, to: str, body: str):
+        await self.executor.run(self._create, to, body)
+
+    def close(self):
+        self.executor.shutdown()
+
+class FakeProvider(NotificationProvider):
+    """Records messages instead of sending them; fails the first ``fail_times`` sends"""
+
+    def __init__(self, fail_times: int = 0):
+        self.fail_times = fail_times
+        self.sent: List[Tuple[str, str]] = []
+
+    async def send(self, to: str, body: str):
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise RuntimeError("fake provider failure")
+        self.sent.append((to, body))
+
+class NotificationService:
+    """Durable, rate limited outbound alert queue.
+
+    Every message is recorded in the ``notifications`` stream before it is
+    sent and again when it is sent or given up on, so pending messages
+    survive a restart. Repeated alerts for the same device and recipient
+    within ``dedupe_window`` seconds are dropped; each recipient gets at
+    most ``rate_limit`` messages per ``rate_period`` seconds, with ready
+    messages for one recipient combined into a single send of up to
+    ``batch_size``. Failed sends are retried with exponential backoff.
+
+    Workers sharing a store all load its pending messages, so each message
+    is claimed in the store for ``claim_lease`` seconds before it is sent
+    and only the worker holding the claim sends it.
+    """
+
+    def __init__(self, data: DataManager, provider: Optional[NotificationProvider] = None,
+                 recipients: Optional[List[str]] = None, workers: int = 2,
+                 dedupe_window: float = 300.0, rate_limit: int = 5, rate_period: float = 60.0,
+                 batch_size: int = 5, max_attempts: int = 6, base_delay: float = 2.0,
+                 max_delay: float = 300.0, claim_lease: float = 60.0):
+        self.data = data
+        self.provider = provider
+        self.recipients = recipients or []
+        self.workers = workers
+        self.dedupe_window = dedupe_window
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.claim_lease = claim_lease
+        # Identifies this worker's claims on shared messages
+        self.worker_id = uuidlib.uuid4().hex
+
+        self.stream = data.backend.open_stream(STREAM, retention=10000, key="id")
+        self.pending: Dict[str, Dict] = {}
+        self._ready: Dict[str, List[str]] = {}       # recipient -> message ids due now
+        self._scheduled: Set[str] = set()            # recipients queued for a worker
+        self._queue: Optional[asyncio.Queue] = None
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._last_alert: Dict[Tuple[str, str], float] = {}
+        self._sent_at: Dict[str, Deque[float]] = {}
+        self._tasks: List[asyncio.Task] = []
+        self.suppressed = 0
+
+        for record in self.stream.records():
+            self._last_alert[(record["to"], record["device"])] = record["created"]
+            if record["status"] == "pending":
+                self.pending[record["id"]] = record
+
+    @property
+    def enabled(self) -> bool:
+        return self.provider is not None and bool(self.recipients)
+
+    def _save(self, message: Dict):
+        self.data.pipeline.submit(STREAM, dict(message))
+
+    def alert(self, device: str, body: str) -> int:
+        """Queue ``body`` about ``device`` for every recipient; returns how many were queued"""
+        if not self.enabled:
+            return 0
+        now = time.time()
+        queued = 0
+        for to in self.recipients:
+            last = self._last_alert.get((to, device))
+            if last is not None and now - last < self.dedupe_window:
+                self.suppressed += 1
+                NOTIFICATIONS.inc(status="suppressed")
+                continue
+            self._last_alert[(to, device)] = now
+            message = {
+                "id": uuidlib.uuid4().hex,
+                "device": device,
+                "to": to,
+                "body": body,
+                "status": "pending",
+                "attempts": 0,
+                "created": now,
+                "next_attempt": now,
+                "error": None,
+            }
+            self.pending[message["id"]] = message
+            self._save(message)
+            self._schedule(message)
+            queued += 1
+        return queued
+
+    def _schedule(self, message: Dict):
+        """Make a message ready now or once its next attempt is due"""
+        if self._queue is None:
+            # Not started yet; start() schedules everything pending
+            return
+        delay = message["next_attempt"] - time.time()
+        if delay > 0:
+            loop = asyncio.get_running_loop()
+            self._timers[message["id"]] = loop.call_later(delay, self._make_ready, message["id"])
+        else:
+            self._make_ready(message["id"])
+
+    def _make_ready(self, message_id: str):
+        self._timers.pop(message_id, None)
+        message = self.pending.get(message_id)
+        if message is None:
+            return
+        self._ready.setdefault(message["to"], []).append(message_id)
+        if message["to"] not in self._scheduled:
+            self._scheduled.add(message["to"])
+            self._queue.put_nowait(message["to"])
+
+    def _rate_delay(self, to: str) -> float:
+        """Seconds until ``to`` may receive another message"""
+        window = self._sent_at.setdefault(to, deque())
+        now = time.monotonic()
+        while window and now - window[0] >= self.rate_period:
+            window.popleft()
+        if len(window) < self.rate_limit:
+            return 0.0
+        return self.rate_period - (now - window[0])
+
+    async def start(self):
+        if self._tasks or not self.enabled:
+            return
+        self._queue = asyncio.Queue()
+        for message in self.pending.values():
+            self._schedule(message)
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    async def _work(self):
+        while True:
+            to = await self._queue.get()
+            try:
+                await self._send_ready(to)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error sending notifications to {to}: {e}")
+
+    async def _send_ready(self, to: str):
+        """Send what is ready for one recipient as a single message"""
+        delay = self._rate_delay(to)
+        if delay > 0:
+            self._scheduled.discard(to)
+            for message_id in self._ready.pop(to, []):
+                self.pending[message_id]["next_attempt"] = time.time() + delay
+                self._schedule(self.pending[message_id])
+            return
+
+        ready = self._ready.get(to, [])
+        batch = [self.pending[message_id] for message_id in ready[:self.batch_size] if message_id in self.pending]
+        del ready[:self.batch_size]
+        # Messages are on disk before the first attempt to send them
+        await self.data.backend.flush_stream(STREAM)
+        batch = await self._claim_batch(batch)
+        try:
+            if batch:
+                self._sent_at[to].append(time.monotonic())
+                await self.provider.send(to, "\n".join(message["body"] for message in batch))
+        except Exception as e:
+            for message in batch:
+                await self._retry(message, str(e))
+            await self.data.backend.flush_stream(STREAM)
+        else:
+            for message in batch:
+                message["status"] = "sent"
+                message["attempts"] += 1
+                self.pending.pop(message["id"], None)
+                self._save(message)
+                NOTIFICATIONS.inc(status="sent")
+            # The outcome is stored before the claim can lapse
+            await self.data.backend.flush_stream(STREAM)
+        finally:
+            if self._ready.get(to):
+                self._queue.put_nowait(to)
+            else:
+                self._ready.pop(to, None)
+                self._scheduled.discard(to)
+
+    def _claim(self, stored: Optional[Dict]) -> Optional[Dict]:
+        """The stored message claimed by this worker, or None if it cannot be claimed"""
+        now = time.time()
+        if stored is None or stored["status"] != "pending":
+            return None
+        if stored.get("claimed_by") not in (None, self.worker_id) and stored["claim_expires"] > now:
+            return None
+        return {**stored, "claimed_by": self.worker_id, "claim_expires": now + self.claim_lease}
+
+    async def _claim_batch(self, batch: List[Dict]) -> List[Dict]:
+        """Claim a batch in the store; returns the messages this worker may send.
+
+        Messages another worker has finished are forgotten, and those it
+        holds are tried again once its claim expires.
+        """
+        if not batch:
+            return batch
+        stored = await self.data.backend.update_keys(STREAM, [message["id"] for message in batch], self._claim)
+        claimed = []
+        for message, current in zip(batch, stored):
+            if current is None or current["status"] != "pending":
+                self.pending.pop(message["id"], None)
+                continue
+            message = self.pending[message["id"]] = dict(current)
+            if message["claimed_by"] == self.worker_id:
+                claimed.append(message)
+            else:
+                message["next_attempt"] = max(message["next_attempt"], message["claim_expires"])
+                self._schedule(message)
+        return claimed
+
+    async def _retry(self, message: Dict, error: str):
+        """Back off exponentially, or give up after ``max_attempts``"""
+        # Release the claim so any worker may make the next attempt
+        message["claimed_by"] = None
+        message["attempts"] += 1
+        message["error"] = error
+        if message["attempts"] >= self.max_attempts:
+            message["status"] = "failed"
+            self.pending.pop(message["id"], None)
+            self._save(message)
+            NOTIFICATIONS.inc(status="failed")
+            await self.data.add_log(message["device"], "ERROR", f"Failed to send SMS to {message['to']}: {error}")
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (message["attempts"] - 1))
+        message["next_attempt"] = time.time() + delay * random.uniform(0.8, 1.2)
+        self._save(message)
+        NOTIFICATIONS.inc(status="retried")
+        self._schedule(message)
+
+    async def close(self):
+        """Stop the workers; unsent messages stay pending on disk"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        self._ready = {}
+        self._scheduled = set()
+        self._queue = None
+        if self.provider is not None:
+            self.provider.close()
+
+def create_provider() -> Optional[NotificationProvider]:
+    """Build the provider configured by NOTIFY_PROVIDER and the Twilio variables"""
+    name = os.getenv("NOTIFY_PROVIDER", "twilio")
+    if name == "fake":
+        return FakeProvider()
+    sid = os.getenv("TWILIO_ACCOUNT_SID")
+    if name == "twilio" and sid:
+        return TwilioProvider(sid, os.getenv("TWILIO_AUTH_TOKEN", ""), os.getenv("TWILIO_PHONE_NUMBER", ""),
+                              timeout=float(os.getenv("TWILIO_TIMEOUT", "10")))
+    return None
+
+# Global notification service instance
+notifier = NotificationService(
+    data_manager,
+    provider=create_provider(),
+    recipients=[to.strip() for to in os.getenv("ALERT_PHONE_NUMBER", "").split(",") if to.strip()]
+)
@@ -0,0 +1,247 @@
+from typing import AsyncIterator, Callable, Dict, Optional, Set
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+import asyncio
+import math
+import os
+from .storage import StorageBackend
+from .metrics import metrics
+
+PIPELINE_DEPTH = metrics.gauge("pipeline_buffered_records", "Records waiting for the next flush")
+PIPELINE_FLUSH = metrics.histogram("pipeline_flush_seconds", "Time writing one batch of every dirty stream")
+PIPELINE_BATCH = metrics.histogram("pipeline_batch_records", "Records written per flush",
+                                   buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+PIPELINE_SHED = metrics.counter("pipeline_shed_records_total", "Records refused or dropped by admission control",
+                                ("stream", "reason"))
+
+POLICIES = ("block", "drop_oldest", "drop_by_level")
+# Log levels drop_by_level never sheds
+PROTECTED_LEVELS = frozenset({"SECURITY", "ERROR"})
+
+@dataclass
+class IngestLimit:
+    """Admission control for one stream.
+
+    ``max_pending`` bounds the records admitted but not yet written. Once
+    it is reached, ``block`` waits up to ``block_timeout`` seconds for a
+    flush to make room, ``drop_oldest`` discards the oldest records still
+    waiting in the write buffer (waiting like ``block`` if none are), and
+    ``drop_by_level`` refuses new records unless their level is SECURITY
+    or ERROR.
+
+    Records dropped by ``drop_oldest`` are only dropped from disk: they
+    stay in the in-memory views (recent logs, tracks and rollups) until the
+    process restarts and rebuilds those views from what was written.
+    """
+    max_pending: int = 10000
+    policy: str = "block"
+    block_timeout: float = 1.0
+
+    def __post_init__(self):
+        if self.policy not in POLICIES:
+            raise ValueError(f"Unknown ingest policy: {self.policy}")
+
+def limits_from_env() -> Dict[str, IngestLimit]:
+    """Limits for the logs and GPS streams from INGEST_MAX_PENDING and INGEST_*_POLICY"""
+    max_pending = int(os.getenv("INGEST_MAX_PENDING", "10000"))
+    return {
+        "logs": IngestLimit(max_pending, os.getenv("INGEST_LOGS_POLICY", "drop_by_level")),
+        "gps": IngestLimit(max_pending, os.getenv("INGEST_GPS_POLICY", "drop_oldest")),
+    }
+
+class IngestSaturated(Exception):
+    """A stream's ingest buffer is full; retry after ``retry_after`` seconds"""
+
+    def __init__(self, stream: str, retry_after: int):
+        super().__init__(f"Ingest buffer for {stream} is full")
+        self.stream = stream
+        self.retry_after = retry_after
+
+class IngestPipeline:
+    """Single batching writer for every persisted stream.
+
+    Submitted records become visible in the stream's in-memory view at
+    once; a background task writes them to disk when ``batch_size`` records
+    are buffered or every ``flush_interval`` seconds, whichever comes first.
+    Streams with an ``IngestLimit`` bound how many records may wait for
+    that write; callers hold room with ``admission`` while they submit,
+    and a record's room is given back once the flush writing it finishes.
+    ``on_flush`` is called with the names of the streams each flush wrote;
+    it runs on the writer, so it must return at once rather than wait on
+    the network.
+    """
+
+    def __init__(self, backend: StorageBackend, batch_size: int = 50, flush_interval: float = 1.0,
+                 limits: Optional[Dict[str, IngestLimit]] = None,
+                 on_flush: Optional[Callable[[Set[str]], None]] = None):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.limits = limits or {}
+        self.on_flush = on_flush
+        self.buffered = 0
+        self.pending: Dict[str, int] = {}
+        self.reserved: Dict[str, int] = {}
+        self.shed: Dict[str, int] = {}
+        self._room: Optional[asyncio.Event] = None
+        self._dirty: Set[str] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+    
+    def submit(self, stream: str, record: Dict):
+        """Queue a record for the named stream"""
+        self.backend.streams[stream].append(record)
+        self._dirty.add(stream)
+        self.pending[stream] = self.pending.get(stream, 0) + 1
+        self.buffered += 1
+        PIPELINE_DEPTH.set(self.buffered)
+        if self.buffered >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+    
+    def _shed(self, stream: str, reason: str, count: int = 1):
+        self.shed[stream] = self.shed.get(stream, 0) + count
+        PIPELINE_SHED.inc(count, stream=stream, reason=reason)
+
+    def _has_room(self, stream: str, count: int, limit: IngestLimit) -> bool:
+        held = self.pending.get(stream, 0) + self.reserved.get(stream, 0)
+        # An oversized batch is let in once the buffer is empty
+        return held + count <= limit.max_pending or held == 0
+
+    def _room_made(self):
+        """Wake everything waiting in ``admit`` and arm a fresh event"""
+        if self._room is not None:
+            self._room.set()
+            self._room = asyncio.Event()
+
+    def reserve(self, stream: str, count: int = 1):
+        """Hold room for ``count`` records until ``release``, whatever the limit"""
+        self.reserved[stream] = self.reserved.get(stream, 0) + count
+
+    def release(self, stream: str, count: int = 1):
+        """Give back room held with ``admit`` or ``reserve``"""
+        self.reserved[stream] -= count
+        self._room_made()
+
+    @asynccontextmanager
+    async def admission(self, stream: str, level: Optional[str] = None, count: int = 1) -> AsyncIterator[None]:
+        """Hold room for ``count`` records while the body submits them.
+
+        Raises ``IngestSaturated`` when the records are refused.
+        """
+        await self.admit(stream, level, count)
+        try:
+            yield
+        finally:
+            self.release(stream, count)
+
+    async def admit(self, stream: str, level: Optional[str] = None, count: int = 1):
+        """Reserve room for ``count`` records, applying the stream's limit policy.
+
+        The room is held until ``release``. Raises ``IngestSaturated`` when
+        the records are refused.
+        """
+        limit = self.limits.get(stream)
+        if limit is None or self._has_room(stream, count, limit):
+            self.reserve(stream, count)
+            return
+        if limit.policy == "drop_oldest":
+            held = self.pending[stream] + self.reserved.get(stream, 0)
+            dropped = self.backend.streams[stream].drop_pending(held + count - limit.max_pending)
+            if dropped:
+                self.pending[stream] -= dropped
+                self.buffered -= dropped
+                PIPELINE_DEPTH.set(self.buffered)
+                self._shed(stream, "drop_oldest", dropped)
+            if self._has_room(stream, count, limit):
+                self.reserve(stream, count)
+                return
+        elif limit.policy == "drop_by_level":
+            if level in PROTECTED_LEVELS:
+                self.reserve(stream, count)
+                return
+            self._shed(stream, "drop_by_level", count)
+            raise IngestSaturated(stream, self.retry_after)
+        # Wait for flushes to make room, up to the stream's timeout
+        if self._wakeup is not None:
+            self._wakeup.set()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + limit.block_timeout
+        while not self._has_room(stream, count, limit):
+            remaining = deadline - loop.time()
+            if remaining <= 0 or self._room is None:
+                self._shed(stream, "block_timeout", count)
+                raise IngestSaturated(stream, self.retry_after)
+            try:
+                await asyncio.wait_for(self._room.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+        self.reserve(stream, count)
+
+    @property
+    def retry_after(self) -> int:
+        """Whole seconds until the next scheduled flush has made room"""
+        return max(1, math.ceil(self.flush_interval))
+
+    async def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._room = asyncio.Event()
+            self._stopping = False
+            self._task = asyncio.create_task(self.run())
+    
+    async def run(self):
+        """Flush buffered records in batches until stopped"""
+        while not self._stopping:
+            try:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error flushing records: {e}")
+                await asyncio.sleep(1)
+    
+    async def flush(self):
+        """Write every stream with buffered records.
+
+        Each stream's records keep their room until its write finishes, so
+        admission only reopens for records that are on disk.
+        """
+        dirty, self._dirty = self._dirty, set()
+        if metrics.enabled and self.buffered:
+            PIPELINE_BATCH.observe(self.buffered)
+        async with PIPELINE_FLUSH.time():
+            for stream in dirty:
+                # Counted just before the stream's buffer is taken for writing
+                written = self.pending.get(stream, 0)
+                try:
+                    await self.backend.flush_stream(stream)
+                finally:
+                    self.pending[stream] = max(0, self.pending.get(stream, 0) - written)
+                    self.buffered = max(0, self.buffered - written)
+                    PIPELINE_DEPTH.set(self.buffered)
+        if dirty and self.on_flush is not None:
+            self.on_flush(dirty)
+        self._room_made()
+    
+    async def stop(self, timeout: float = 5.0):
+        """Stop the writer and flush what is left.
+
+        The writer is woken for a last flush rather than cancelled, so a
+        batch already handed to the I/O executor completes first; it is
+        cancelled only if that takes longer than ``timeout`` seconds.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=timeout)
+            except asyncio.TimeoutError:
+                print(f"Ingest writer did not finish within {timeout}s; flushing directly")
+            self._task = None
+        await self.flush()
@@ -0,0 +1,189 @@
+"""Publish/subscribe transport for cross-worker messages.
+
+``InProcessPubSub`` is used by default. When several uvicorn workers run,
+point ``PUBSUB_URL`` at a broker (``broker://host:port``); a minimal broker
+is included and can be started with ``python -m app.pubsub``.
+"""
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+import argparse
+import asyncio
+import json
+import os
+
+Handler = Callable[[Dict], Awaitable[None]]
+
+class PubSubUnavailable(Exception):
+    """The transport could not take a message in time"""
+
+class PubSub:
+    """Base class for pub/sub transports"""
+
+    def __init__(self):
+        self.handlers: Dict[str, List[Handler]] = {}
+    
+    async def start(self):
+        pass
+    
+    async def close(self):
+        pass
+    
+    async def subscribe(self, channel: str, handler: Handler):
+        """Call ``handler`` for every message published on ``channel``"""
+        self.handlers.setdefault(channel, []).append(handler)
+    
+    async def publish(self, channel: str, message: Dict):
+        raise NotImplementedError
+    
+    async def _dispatch(self, channel: str, message: Dict):
+        for handler in self.handlers.get(channel, []):
+            try:
+                await handler(message)
+            except Exception as e:
+                print(f"Error handling message on {channel}: {e}")
+
+class InProcessPubSub(PubSub):
+    """Delivers messages to subscribers in the same process"""
+
+    async def publish(self, channel: str, message: Dict):
+        await self._dispatch(channel, message)
+
+class BrokerPubSub(PubSub):
+    """Client for ``BrokerServer`` speaking newline-delimited JSON over TCP"""
+
+    def __init__(self, host: str, port: int, reconnect_delay: float = 1.0, publish_timeout: float = 2.0):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.reconnect_delay = reconnect_delay
+        self.publish_timeout = publish_timeout
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+    
+    async def start(self):
+        if self._reader_task is None:
+            self._reader_task = asyncio.create_task(self._run())
+            await asyncio.wait_for(self._connected.wait(), timeout=5)
+    
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_connection(self.host, self.port)
+                for channel in self.handlers:
+                    await self._send({"op": "sub", "channel": channel})
+                self._connected.set()
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    frame = json.loads(line)
+                    await self._dispatch(frame["channel"], frame["message"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Pub/sub broker connection error: {e}")
+            self._connected.clear()
+            self._writer = None
+            await asyncio.sleep(self.reconnect_delay)
+    
+    async def _send(self, frame: Dict):
+        self._writer.write((json.dumps(frame) + "\n").encode())
+        await self._writer.drain()
+    
+    async def subscribe(self, channel: str, handler: Handler):
+        is_new = channel not in self.handlers
+        await super().subscribe(channel, handler)
+        if is_new and self._writer is not None:
+            await self._send({"op": "sub", "channel": channel})
+    
+    async def publish(self, channel: str, message: Dict):
+        """Send a message to the broker.
+
+        Raises ``PubSubUnavailable`` if the broker is not connected, or does
+        not take the message, within ``publish_timeout`` seconds.
+        """
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout=self.publish_timeout)
+            # Taken without awaiting in between, so a dropped connection cannot swap it out
+            writer = self._writer
+            if writer is not None:
+                writer.write((json.dumps({"op": "pub", "channel": channel, "message": message}) + "\n").encode())
+                await asyncio.wait_for(writer.drain(), timeout=self.publish_timeout)
+                return
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        raise PubSubUnavailable(f"Pub/sub broker {self.host}:{self.port} is unavailable")
+    
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+class BrokerServer:
+    """Minimal fan-out broker used as a local stand-in for multi-worker runs"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765):
+        self.host = host
+        self.port = port
+        self.subscribers: Dict[str, List[asyncio.StreamWriter]] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+    
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                frame = json.loads(line)
+                if frame["op"] == "sub":
+                    self.subscribers.setdefault(frame["channel"], []).append(writer)
+                elif frame["op"] == "pub":
+                    data = (json.dumps({"channel": frame["channel"], "message": frame["message"]}) + "\n").encode()
+                    for subscriber in list(self.subscribers.get(frame["channel"], [])):
+                        subscriber.write(data)
+        except Exception as e:
+            print(f"Broker client error: {e}")
+        finally:
+            for writers in self.subscribers.values():
+                if writer in writers:
+                    writers.remove(writer)
+            writer.close()
+    
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+def create_pubsub(url: Optional[str] = None) -> PubSub:
+    """Build the transport configured by ``url`` or the PUBSUB_URL variable"""
+    url = url or os.getenv("PUBSUB_URL", "")
+    if not url:
+        return InProcessPubSub()
+    parsed = urlparse(url)
+    if parsed.scheme == "broker":
+        return BrokerPubSub(parsed.hostname or "127.0.0.1", parsed.port or 8765)
+    raise ValueError(f"Unsupported PUBSUB_URL: {url}")
+
+# Global pub/sub instance
+pubsub = create_pubsub()
+
+async def _serve(host: str, port: int):
+    broker = BrokerServer(host, port)
+    await broker.start()
+    print(f"Pub/sub broker listening on {host}:{broker.port}")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local pub/sub broker")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(_serve(args.host, args.port))
@@ -0,0 +1,214 @@
+from typing import Dict, List, Optional, Tuple
+from bisect import bisect_right, insort
+from datetime import datetime
+import re
+from .track_store import to_epoch
+
+# Bucket width in seconds and how many buckets each resolution keeps:
+# two hours of minutes, a week of hours and a quarter of days
+RESOLUTIONS: Dict[str, Tuple[int, int]] = {
+    "1m": (60, 120),
+    "1h": (3600, 7 * 24),
+    "1d": (86400, 90),
+}
+
+# Alert messages written before log entries carried structured metadata
+ALERT_MESSAGE = re.compile(r"Alcohol detected: (\d+(?:\.\d+)?)")
+SAFE_MESSAGE = "Helmet status: Safe"
+
+def reading_of(entry: Dict) -> Optional[Tuple[bool, Optional[float]]]:
+    """``(is_alert, alcohol_level)`` if a log entry records a helmet reading"""
+    metadata = entry.get("metadata") or {}
+    if "status" in metadata:
+        return metadata["status"] == "drunken", metadata.get("alcohol_level")
+    if entry.get("level") == "SECURITY":
+        match = ALERT_MESSAGE.match(entry.get("message", ""))
+        if match:
+            return True, float(match.group(1))
+    if entry.get("message") == SAFE_MESSAGE:
+        return False, None
+    return None
+
+class Bucket:
+    """Aggregates of one device (or the fleet) over one time bucket"""
+
+    __slots__ = ("start", "events", "readings", "alerts", "level_count", "level_sum",
+                 "level_min", "level_max", "last_seen")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.events = 0       # every log entry
+        self.readings = 0     # helmet checks, drunken or not
+        self.alerts = 0
+        self.level_count = 0
+        self.level_sum = 0.0
+        self.level_min = None
+        self.level_max = None
+        self.last_seen = 0.0
+
+    def add(self, timestamp: float, reading: Optional[Tuple[bool, Optional[float]]], count: int = 1):
+        self.events += count
+        self.last_seen = max(self.last_seen, timestamp)
+        if reading is None:
+            return
+        is_alert, level = reading
+        self.readings += count
+        if is_alert:
+            self.alerts += count
+        if level is not None:
+            self.level_count += count
+            self.level_sum += level * count
+            self.level_min = level if self.level_min is None else min(self.level_min, level)
+            self.level_max = level if self.level_max is None else max(self.level_max, level)
+
+    def merge(self, other: "Bucket"):
+        self.events += other.events
+        self.readings += other.readings
+        self.alerts += other.alerts
+        self.level_count += other.level_count
+        self.level_sum += other.level_sum
+        for value in (other.level_min, other.level_max):
+            if value is not None:
+                self.level_min = value if self.level_min is None else min(self.level_min, value)
+                self.level_max = value if self.level_max is None else max(self.level_max, value)
+        self.last_seen = max(self.last_seen, other.last_seen)
+
+    def to_dict(self) -> Dict:
+        return {
+            "start": datetime.fromtimestamp(self.start).isoformat(),
+            "events": self.events,
+            "readings": self.readings,
+            "alerts": self.alerts,
+            "alert_rate": self.alerts / self.readings if self.readings else 0.0,
+            "alcohol_min": self.level_min,
+            "alcohol_max": self.level_max,
+            "alcohol_mean": self.level_sum / self.level_count if self.level_count else None,
+            "last_seen": datetime.fromtimestamp(self.last_seen).isoformat(),
+        }
+
+class Series:
+    """Buckets of one resolution, kept sorted by start time"""
+
+    __slots__ = ("width", "retention", "starts", "buckets")
+
+    def __init__(self, width: int, retention: int):
+        self.width = width
+        self.retention = retention
+        self.starts: List[float] = []
+        self.buckets: Dict[float, Bucket] = {}
+
+    def add(self, timestamp: float, reading: Optional[Tuple[bool, Optional[float]]], count: int = 1):
+        start = timestamp - timestamp % self.width
+        bucket = self.buckets.get(start)
+        if bucket is None:
+            if self.starts and start < self.starts[0] and len(self.starts) >= self.retention:
+                return  # older than anything retained
+            bucket = self.buckets[start] = Bucket(start)
+            if not self.starts or start > self.starts[-1]:
+                self.starts.append(start)
+            else:
+                insort(self.starts, start)
+            while len(self.starts) > self.retention:
+                del self.buckets[self.starts.pop(0)]
+        bucket.add(timestamp, reading, count)
+
+    def state(self) -> List[List]:
+        """The buckets as lists of their fields, oldest first"""
+        return [[getattr(self.buckets[start], field) for field in Bucket.__slots__] for start in self.starts]
+
+    def restore(self, state: List[List]):
+        """Replace the buckets with ones saved by ``state``"""
+        self.starts = []
+        self.buckets = {}
+        for values in state[-self.retention:]:
+            bucket = Bucket(values[0])
+            for field, value in zip(Bucket.__slots__, values):
+                setattr(bucket, field, value)
+            self.starts.append(bucket.start)
+            self.buckets[bucket.start] = bucket
+
+    def range(self, since: Optional[float], until: Optional[float]) -> List[Bucket]:
+        """Buckets overlapping [since, until], oldest first"""
+        lo = bisect_right(self.starts, since - self.width) if since is not None else 0
+        hi = bisect_right(self.starts, until) if until is not None else len(self.starts)
+        return [self.buckets[start] for start in self.starts[lo:hi]]
+
+class RollupStore:
+    """Per-device and fleet-wide rollups maintained as log entries arrive.
+
+    Each entry updates one bucket per resolution for its device and for the
+    fleet, so reports read pre-aggregated buckets instead of scanning logs.
+    """
+
+    def __init__(self, resolutions: Dict[str, Tuple[int, int]] = RESOLUTIONS):
+        self.resolutions = resolutions
+        # Seconds of history the longest-lived resolution keeps
+        self.horizon = max(width * retention for width, retention in resolutions.values())
+        self.devices: Dict[str, Dict[str, Series]] = {}
+        self.fleet = self._new_series()
+
+    def _new_series(self) -> Dict[str, Series]:
+        return {name: Series(width, retention) for name, (width, retention) in self.resolutions.items()}
+
+    def add(self, entry: Dict, count: Optional[int] = None):
+        """Fold a log entry into the device and fleet rollups.
+
+        A coalesced entry counts as its ``count`` repeats unless ``count``
+        is given.
+        """
+        timestamp = to_epoch(entry.get("timestamp"))
+        reading = reading_of(entry)
+        if count is None:
+            count = entry.get("count", 1)
+        device = entry.get("device")
+        series = self.devices.get(device)
+        if series is None:
+            series = self.devices[device] = self._new_series()
+        for name in self.resolutions:
+            series[name].add(timestamp, reading, count)
+            self.fleet[name].add(timestamp, reading, count)
+
+    def state(self) -> Dict:
+        """Every series' buckets, to be saved and handed to ``restore``"""
+        return {
+            "resolutions": {name: list(spec) for name, spec in self.resolutions.items()},
+            "fleet": {name: series.state() for name, series in self.fleet.items()},
+            "devices": {device: {name: series.state() for name, series in device_series.items()}
+                        for device, device_series in self.devices.items()},
+        }
+
+    def restore(self, state: Dict) -> bool:
+        """Load buckets saved by ``state``; False if they were kept at other resolutions"""
+        if state.get("resolutions") != {name: list(spec) for name, spec in self.resolutions.items()}:
+            return False
+        self.fleet = self._new_series()
+        for name, series in self.fleet.items():
+            series.restore(state["fleet"][name])
+        self.devices = {}
+        for device, saved in state["devices"].items():
+            series = self.devices[device] = self._new_series()
+            for name in self.resolutions:
+                series[name].restore(saved[name])
+        return True
+
+    def query(self, device: Optional[str], resolution: str, since: Optional[float] = None,
+              until: Optional[float] = None) -> List[Dict]:
+        """Buckets of a device, or of the whole fleet, in a time range"""
+        series = self.fleet if device is None else self.devices.get(device)
+        if series is None:
+            return []
+        return [bucket.to_dict() for bucket in series[resolution].range(since, until)]
+
+    def summary(self, resolution: str, since: Optional[float] = None,
+                until: Optional[float] = None) -> Dict[str, Dict]:
+        """Totals per device over a time range, merged from its buckets"""
+        report = {}
+        for device, series in self.devices.items():
+            buckets = series[resolution].range(since, until)
+            if not buckets:
+                continue
+            total = Bucket(buckets[0].start)
+            for bucket in buckets:
+                total.merge(bucket)
+            report[device] = total.to_dict()
+        return report
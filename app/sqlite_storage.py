@@ -0,0 +1,436 @@
+"""SQLite storage backend shared by several worker processes.
+
+Every stream is a table of JSON records in one database file opened in
+WAL mode, so workers keep reading while another one writes. Each row
+records the worker that stored it; ``changes`` returns the rows other
+workers stored since the last call, which is how a worker keeps its
+in-memory views in step with the rest.
+
+Existing JSON data is imported with::
+
+    python -m app.sqlite_storage migrate --data-dir data --db data/helmet.db
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid as uuidlib
+from .io_executor import io_executor, IOExecutor
+from .storage import StorageBackend, RecordStream, SegmentedLog, STORAGE_READ, STORAGE_WRITE
+from .track_store import to_epoch
+
+STREAM_NAME = re.compile(r"^[a-z_][a-z0-9_]*$")
+CHANGES_BATCH = 1000
+# Keys looked up per statement, well under SQLite's bound-parameter limit
+KEYS_BATCH = 500
+MIGRATE_BATCH = 1000
+DEFAULT_RETENTION_DAYS = 180.0
+# Seconds between retention sweeps of a stream
+EXPIRE_INTERVAL = 60.0
+
+# Columns stored next to each record's JSON: column -> (SQL type, record field).
+# ``ts`` holds the record's time as epoch seconds.
+COLUMNS: Dict[str, Dict[str, Tuple[str, str]]] = {
+    "status": {"device": ("TEXT", "uuid"), "status": ("TEXT", "status"), "ts": ("REAL", "timestamp")},
+    "logs": {"device": ("TEXT", "device"), "level": ("TEXT", "level"), "ts": ("REAL", "timestamp")},
+    "gps": {"device": ("TEXT", "device"), "latitude": ("REAL", "latitude"),
+            "longitude": ("REAL", "longitude"), "ts": ("REAL", "timestamp")},
+    "notifications": {"device": ("TEXT", "device"), "ts": ("REAL", "created")},
+    "devices": {"device": ("TEXT", "uuid"), "ts": ("REAL", "timestamp")},
+    "pairings": {"device": ("TEXT", "helmet"), "ts": ("REAL", "timestamp")},
+}
+DEFAULT_COLUMNS = {"device": ("TEXT", "device"), "ts": ("REAL", "timestamp")}
+
+# Streams the migration imports, with their key field
+MIGRATED_STREAMS = {"status": "uuid", "logs": None, "gps": None, "notifications": "id",
+                    "devices": "uuid", "pairings": "helmet"}
+
+class SQLiteStream(RecordStream):
+    """A stream stored as rows of one table.
+
+    Besides the record's JSON each row carries typed columns (device, time
+    and a few stream-specific fields) indexed on ``(device, ts)``, so reads
+    of one device over a time range stay fast however much history is kept.
+
+    Keyed streams keep a single row per key; storing a record replaces the
+    row for its key, giving it a new id, and the newest ``retention`` keys
+    are kept. Other streams keep records for the backend's retention
+    period rather than a fixed count.
+    """
+
+    def __init__(self, backend: "SQLiteBackend", name: str, retention: int = 1000,
+                 key: Optional[str] = None, keep_tail: bool = True):
+        if not STREAM_NAME.match(name):
+            raise ValueError(f"Invalid stream name: {name}")
+        super().__init__(name, retention, key, keep_tail=keep_tail)
+        self.backend = backend
+        self.columns = COLUMNS.get(name, DEFAULT_COLUMNS)
+        # Highest row id this worker has read or written
+        self.last_id = 0
+        self._next_expiry = 0.0
+
+        # Statements are built once; sqlite3 keeps every connection's compiled
+        # statements by their SQL text, so each flush reuses them
+        columns = ", ".join(self.columns)
+        placeholders = ", ".join("?" * (len(self.columns) + 3))
+        verb = "INSERT OR REPLACE" if key else "INSERT"
+        self._insert_sql = f"{verb} INTO {name} (origin, key, {columns}, data) VALUES ({placeholders})"
+        self._expire_sql = f"DELETE FROM {name} WHERE ts < ?"
+        self._trim_sql = (f"DELETE FROM {name} WHERE id < "
+                          f"(SELECT id FROM {name} ORDER BY id DESC LIMIT 1 OFFSET ?)")
+        self._page_sql = f"SELECT id, data FROM {name} WHERE id > ? ORDER BY id LIMIT ?"
+        self._changes_sql = f"SELECT id, origin, data FROM {name} WHERE id > ? ORDER BY id LIMIT ?"
+        self._key_sql = f"SELECT data FROM {name} WHERE key = ?"
+
+        with backend.transaction() as db:
+            typed = "".join(f"{column} {sql_type}, " for column, (sql_type, _) in self.columns.items())
+            db.execute(f"CREATE TABLE IF NOT EXISTS {name} ("
+                       f"id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, "
+                       f"key TEXT, {typed}data TEXT NOT NULL)")
+            self._add_columns(db)
+            if key:
+                db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} (key)")
+            db.execute(f"CREATE INDEX IF NOT EXISTS {name}_device_ts ON {name} (device, ts)")
+            db.execute(f"CREATE INDEX IF NOT EXISTS {name}_ts ON {name} (ts)")
+        if keep_tail:
+            with STORAGE_READ.time(stream=name):
+                for record in self.replay():
+                    self._remember(record)
+
+    def _add_columns(self, db: sqlite3.Connection):
+        """Add and fill typed columns missing from a table created before them"""
+        existing = {row[1] for row in db.execute(f"PRAGMA table_info({self.name})")}
+        missing = [column for column in self.columns if column not in existing]
+        if not missing:
+            return
+        for column in missing:
+            db.execute(f"ALTER TABLE {self.name} ADD COLUMN {column} {self.columns[column][0]}")
+        assignments = ", ".join(f"{column} = ?" for column in self.columns)
+        rows = db.execute(f"SELECT id, data FROM {self.name}").fetchall()
+        db.executemany(f"UPDATE {self.name} SET {assignments} WHERE id = ?",
+                       [(*self._typed(json.loads(data)), row_id) for row_id, data in rows])
+
+    def _typed(self, record: Dict) -> tuple:
+        """Values of the typed columns for a record"""
+        values = []
+        for column, (_, field) in self.columns.items():
+            value = record.get(field)
+            values.append(to_epoch(value) if column == "ts" else value)
+        return tuple(values)
+
+    def _encode(self, record: Dict) -> tuple:
+        return ((record[self.key] if self.key else None), *self._typed(record), super()._encode(record))
+
+    def _rows(self, sql: str, params: tuple = ()) -> Iterator[Tuple[int, str]]:
+        for row_id, data in self.backend.connection().execute(sql, params):
+            self.last_id = max(self.last_id, row_id)
+            yield row_id, data
+
+    def replay(self) -> Iterator[Dict]:
+        for _, data in self._rows(f"SELECT id, data FROM {self.name} ORDER BY id"):
+            yield json.loads(data)
+
+    def replay_reverse(self) -> Iterator[Dict]:
+        for _, data in self._rows(f"SELECT id, data FROM {self.name} ORDER BY id DESC"):
+            yield json.loads(data)
+
+    def read_page(self, after: int, limit: int) -> Tuple[int, List[Dict]]:
+        """Up to ``limit`` records stored after row ``after``, and the last row id read"""
+        rows = self.backend.connection().execute(self._page_sql, (after, limit)).fetchall()
+        return (rows[-1][0] if rows else after), [json.loads(data) for _, data in rows]
+
+    def read_range(self, device: Optional[str], since: Optional[float], until: Optional[float],
+                   position: Optional[Tuple[float, int]], limit: int) -> Tuple[Optional[Tuple[float, int]], List[Dict]]:
+        """Up to ``limit`` records of a device (or every device) between two
+        epoch times, in time order.
+
+        Returns the records and the ``(ts, id)`` position to continue from.
+        """
+        clauses, params = [], []
+        if device is not None:
+            clauses.append("device = ?")
+            params.append(device)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts <= ?")
+            params.append(until)
+        if position is not None:
+            clauses.append("(ts, id) > (?, ?)")
+            params.extend(position)
+        where = " AND ".join(clauses) or "1"
+        rows = self.backend.connection().execute(
+            f"SELECT id, ts, data FROM {self.name} WHERE {where} ORDER BY ts, id LIMIT ?",
+            (*params, limit)).fetchall()
+        if not rows:
+            return position, []
+        return (rows[-1][1], rows[-1][0]), [json.loads(data) for _, _, data in rows]
+
+    def query(self, after: Optional[int], since: Optional[float], until: Optional[float], limit: int,
+              **fields) -> List[Dict]:
+        """Up to ``limit`` records whose typed columns equal ``fields``, between
+        two epoch times, in row order.
+
+        With ``after`` these are the first rows after that id; without it they
+        are the newest rows. Row ids are the same on every worker, so each
+        record carries its row id as ``seq``.
+        """
+        clauses, params = [], []
+        for column, value in fields.items():
+            if column not in self.columns:
+                raise ValueError(f"{self.name} has no {column} column")
+            clauses.append(f"{column} = ?")
+            params.append(value)
+        if since is not None:
+            clauses.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("ts <= ?")
+            params.append(until)
+        if after is not None:
+            clauses.append("id > ?")
+            params.append(after)
+        where = " AND ".join(clauses) or "1"
+        order = "DESC" if after is None else ""
+        rows = self.backend.connection().execute(
+            f"SELECT id, data FROM {self.name} WHERE {where} ORDER BY id {order} LIMIT ?",
+            (*params, limit)).fetchall()
+        if after is None:
+            rows.reverse()
+        records = []
+        for row_id, data in rows:
+            record = json.loads(data)
+            record["seq"] = row_id
+            records.append(record)
+        return records
+
+    def read_key(self, value: str) -> Optional[Dict]:
+        """The stored record for a key, as every worker sees it (keyed streams only)"""
+        row = self.backend.connection().execute(self._key_sql, (value,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def read_keys(self, values: List[str]) -> Dict[str, Dict]:
+        """The stored records for several keys at once, by key (keyed streams only)"""
+        records = {}
+        db = self.backend.connection()
+        for start in range(0, len(values), KEYS_BATCH):
+            batch = values[start:start + KEYS_BATCH]
+            placeholders = ", ".join("?" * len(batch))
+            for key, data in db.execute(f"SELECT key, data FROM {self.name} WHERE key IN ({placeholders})", batch):
+                records[key] = json.loads(data)
+        return records
+
+    def is_empty(self) -> bool:
+        return self.backend.connection().execute(f"SELECT 1 FROM {self.name} LIMIT 1").fetchone() is None
+
+    def _expire(self, db: sqlite3.Connection):
+        """Delete records older than the backend's retention period"""
+        self._next_expiry = time.monotonic() + EXPIRE_INTERVAL
+        db.execute(self._expire_sql, (time.time() - self.backend.retention_seconds,))
+
+    def persist(self, rows: List[tuple], snapshot: Optional[List[Dict]] = None):
+        """Store a batch of rows in one transaction and apply retention"""
+        if not rows:
+            return
+        origin = self.backend.origin
+        with STORAGE_WRITE.time(stream=self.name), self.backend.transaction() as db:
+            db.executemany(self._insert_sql, [(origin, *row) for row in rows])
+            if self.key:
+                if len(self.index) >= self.retention:
+                    db.execute(self._trim_sql, (self.retention - 1,))
+            elif self.backend.retention_seconds and time.monotonic() >= self._next_expiry:
+                self._expire(db)
+
+    def update_keys(self, values: List[str],
+                    update: Callable[[Optional[Dict]], Optional[Dict]]) -> List[Optional[Dict]]:
+        """Read, update and store the records for ``values`` in one write
+        transaction; other workers' updates to the same keys wait for it"""
+        current = []
+        with STORAGE_WRITE.time(stream=self.name), self.backend.transaction() as db:
+            for value in values:
+                row = db.execute(self._key_sql, (value,)).fetchone()
+                stored = json.loads(row[0]) if row else None
+                record = update(stored)
+                if record is None:
+                    record = stored
+                else:
+                    db.execute(self._insert_sql, (self.backend.origin, *self._encode(record)))
+                current.append(record)
+        return current
+
+    def fetch_changes(self) -> List[Dict]:
+        """Records other workers stored since the last read.
+
+        Keyed streams also return this worker's own rows, so applying the
+        changes in order leaves the latest record per key in place.
+        """
+        changes = []
+        while True:
+            rows = self.backend.connection().execute(self._changes_sql, (self.last_id, CHANGES_BATCH)).fetchall()
+            for row_id, origin, data in rows:
+                self.last_id = row_id
+                if origin != self.backend.origin or self.key:
+                    changes.append(json.loads(data))
+            if len(rows) < CHANGES_BATCH:
+                return changes
+
+class SQLiteBackend(StorageBackend):
+    """Stores every stream in one SQLite database shared by all workers.
+
+    Unkeyed streams keep ``retention_days`` of records; ``None`` or 0 keeps
+    everything.
+    """
+
+    shared = True
+
+    def __init__(self, path: Path, executor: Optional[IOExecutor] = None,
+                 retention_days: Optional[float] = DEFAULT_RETENTION_DAYS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.executor = executor or io_executor
+        self.retention_seconds = retention_days * 86400 if retention_days else None
+        # Identifies this worker's rows
+        self.origin = uuidlib.uuid4().hex
+        self.streams: Dict[str, SQLiteStream] = {}
+        self._flush_locks: Dict[str, asyncio.Lock] = {}
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.connection().execute("PRAGMA journal_mode=WAL")
+        self.connection().execute("CREATE TABLE IF NOT EXISTS saved_state (name TEXT PRIMARY KEY, data TEXT NOT NULL)")
+
+    def connection(self) -> sqlite3.Connection:
+        """The calling thread's connection; SQLite connections are not shared between threads"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # Autocommit mode; writes open their own transactions
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            with self._connections_lock:
+                self._connections.append(db)
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """Take the write lock up front so concurrent workers queue instead of deadlocking"""
+        db = self.connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def open_stream(self, name: str, retention: int = 1000, key: Optional[str] = None,
+                    keep_tail: bool = True) -> SQLiteStream:
+        stream = SQLiteStream(self, name, retention=retention, key=key, keep_tail=keep_tail)
+        self.streams[name] = stream
+        self._flush_locks[name] = asyncio.Lock()
+        return stream
+
+    async def flush_stream(self, name: str):
+        """Write a stream's buffered records on the I/O executor"""
+        stream = self.streams[name]
+        async with self._flush_locks[name]:
+            rows = stream.take_pending()
+            if rows:
+                await self.executor.run(stream.persist, rows)
+
+    async def update_keys(self, name: str, values: List[str],
+                          update: Callable[[Optional[Dict]], Optional[Dict]]) -> List[Optional[Dict]]:
+        stream = self.streams[name]
+        async with self._flush_locks[name]:
+            # Buffered records are written first so they cannot overwrite the update
+            rows = stream.take_pending()
+            if rows:
+                await self.executor.run(stream.persist, rows)
+            current = await self.executor.run(stream.update_keys, values, update)
+        for record in current:
+            if record is not None:
+                stream._remember(record)
+        return current
+
+    async def changes(self, name: str) -> List[Dict]:
+        return await self.executor.run(self.streams[name].fetch_changes)
+
+    def load_state(self, name: str) -> Optional[Dict]:
+        row = self.connection().execute("SELECT data FROM saved_state WHERE name = ?", (name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _write_state(self, name: str, data: str):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO saved_state (name, data) VALUES (?, ?)", (name, data))
+
+    async def save_state(self, name: str, state: Dict):
+        await self.executor.run(self._write_state, name, json.dumps(state))
+
+    async def close(self):
+        for name in self.streams:
+            await self.flush_stream(name)
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+            self._connections = []
+        self._local = threading.local()
+
+def _source_records(data_dir: Path, name: str) -> Iterator[Dict]:
+    """Records of a stream in the JSON store: its segments, or else the old ``<name>.json`` array"""
+    directory = data_dir / name
+    if directory.is_dir() and any(directory.glob("*.jsonl")):
+        yield from SegmentedLog(directory, keep_tail=False).replay()
+        return
+    legacy_file = data_dir / f"{name}.json"
+    if legacy_file.exists():
+        yield from json.loads(legacy_file.read_text())
+
+def migrate(data_dir: Path, backend: SQLiteBackend, force: bool = False) -> Dict[str, int]:
+    """Copy the JSON store under ``data_dir`` into ``backend``.
+
+    Streams whose table already holds records are skipped unless ``force``
+    is set. Returns how many records were imported per stream.
+    """
+    imported = {}
+    for name, key in MIGRATED_STREAMS.items():
+        stream = backend.open_stream(name, key=key, keep_tail=False)
+        if not force and not stream.is_empty():
+            print(f"Skipping {name}: the table already holds records")
+            continue
+        count = 0
+        batch = []
+        for record in _source_records(Path(data_dir), name):
+            batch.append(stream._encode(record))
+            if len(batch) >= MIGRATE_BATCH:
+                stream.persist(batch)
+                count += len(batch)
+                batch = []
+        stream.persist(batch)
+        count += len(batch)
+        if not key and backend.retention_seconds:
+            with backend.transaction() as db:
+                stream._expire(db)
+        imported[name] = count
+    return imported
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite storage tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = commands.add_parser("migrate", help="import the JSON files in the data directory")
+    migrate_parser.add_argument("--data-dir", default="data")
+    migrate_parser.add_argument("--db", default=None, help="database file (default: <data-dir>/helmet.db)")
+    migrate_parser.add_argument("--retention-days", type=float, default=DEFAULT_RETENTION_DAYS,
+                                help="drop imported records older than this; 0 keeps everything")
+    migrate_parser.add_argument("--force", action="store_true", help="import into tables that already hold records")
+    args = parser.parse_args()
+    backend = SQLiteBackend(args.db or Path(args.data_dir) / "helmet.db", retention_days=args.retention_days)
+    for name, count in migrate(Path(args.data_dir), backend, args.force).items():
+        print(f"Imported {count} {name} records")
+    asyncio.run(backend.close())
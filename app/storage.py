@@ -0,0 +1,440 @@
+from typing import Callable, Dict, Iterator, List, Optional
+from collections import deque
+from pathlib import Path
+import asyncio
+import json
+import os
+import threading
+from .io_executor import io_executor, IOExecutor
+from .metrics import metrics
+
+SEGMENT_SUFFIX = ".jsonl"
+COMPACTED_MARKER = "__compacted__"
+READ_BLOCK_SIZE = 64 * 1024
+
+STORAGE_READ = metrics.histogram(
+    "storage_read_seconds", "Time reading and parsing records from segment files", ("stream",))
+STORAGE_SERIALIZE = metrics.histogram(
+    "storage_serialize_seconds", "Time encoding one record as JSON", ("stream",))
+STORAGE_WRITE = metrics.histogram(
+    "storage_write_seconds", "Time writing and fsyncing a batch of records", ("stream",))
+STORAGE_COMPACT = metrics.histogram(
+    "storage_compact_seconds", "Time rewriting a stream during compaction", ("stream",))
+
+def _lines_backward(path: Path, block_size: int = READ_BLOCK_SIZE) -> Iterator[bytes]:
+    """Yield the lines of a file last first, reading fixed-size blocks from the end"""
+    with open(path, "rb") as f:
+        position = f.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            lines = (f.read(step) + remainder).split(b"\n")
+            # The first piece may be the end of a line that starts in an earlier block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                if line:
+                    yield line
+        if remainder:
+            yield remainder
+
+class RecordStream:
+    """Base class for a persisted stream of JSON records.
+
+    Every record is kept in an in-memory tail (bounded by ``retention``) so
+    reads never touch storage. When ``key`` is set the tail is indexed by
+    that field and only the latest record per key is retained. With
+    ``keep_tail=False`` nothing is held in memory and the owner rebuilds its
+    own view from ``replay()``.
+
+    ``append`` and ``take_pending`` run on the event loop; ``persist`` does
+    the blocking work and is meant to run on the I/O executor.
+    """
+
+    def __init__(self, name: str, retention: int = 1000, key: Optional[str] = None,
+                 fsync_batch: int = 50, keep_tail: bool = True):
+        self.name = name
+        self.retention = retention
+        self.key = key
+        self.fsync_batch = fsync_batch
+        self.keep_tail = keep_tail
+
+        self.tail = deque(maxlen=retention if keep_tail else 0)
+        self.index: Dict[str, Dict] = {}
+        self._pending: List = []
+
+    def replay(self) -> Iterator[Dict]:
+        """Yield every stored record, oldest first"""
+        raise NotImplementedError
+
+    def replay_reverse(self) -> Iterator[Dict]:
+        """Yield stored records newest first"""
+        raise NotImplementedError
+
+    def _remember(self, record: Dict):
+        if self.key:
+            value = record[self.key]
+            self.index.pop(value, None)
+            self.index[value] = record
+            while len(self.index) > self.retention:
+                self.index.pop(next(iter(self.index)))
+        else:
+            self.tail.append(record)
+
+    def records(self) -> List[Dict]:
+        """Return all retained records, oldest first"""
+        if self.key:
+            return list(self.index.values())
+        return list(self.tail)
+
+    def get(self, value: str) -> Optional[Dict]:
+        """Return the latest record for a key (keyed streams only)"""
+        return self.index.get(value)
+
+    def _encode(self, record: Dict):
+        """What ``persist`` receives for a record"""
+        with STORAGE_SERIALIZE.time(stream=self.name):
+            return json.dumps(record)
+
+    def append(self, record: Dict) -> bool:
+        """Add a record to the tail and buffer it for the next flush.
+
+        Returns True once enough records are buffered to warrant a flush.
+        """
+        self._remember(record)
+        self._pending.append(self._encode(record))
+        return len(self._pending) >= self.fsync_batch
+
+    def drop_pending(self, count: int) -> int:
+        """Discard up to ``count`` of the oldest buffered records; returns how many"""
+        dropped = min(count, len(self._pending))
+        del self._pending[:dropped]
+        return dropped
+
+    def take_pending(self) -> List:
+        """Hand over the buffered records for writing"""
+        pending, self._pending = self._pending, []
+        return pending
+
+    def compaction_due(self, incoming: int = 0) -> bool:
+        return False
+
+    def persist(self, lines: List, snapshot: Optional[List[Dict]] = None):
+        raise NotImplementedError
+
+    def flush(self):
+        """Synchronously write buffered records, compacting when due"""
+        lines = self.take_pending()
+        snapshot = self.records() if self.compaction_due(len(lines)) else None
+        self.persist(lines, snapshot)
+
+    def close(self):
+        self.flush()
+
+class SegmentedLog(RecordStream):
+    """Append-only JSON-lines log split into numbered segment files.
+
+    With ``keep_tail=False`` retention is enforced by dropping whole
+    segments instead of compacting.
+    """
+
+    def __init__(self, directory: Path, retention: int = 1000, key: Optional[str] = None,
+                 segment_size: int = 1000, fsync_batch: int = 50, keep_tail: bool = True):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        super().__init__(self.directory.name, retention, key, fsync_batch, keep_tail)
+        self.segment_size = segment_size
+        self._segment_records = 0
+        self._segment_count = 0
+        self._segment_id = 0
+        self._handle = None
+        self._io_lock = threading.Lock()
+        self._load()
+
+    def _segments(self) -> List[Path]:
+        return sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def _segment_path(self, segment_id: int) -> Path:
+        return self.directory / f"{segment_id:08d}{SEGMENT_SUFFIX}"
+
+    def live_segments(self) -> List[Path]:
+        """Segments from the most recent compaction onwards"""
+        segments = self._segments()
+        for i in range(len(segments) - 1, -1, -1):
+            with open(segments[i], "r") as f:
+                if COMPACTED_MARKER in f.readline():
+                    # Everything before a compacted segment is superseded
+                    return segments[i:]
+        return segments
+
+    def replay(self) -> Iterator[Dict]:
+        """Yield every live record on disk, oldest first"""
+        for segment in self.live_segments():
+            with open(segment, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Torn write at the end of a segment after a crash
+                        continue
+                    if not record.get(COMPACTED_MARKER):
+                        yield record
+
+    def replay_reverse(self) -> Iterator[Dict]:
+        """Yield live records newest first, reading each segment back from its end.
+
+        Stop iterating once enough history has been seen; segments that are
+        never reached are never read.
+        """
+        for segment in reversed(self.live_segments()):
+            for line in _lines_backward(segment):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if not record.get(COMPACTED_MARKER):
+                    yield record
+
+    def _load(self):
+        """Rebuild the in-memory tail from segment files"""
+        if self.keep_tail:
+            with STORAGE_READ.time(stream=self.name):
+                for record in self.replay():
+                    self._remember(record)
+        segments = self._segments()
+        if segments:
+            self._segment_id = int(segments[-1].stem)
+            self._segment_count = len(segments)
+            with open(segments[-1], "r") as f:
+                self._segment_records = sum(1 for _ in f)
+
+    def compaction_due(self, incoming: int = 0) -> bool:
+        """Whether the segments hold enough superseded records to compact"""
+        if not self.keep_tail:
+            return False
+        retained = len(self.index) if self.key else len(self.tail)
+        written = (self._segment_count - 1) * self.segment_size + self._segment_records + incoming
+        return self._segment_count > 2 and written > retained + self.segment_size
+
+    def persist(self, lines: List[str], snapshot: Optional[List[Dict]] = None):
+        """Write and fsync ``lines``, then compact to ``snapshot`` if given"""
+        with self._io_lock:
+            if lines:
+                with STORAGE_WRITE.time(stream=self.name):
+                    self._write(lines)
+            if snapshot is not None:
+                with STORAGE_COMPACT.time(stream=self.name):
+                    self._compact(snapshot)
+
+    def _write(self, lines: List[str]):
+        if not lines:
+            return
+        for line in lines:
+            if self._handle is None or self._segment_records >= self.segment_size:
+                self._roll()
+            self._handle.write(line + "\n")
+            self._segment_records += 1
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+
+    def _roll(self):
+        """Close the current segment and start a new one
+
+        A fresh segment is also started after a restart so that new records
+        are never appended behind a possibly torn final line.
+        """
+        if self._handle is not None:
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+            self._handle.close()
+        self._segment_id += 1
+        self._segment_count += 1
+        self._handle = open(self._segment_path(self._segment_id), "a")
+        self._segment_records = 0
+        if not self.keep_tail:
+            self._drop_expired_segments()
+
+    def _drop_expired_segments(self):
+        """Delete whole segments no longer needed to cover ``retention``"""
+        # Full segments kept besides the open one
+        keep = -(-self.retention // self.segment_size)
+        segments = self._segments()
+        for segment in segments[:max(0, len(segments) - 1 - keep)]:
+            segment.unlink(missing_ok=True)
+            self._segment_count -= 1
+
+    def _compact(self, records: List[Dict]):
+        """Rewrite the retained tail into a single segment and drop older ones"""
+        self._close_handle()
+        old_segments = self._segments()
+        self._segment_id += 1
+        target = self._segment_path(self._segment_id)
+        tmp = target.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            f.write(json.dumps({COMPACTED_MARKER: True}) + "\n")
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+        for segment in old_segments:
+            segment.unlink(missing_ok=True)
+        self._handle = open(target, "a")
+        self._segment_count = 1
+        self._segment_records = len(records) + 1
+
+    def _close_handle(self):
+        if self._handle is not None:
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+            self._handle.close()
+            self._handle = None
+
+    def close(self):
+        """Flush pending records and close the segment"""
+        self.flush()
+        with self._io_lock:
+            self._close_handle()
+
+class StorageBackend:
+    """Base class for pluggable record storage.
+
+    A ``shared`` backend is written by several worker processes at once;
+    each worker then picks up the others' records with ``changes``.
+    """
+
+    streams: Dict[str, RecordStream]
+    executor: IOExecutor
+    shared = False
+
+    def open_stream(self, name: str, retention: int = 1000, key: Optional[str] = None,
+                    keep_tail: bool = True) -> RecordStream:
+        raise NotImplementedError
+
+    async def changes(self, name: str) -> List[Dict]:
+        """Records stored in a stream by other workers since the last call"""
+        return []
+
+    async def flush_stream(self, name: str):
+        pass
+
+    async def update_keys(self, name: str, values: List[str],
+                          update: Callable[[Optional[Dict]], Optional[Dict]]) -> List[Optional[Dict]]:
+        """Replace the records stored under ``values`` in a keyed stream.
+
+        ``update`` receives each stored record, or None, and returns the
+        record to store in its place, or None to leave it. Returns the
+        records stored afterwards. A shared backend applies every update in
+        one transaction, so workers can use it to claim records.
+        """
+        stream = self.streams[name]
+        current = []
+        for value in values:
+            record = update(stream.get(value))
+            if record is not None:
+                stream.append(record)
+            current.append(stream.get(value))
+        return current
+
+    def load_state(self, name: str) -> Optional[Dict]:
+        """The document last saved under ``name``, if any"""
+        return None
+
+    async def save_state(self, name: str, state: Dict):
+        """Replace the document saved under ``name``"""
+
+    async def close(self):
+        pass
+
+def create_backend(data_dir: Path, url: Optional[str] = None) -> StorageBackend:
+    """Build the backend configured by ``url`` or the STORAGE_URL variable.
+
+    ``sqlite:///<path>`` selects the shared SQLite backend (``sqlite://``
+    alone uses ``<data_dir>/helmet.db``), keeping STORAGE_RETENTION_DAYS
+    of history; otherwise JSON-lines segments under ``data_dir`` are used.
+    """
+    url = url or os.getenv("STORAGE_URL", "")
+    if not url:
+        return JSONLinesBackend(data_dir)
+    if url.startswith("sqlite://"):
+        from .sqlite_storage import SQLiteBackend, DEFAULT_RETENTION_DAYS
+        return SQLiteBackend(url[len("sqlite:///"):] or Path(data_dir) / "helmet.db",
+                             retention_days=float(os.getenv("STORAGE_RETENTION_DAYS", DEFAULT_RETENTION_DAYS)))
+    raise ValueError(f"Unsupported STORAGE_URL: {url}")
+
+class JSONLinesBackend(StorageBackend):
+    """Stores each stream as a segmented JSON-lines log under ``data_dir``"""
+
+    def __init__(self, data_dir: Path, executor: Optional[IOExecutor] = None):
+        self.data_dir = Path(data_dir)
+        self.executor = executor or io_executor
+        self.streams: Dict[str, SegmentedLog] = {}
+        self._flush_locks: Dict[str, asyncio.Lock] = {}
+
+    def open_stream(self, name: str, retention: int = 1000, key: Optional[str] = None,
+                    keep_tail: bool = True) -> SegmentedLog:
+        directory = self.data_dir / name
+        is_new = not directory.exists()
+        stream = SegmentedLog(directory, retention=retention, key=key, keep_tail=keep_tail)
+        if is_new:
+            self._import_legacy(name, stream)
+        self.streams[name] = stream
+        self._flush_locks[name] = asyncio.Lock()
+        return stream
+
+    def _import_legacy(self, name: str, stream: SegmentedLog):
+        """Import records from the old whole-file ``<name>.json`` array"""
+        legacy_file = self.data_dir / f"{name}.json"
+        if not legacy_file.exists():
+            return
+        try:
+            data = json.loads(legacy_file.read_text())
+        except json.JSONDecodeError as e:
+            print(f"Error importing {legacy_file}: {e}")
+            return
+        for record in data[-stream.retention:]:
+            stream.append(record)
+        stream.flush()
+
+    def _state_path(self, name: str) -> Path:
+        return self.data_dir / "state" / f"{name}.json"
+
+    def load_state(self, name: str) -> Optional[Dict]:
+        path = self._state_path(name)
+        if not path.exists():
+            return None
+        try:
+            return json.loads(path.read_text())
+        except json.JSONDecodeError as e:
+            print(f"Error loading {path}: {e}")
+            return None
+
+    def _write_state(self, name: str, data: str):
+        path = self._state_path(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    async def save_state(self, name: str, state: Dict):
+        """Write the document to a temporary file and swap it into place"""
+        await self.executor.run(self._write_state, name, json.dumps(state))
+
+    async def flush_stream(self, name: str):
+        """Write a stream's buffered records on the I/O executor"""
+        stream = self.streams[name]
+        # Flushes of one stream are serialized so segments keep append order
+        async with self._flush_locks[name]:
+            lines = stream.take_pending()
+            snapshot = stream.records() if stream.compaction_due(len(lines)) else None
+            if lines or snapshot is not None:
+                await self.executor.run(stream.persist, lines, snapshot)
+
+    async def close(self):
+        for name, stream in self.streams.items():
+            await self.flush_stream(name)
+            await self.executor.run(stream.close)
@@ -0,0 +1,108 @@
+from typing import Dict, List, Optional, Tuple
+from array import array
+from datetime import datetime
+
+def to_epoch(timestamp) -> float:
+    """Convert an ISO timestamp (or epoch number) to epoch seconds"""
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return datetime.now().timestamp()
+
+def parse_time(value: str) -> float:
+    """Parse a query time given as an ISO timestamp or epoch seconds.
+
+    Unlike ``to_epoch`` this raises ValueError instead of falling back to
+    now, so callers can reject the value.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+class TrackBuffer:
+    """Fixed-capacity ring buffer of one device's fixes stored column-wise.
+
+    Latitude, longitude and timestamp live in three ``array('d')`` columns,
+    so a fix costs 24 bytes instead of a dict per point. The columns grow
+    as fixes arrive and only wrap around once they reach ``capacity``, so a
+    device that has sent a few fixes holds a few slots.
+    """
+
+    __slots__ = ("capacity", "lat", "lon", "ts", "head", "size")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.lat = array("d")
+        self.lon = array("d")
+        self.ts = array("d")
+        self.head = 0  # next write position
+        self.size = 0
+    
+    def append(self, latitude: float, longitude: float, timestamp: float):
+        if self.size < self.capacity:
+            self.lat.append(latitude)
+            self.lon.append(longitude)
+            self.ts.append(timestamp)
+            self.size += 1
+            self.head = self.size % self.capacity
+            return
+        self.lat[self.head] = latitude
+        self.lon[self.head] = longitude
+        self.ts[self.head] = timestamp
+        self.head = (self.head + 1) % self.capacity
+    
+    def recent(self, limit: int) -> List[Tuple[float, float, float]]:
+        """Return up to ``limit`` most recent fixes, oldest first"""
+        count = min(limit, self.size)
+        start = (self.head - count) % self.capacity
+        return [
+            (self.lat[i], self.lon[i], self.ts[i])
+            for i in ((start + n) % self.capacity for n in range(count))
+        ]
+    
+    def latest(self) -> Optional[Tuple[float, float, float]]:
+        if not self.size:
+            return None
+        i = (self.head - 1) % self.capacity
+        return self.lat[i], self.lon[i], self.ts[i]
+
+class TrackStore:
+    """Per-device GPS tracks held in columnar ring buffers"""
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.tracks: Dict[str, TrackBuffer] = {}
+        # Insertion sequence of the last fix per device, for cross-device ordering
+        self.last_seq: Dict[str, int] = {}
+        self._seq = 0
+    
+    def add(self, device: str, latitude: float, longitude: float, timestamp: float):
+        track = self.tracks.get(device)
+        if track is None:
+            track = self.tracks[device] = TrackBuffer(self.capacity)
+        track.append(latitude, longitude, timestamp)
+        self._seq += 1
+        self.last_seq[device] = self._seq
+    
+    def recent(self, device: str, limit: int = 100) -> List[Dict]:
+        """Recent fixes for a device as GPS records, oldest first"""
+        track = self.tracks.get(device)
+        if track is None:
+            return []
+        return [
+            {
+                "device": device,
+                "latitude": lat,
+                "longitude": lon,
+                "timestamp": datetime.fromtimestamp(ts).isoformat()
+            }
+            for lat, lon, ts in track.recent(limit)
+        ]
+    
+    def latest_positions(self, limit: int = 100) -> List[Dict]:
+        """Last known fix of the most recently updated devices"""
+        devices = sorted(self.last_seq, key=self.last_seq.get)[-limit:]
+        return [self.recent(device, 1)[0] for device in devices]
@@ -0,0 +1,89 @@
+import asyncio
+import time
+import httpx
+import pytest
+from app import main
+from app.auth import DeviceAuth
+from app.data_manager import DataManager
+from app.device_manager import DeviceManager
+from app.storage import JSONLinesBackend
+
+SECRET = "test-secret"
+
+@pytest.fixture
+def auth():
+    registry = DeviceManager()
+    registry.set_token("helmet-1", "static-token")
+    return DeviceAuth(registry, secret=SECRET, required=True)
+
+def test_static_and_signed_tokens(auth):
+    assert auth.verify("helmet-1", "static-token")
+    assert not auth.verify("helmet-1", "wrong-token")
+    assert not auth.verify("helmet-2", "static-token")
+    token = auth.issue_token("helmet-2")
+    assert auth.verify("helmet-2", token)
+    # A token signed for one device does not authenticate another
+    assert not auth.verify("helmet-1", token)
+    assert not auth.verify("helmet-2", DeviceAuth(DeviceManager(), secret="other").issue_token("helmet-2"))
+
+def test_expired_signed_token_is_rejected(auth):
+    assert not auth.verify("helmet-1", auth.issue_token("helmet-1", expires_in=-60))
+    # A valid result is not cached past the token's expiry
+    token = auth.issue_token("helmet-1", expires_in=1)
+    assert auth.verify("helmet-1", token)
+    # Expiry is checked in whole seconds
+    time.sleep(2.1)
+    assert not auth.verify("helmet-1", token)
+
+def test_repeat_checks_hit_the_cache(auth, monkeypatch):
+    checks = []
+    check_token = auth.registry.check_token
+
+    def counting_check(uuid: str, token: str) -> bool:
+        checks.append(token)
+        return check_token(uuid, token)
+
+    monkeypatch.setattr(auth.registry, "check_token", counting_check)
+    for _ in range(3):
+        assert auth.verify("helmet-1", "static-token")
+        assert not auth.verify("helmet-1", "wrong-token")
+    assert checks == ["static-token", "wrong-token"]
+
+def test_invalidate_drops_a_changed_token(auth):
+    assert auth.verify("helmet-1", "static-token")
+    auth.registry.set_token("helmet-1", "rotated-token")
+    # Still answered from the cache until the device's entries are dropped
+    assert auth.verify("helmet-1", "static-token")
+    auth.invalidate("helmet-1")
+    assert not auth.verify("helmet-1", "static-token")
+    assert auth.verify("helmet-1", "rotated-token")
+
+def test_failures_are_cached_briefly(auth):
+    auth.negative_ttl = 0
+    assert not auth.verify("helmet-3", "late-token")
+    auth.registry.set_token("helmet-3", "late-token")
+    assert auth.verify("helmet-3", "late-token")
+
+def test_endpoints_answer_401_without_a_valid_token(auth, tmp_path, monkeypatch):
+    manager = DataManager(tmp_path, backend=JSONLinesBackend(tmp_path))
+    monkeypatch.setattr(main, "data_manager", manager)
+    monkeypatch.setattr(main, "device_auth", auth)
+    body = {"device": "helmet-1", "level": "INFO", "message": "hello"}
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            response = await client.post("/log", json=body)
+            assert response.status_code == 401
+            assert response.headers["WWW-Authenticate"] == "Bearer"
+            response = await client.post("/log", json=body, headers={"Authorization": "Bearer wrong-token"})
+            assert response.status_code == 401
+            expired = auth.issue_token("helmet-1", expires_in=-60)
+            response = await client.post("/log", json=body, headers={"Authorization": f"Bearer {expired}"})
+            assert response.status_code == 401
+
+            response = await client.post("/log", json=body, headers={"X-Device-Token": "static-token"})
+            assert response.status_code == 200
+            response = await client.post("/log", json=body, params={"token": auth.issue_token("helmet-1")})
+            assert response.status_code == 200
+        await manager.close()
+    asyncio.run(run())
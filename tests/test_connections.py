@@ -0,0 +1,72 @@
+import asyncio
+from app.connection_manager import ConnectionManager
+from app.pubsub import BrokerPubSub, BrokerServer, InProcessPubSub
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+
+async def wait_until(condition, timeout: float = 5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+def test_old_socket_closing_keeps_the_reconnected_one():
+    async def run():
+        manager = ConnectionManager(InProcessPubSub())
+        old, new = FakeSocket(), FakeSocket()
+        await manager.connect("bike-1", old)
+        await manager.connect("bike-1", new)
+        # The dropped connection notices it is gone after the bike reconnected
+        manager.disconnect("bike-1", old)
+        await manager.send_to_device("bike-1", "304")
+        assert new.sent == ["304"] and old.sent == []
+        assert manager.last_command("bike-1") == "304"
+
+        manager.disconnect("bike-1", new)
+        assert "bike-1" not in manager.active_connections
+        assert manager.last_command("bike-1") is None
+    asyncio.run(run())
+
+def test_commands_reach_a_socket_held_by_another_worker():
+    async def run():
+        broker = BrokerServer(port=0)
+        await broker.start()
+        workers = []
+        for worker_id in ("worker-a", "worker-b"):
+            manager = ConnectionManager(BrokerPubSub(broker.host, broker.port, reconnect_delay=0.05))
+            manager.worker_id = worker_id
+            await manager.start()
+            await manager.transport.start()
+            workers.append(manager)
+        a, b = workers
+        bike, helmet = FakeSocket(), FakeSocket()
+        await b.connect("bike-1", bike)
+        await a.connect("helmet-1", helmet)
+
+        # Worker A does not hold the bike, so the command goes through the broker
+        await a.send_to_device("bike-1", "304")
+        assert a.last_command("bike-1") == "304"
+        await wait_until(lambda: bike.sent)
+        assert bike.sent == ["304"] and b.last_command("bike-1") == "304"
+
+        # A worker's own sockets are sent to directly, whichever worker the command starts on
+        await a.send_to_device("helmet-1", "ping")
+        await b.send_to_device("bike-1", "302")
+        await a.send_to_device("bike-1", "302")
+        await wait_until(lambda: len(bike.sent) == 3)
+        await asyncio.sleep(0.05)
+        assert bike.sent == ["304", "302", "302"] and helmet.sent == ["ping"]
+
+        for manager in workers:
+            await manager.transport.close()
+        await broker.close()
+    asyncio.run(run())
@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+import httpx
+from app import main
+from app.data_manager import DataManager, DeviceStatus
+from app.device_manager import DeviceManager, DeviceType
+from app.event_bus import EventBus
+from app.sqlite_storage import SQLiteBackend
+from app.storage import JSONLinesBackend
+
+DEVICES = 1200
+
+def test_shared_snapshot_reads_statuses_in_one_batch(tmp_path, monkeypatch):
+    async def run():
+        writer = DataManager(tmp_path, backend=SQLiteBackend(tmp_path / "helmet.db"))
+        for i in range(0, DEVICES, 2):
+            status = "drunken" if i % 4 == 0 else "not_drunken"
+            await writer.update_device_status(DeviceStatus(uuid=f"helmet-{i}", status=status,
+                                                           timestamp=datetime.now().isoformat()))
+        await writer.close()
+
+        reader = DataManager(tmp_path, backend=SQLiteBackend(tmp_path / "helmet.db"))
+        registry = DeviceManager()
+        for i in range(DEVICES):
+            registry.add_device(f"helmet-{i}", DeviceType.HELMET, group="fleet")
+        monkeypatch.setattr(main, "data_manager", reader)
+        monkeypatch.setattr(main, "device_manager", registry)
+
+        reads = []
+        run_on_executor = reader.backend.executor.run
+
+        async def counting_run(func, *args, **kwargs):
+            reads.append(func.__name__)
+            return await run_on_executor(func, *args, **kwargs)
+
+        monkeypatch.setattr(reader.backend.executor, "run", counting_run)
+        snapshot = await main.dashboard_snapshot(group="fleet", offset=0, limit=DEVICES)
+        assert reads == ["read_keys"]
+        statuses = {device["device"]: device["status"] for device in snapshot["devices"]}
+        assert len(statuses) == DEVICES and snapshot["total"] == DEVICES
+        assert statuses["helmet-0"] == "drunken"
+        assert statuses["helmet-2"] == "not_drunken"
+        assert statuses["helmet-1"] == "unknown"
+        await reader.close()
+    asyncio.run(run())
+
+def test_local_statuses_come_from_memory(tmp_path):
+    async def run():
+        manager = DataManager(tmp_path)
+        await manager.update_device_status(DeviceStatus(uuid="helmet-1", status="drunken",
+                                                        timestamp=datetime.now().isoformat()))
+        statuses = await manager.get_device_statuses(["helmet-1", "helmet-2"])
+        assert list(statuses) == ["helmet-1"] and statuses["helmet-1"].status == "drunken"
+        await manager.close()
+    asyncio.run(run())
+
+def test_repeat_count_moves_the_dashboard_version(tmp_path, monkeypatch):
+    manager = DataManager(tmp_path, backend=JSONLinesBackend(tmp_path), log_dedupe_window=60)
+    bus = EventBus()
+    monkeypatch.setattr(main, "data_manager", manager)
+    monkeypatch.setattr(main, "event_bus", bus)
+
+    async def run():
+        await bus.start()
+        body = {"device": "helmet-1", "level": "INFO", "message": "<b>sensor</b> warming up"}
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            for _ in range(2):
+                assert (await client.post("/log", json=body)).status_code == 200
+            await bus.stop()
+            await bus.start()
+            etag = (await client.get("/dashboard")).headers["ETag"]
+            version = main.dashboard_cache.version
+
+            # The third report only bumps the collapsed entry's count
+            assert (await client.post("/log", json=body)).status_code == 200
+            await bus.stop()
+            response = await client.get("/dashboard", headers={"If-None-Match": etag})
+            assert response.status_code == 200 and response.headers["ETag"] != etag
+            assert "&lt;b&gt;sensor&lt;/b&gt;" in response.text
+            delta = (await client.get("/api/dashboard/delta", params={
+                "since": version, "instance": main.dashboard_cache.instance
+            })).json()
+            assert [event["data"]["count"] for event in delta["events"]] == [2]
+        await manager.close()
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+import httpx
+import pytest
+from app import main
+from app.device_manager import DEFAULT_GROUP, DeviceManager, DeviceStatus, DeviceType
+
+def uuids(devices) -> list:
+    return [device.uuid for device in devices]
+
+@pytest.fixture
+def registry():
+    registry = DeviceManager()
+    for i in range(10):
+        registry.add_device(f"helmet-{i}", DeviceType.HELMET, group="north" if i % 2 else "south")
+        registry.add_device(f"bike-{i}", DeviceType.BIKE, group="north" if i < 3 else None)
+    return registry
+
+def test_pages_follow_registration_order(registry):
+    pages = [uuids(registry.list_devices(DeviceType.HELMET, offset=offset, limit=4)) for offset in (0, 4, 8, 12)]
+    assert pages == [[f"helmet-{i}" for i in range(start, min(start + 4, 10))] for start in (0, 4, 8)] + [[]]
+    assert registry.count(DeviceType.HELMET) == 10
+    assert registry.count(DeviceType.BIKE) == 10
+    # Unregistered status reporters join the registry as well
+    assert registry.count() == len(registry.devices)
+
+def test_type_and_group_views(registry):
+    assert uuids(registry.list_devices(group="north", limit=100)) == [
+        "bike-0", "helmet-1", "bike-1", "bike-2", "helmet-3", "helmet-5", "helmet-7", "helmet-9"
+    ]
+    assert uuids(registry.list_devices(DeviceType.BIKE, "north")) == ["bike-0", "bike-1", "bike-2"]
+    assert registry.count(DeviceType.BIKE, "north") == 3
+    assert registry.count(group="south") == 5
+    assert uuids(registry.list_devices(DeviceType.BIKE, DEFAULT_GROUP, offset=5)) == ["bike-8", "bike-9"]
+    assert registry.list_devices(group="nowhere") == [] and registry.count(group="nowhere") == 0
+
+def test_regrouping_moves_a_device_between_views(registry):
+    registry.add_device("helmet-1", DeviceType.HELMET, group="south")
+    assert "helmet-1" not in uuids(registry.list_devices(group="north", limit=100))
+    assert uuids(registry.list_devices(group="south", limit=100))[-1] == "helmet-1"
+    # Refreshing without a group keeps the current one
+    registry.add_device("helmet-1", DeviceType.HELMET)
+    assert registry.group_of("helmet-1") == "south"
+    # A group is dropped once its last member leaves
+    registry.add_device("helmet-1", DeviceType.HELMET, group="east")
+    assert registry.count(group="east") == 1
+    registry.add_device("helmet-1", DeviceType.HELMET, group="south")
+    assert sorted(registry.by_group) == [DEFAULT_GROUP, "north", "south"]
+
+def test_status_reports_register_unknown_devices():
+    registry = DeviceManager()
+    registry.record_status("bike-77", "drunken")
+    registry.record_status("helmet-77", "not_drunken")
+    assert uuids(registry.list_devices(DeviceType.BIKE)) == ["bike-77"]
+    assert registry.devices["helmet-77"].status == DeviceStatus.SAFE
+    assert registry.group_of("bike-77") == DEFAULT_GROUP
+
+def test_devices_endpoint_pages(registry, monkeypatch):
+    monkeypatch.setattr(main, "device_manager", registry)
+    registry.pair("helmet-2", "bike-2")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            body = (await client.get("/api/devices", params={"type": "bike", "group": "north",
+                                                             "offset": 1, "limit": 2})).json()
+            assert body["total"] == 3 and body["offset"] == 1
+            assert [device["uuid"] for device in body["devices"]] == ["bike-1", "bike-2"]
+            assert body["devices"][1]["paired_with"] == "helmet-2"
+            assert body["devices"][1]["group"] == "north" and body["devices"][1]["status"] == "unknown"
+            response = await client.get("/api/devices", params={"limit": 0})
+            assert response.status_code == 422
+    asyncio.run(run())
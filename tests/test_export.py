@@ -0,0 +1,101 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+import httpx
+import pytest
+from app import main
+from app.data_manager import DataManager
+from app.sqlite_storage import SQLiteBackend
+from app.storage import JSONLinesBackend
+
+@pytest.fixture(params=["jsonl", "sqlite"])
+def manager(request, tmp_path, monkeypatch):
+    if request.param == "sqlite":
+        backend = SQLiteBackend(tmp_path / "helmet.db")
+    else:
+        backend = JSONLinesBackend(tmp_path)
+    manager = DataManager(tmp_path, backend=backend, log_dedupe_window=0)
+    monkeypatch.setattr(main, "data_manager", manager)
+    return manager
+
+async def fill(manager: DataManager) -> str:
+    """Log two batches a moment apart; returns a time between them"""
+    for i in range(4):
+        await manager.add_log(f"helmet-{i % 2}", "WARNING" if i == 3 else "INFO", f"early {i}")
+    await asyncio.sleep(0.05)
+    cut = datetime.now().isoformat()
+    await asyncio.sleep(0.05)
+    for i in range(4):
+        await manager.add_log(f"helmet-{i % 2}", "INFO", f"late {i}, with \"quotes\"")
+    return cut
+
+def export(manager: DataManager, **params):
+    async def run():
+        cut = await fill(manager)
+        params.update({key: cut for key, value in params.items() if value == "cut"})
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            response = await client.get("/export/logs", params=params)
+        await manager.close()
+        return response
+    return asyncio.run(run())
+
+EARLY = [f"early {i}" for i in range(4)]
+LATE = [f"late {i}, with \"quotes\"" for i in range(4)]
+
+def test_json(manager):
+    response = export(manager, format="json")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    assert "logs.json" in response.headers["content-disposition"]
+    assert [record["message"] for record in response.json()] == EARLY + LATE
+
+def test_ndjson(manager):
+    response = export(manager, format="NDJSON")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert [record["message"] for record in records] == EARLY + LATE
+
+def test_csv(manager):
+    response = export(manager, format="csv")
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert rows[0] == ["Timestamp", "Device", "Level", "Message"]
+    assert [row[3] for row in rows[1:]] == EARLY + LATE
+    assert rows[4][1:3] == ["helmet-1", "WARNING"]
+
+def test_columnar(manager):
+    response = export(manager, format="columnar")
+    assert response.headers["content-type"] == "application/gzip"
+    groups = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert sum(group["rows"] for group in groups) == 8
+    messages, devices, levels = [], [], []
+    for group in groups:
+        messages += group["message"]
+        devices += [group["device"]["dictionary"][code] for code in group["device"]["codes"]]
+        levels += [group["level"]["dictionary"][code] for code in group["level"]["codes"]]
+    assert messages == EARLY + LATE
+    assert devices == ["helmet-0", "helmet-1"] * 4
+    assert levels.count("WARNING") == 1
+
+def test_device_filter(manager):
+    records = export(manager, format="json", device="helmet-1").json()
+    assert [record["message"] for record in records] == EARLY[1::2] + LATE[1::2]
+
+def test_time_range_filters(manager):
+    records = export(manager, format="json", since="cut").json()
+    assert [record["message"] for record in records] == LATE
+
+def test_until_and_device_filters_combine(manager):
+    records = export(manager, format="json", device="helmet-0", until="cut").json()
+    assert [record["message"] for record in records] == EARLY[::2]
+
+def test_unknown_format_is_rejected(manager):
+    response = export(manager, format="xml")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unsupported format: xml"
+
+def test_invalid_time_is_rejected(manager):
+    assert export(manager, since="last week").status_code == 422
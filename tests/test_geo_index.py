@@ -0,0 +1,27 @@
+from array import array
+import random
+import pytest
+from app.geo_index import TripSegmenter, haversine_km, path_km
+
+def test_path_matches_summed_legs():
+    rng = random.Random(7)
+    lats = array("d", (12.9 + rng.uniform(-0.05, 0.05) for _ in range(200)))
+    lons = array("d", (77.5 + rng.uniform(-0.05, 0.05) for _ in range(200)))
+    legs = sum(haversine_km(lats[i - 1], lons[i - 1], lats[i], lons[i]) for i in range(1, len(lats)))
+    assert path_km(lats, lons) == pytest.approx(legs, rel=1e-12)
+    assert path_km(lats[:1], lons[:1]) == 0.0
+
+def test_columns_give_the_same_trips_as_single_fixes():
+    rng = random.Random(11)
+    fixes, timestamp = [], 1_000_000.0
+    for _ in range(500):
+        # Mostly steady fixes, with gaps that start new trips and some out of order
+        timestamp += rng.choice([5.0, 5.0, 5.0, 900.0, -30.0])
+        fixes.append((12.9 + rng.uniform(-0.01, 0.01), 77.5 + rng.uniform(-0.01, 0.01), timestamp))
+    single, batched = TripSegmenter(), TripSegmenter()
+    for latitude, longitude, ts in fixes:
+        single.add("bike-1", latitude, longitude, ts)
+    # Two batches, so the second continues the first one's last trip
+    for part in (fixes[:250], fixes[250:]):
+        batched.add_track("bike-1", *(array("d", column) for column in zip(*part)))
+    assert batched.recent("bike-1", 50) == single.recent("bike-1", 50)
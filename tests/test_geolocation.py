@@ -0,0 +1,119 @@
+import asyncio
+from datetime import date
+import httpx
+import pytest
+from app import main
+from app.data_manager import DataManager
+from app.geolocation import GeoLocator, GeoProvider
+from app.gps_manager import GPSManager
+from app.storage import JSONLinesBackend
+
+class StubProvider(GeoProvider):
+    """Resolves addresses from a table, holding every lookup until ``release`` is set"""
+
+    def __init__(self, locations: dict):
+        self.locations = locations
+        self.lookups = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def lookup(self, session, ip: str):
+        self.lookups.append(ip)
+        await self.release.wait()
+        return self.locations.get(ip)
+
+LOCATIONS = {"203.0.113.7": {"city": "Bengaluru", "lat": 12.97, "lon": 77.59}}
+
+def test_cache_hits_and_failures():
+    async def run():
+        provider = StubProvider(LOCATIONS)
+        locator = GeoLocator(provider, ttl=60, negative_ttl=60)
+        assert (await locator.locate("203.0.113.7"))["city"] == "Bengaluru"
+        assert (await locator.locate("203.0.113.7"))["city"] == "Bengaluru"
+        # Unresolvable addresses are remembered too
+        assert await locator.locate("198.51.100.1") is None
+        assert await locator.locate("198.51.100.1") is None
+        assert provider.lookups == ["203.0.113.7", "198.51.100.1"]
+        await locator.close()
+    asyncio.run(run())
+
+def test_expired_and_evicted_entries_are_looked_up_again():
+    async def run():
+        provider = StubProvider(LOCATIONS)
+        locator = GeoLocator(provider, cache_size=1, ttl=0, negative_ttl=60)
+        await locator.locate("203.0.113.7")
+        await locator.locate("203.0.113.7")
+        await locator.locate("198.51.100.1")
+        await locator.locate("198.51.100.2")
+        await locator.locate("198.51.100.1")
+        assert provider.lookups == ["203.0.113.7", "203.0.113.7", "198.51.100.1", "198.51.100.2", "198.51.100.1"]
+        await locator.close()
+    asyncio.run(run())
+
+def test_concurrent_lookups_share_one_request():
+    async def run():
+        provider = StubProvider(LOCATIONS)
+        provider.release.clear()
+        locator = GeoLocator(provider)
+        callers = [asyncio.create_task(locator.locate("203.0.113.7")) for _ in range(20)]
+        await asyncio.sleep(0.01)
+        provider.release.set()
+        results = await asyncio.gather(*callers)
+        assert provider.lookups == ["203.0.113.7"]
+        assert all(result["city"] == "Bengaluru" for result in results)
+        await locator.close()
+    asyncio.run(run())
+
+def test_cancelled_lookup_hands_over_to_waiting_callers():
+    async def run():
+        provider = StubProvider(LOCATIONS)
+        provider.release.clear()
+        locator = GeoLocator(provider)
+        leader = asyncio.create_task(locator.locate("203.0.113.7"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(locator.locate("203.0.113.7"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        provider.release.set()
+        assert (await follower)["city"] == "Bengaluru"
+        assert provider.lookups == ["203.0.113.7", "203.0.113.7"]
+        await locator.close()
+    asyncio.run(run())
+
+@pytest.fixture
+def gps_env(tmp_path, monkeypatch):
+    manager = DataManager(tmp_path, backend=JSONLinesBackend(tmp_path))
+    provider = StubProvider(LOCATIONS)
+    gps = GPSManager(manager, GeoLocator(provider))
+    monkeypatch.setattr(main, "data_manager", manager)
+    monkeypatch.setattr(main, "gps_manager", gps)
+    return manager, gps, provider
+
+def test_gps_endpoint_attaches_ip_location(gps_env):
+    manager, gps, provider = gps_env
+    today = date.today().isoformat()
+
+    async def run():
+        await manager.start()
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            for i in range(5):
+                response = await client.post("/GPS", params={
+                    "device": "bike-1", "latitude": 12.9 + i * 1e-4, "longitude": 77.5,
+                    "timestamp": f"{today}T00:00:0{i}", "ip": "203.0.113.7"
+                })
+                assert response.status_code == 200
+            response = await client.post("/GPS", params={
+                "device": "bike-2", "latitude": 1.0, "longitude": 2.0, "timestamp": f"{today}T00:00:00"
+            })
+            assert response.status_code == 200
+        await gps.close()
+        await manager.close()
+        assert provider.lookups == ["203.0.113.7"]
+
+        located = [entry for entry in manager.gps_log.replay() if entry["device"] == "bike-1"]
+        assert len(located) == 5
+        assert all(entry["ip_location"]["city"] == "Bengaluru" for entry in located)
+        assert [entry["timestamp"] for entry in located] == [f"{today}T00:00:0{i}" for i in range(5)]
+        assert [entry["ip_location"] for entry in manager.gps_log.replay() if entry["device"] == "bike-2"] == [None]
+    asyncio.run(run())
@@ -0,0 +1,129 @@
+import asyncio
+from datetime import datetime
+import httpx
+import pytest
+from app import main
+from app.data_manager import DataManager, GPSData
+from app.pipeline import IngestLimit, IngestSaturated
+from app.storage import JSONLinesBackend
+
+def open_manager(tmp_path, **limits) -> DataManager:
+    return DataManager(tmp_path, backend=JSONLinesBackend(tmp_path), ingest_limits=limits, log_dedupe_window=0)
+
+def fix(i: int) -> GPSData:
+    return GPSData(device="bike-1", latitude=float(i), longitude=0.0, timestamp=datetime.now().isoformat())
+
+async def log(manager: DataManager, message: str, level: str = "INFO"):
+    async with manager.pipeline.admission("logs", level):
+        # Give every concurrent request the chance to be admitted first
+        await asyncio.sleep(0.01)
+        await manager.add_log("helmet-1", level, message)
+
+def test_concurrent_requests_cannot_overfill_the_buffer(tmp_path):
+    manager = open_manager(tmp_path, logs=IngestLimit(max_pending=5, policy="block", block_timeout=0))
+
+    async def run():
+        results = await asyncio.gather(*(log(manager, f"entry {i}") for i in range(12)), return_exceptions=True)
+        assert sum(result is None for result in results) == 5
+        assert all(isinstance(result, IngestSaturated) for result in results if result is not None)
+        assert manager.pipeline.pending["logs"] == 5 and manager.pipeline.reserved["logs"] == 0
+        await manager.close()
+    asyncio.run(run())
+
+def test_room_is_given_back_only_once_written(tmp_path, monkeypatch):
+    manager = open_manager(tmp_path, logs=IngestLimit(max_pending=3, policy="block", block_timeout=0))
+    backend = manager.backend
+    flush_stream = backend.flush_stream
+    written = asyncio.Event()
+
+    async def slow_flush_stream(name: str):
+        if name == "logs":
+            await written.wait()
+        await flush_stream(name)
+
+    monkeypatch.setattr(backend, "flush_stream", slow_flush_stream)
+
+    async def run():
+        for i in range(3):
+            await log(manager, f"entry {i}")
+        flush = asyncio.create_task(manager.pipeline.flush())
+        await asyncio.sleep(0.01)
+        with pytest.raises(IngestSaturated):
+            await log(manager, "while writing")
+        written.set()
+        await flush
+        await log(manager, "after the write")
+        await manager.close()
+        assert [entry["message"] for entry in manager.logs_log.replay()][-1] == "after the write"
+    asyncio.run(run())
+
+def test_block_waits_for_a_flush(tmp_path):
+    manager = open_manager(tmp_path, logs=IngestLimit(max_pending=2, policy="block", block_timeout=2.0))
+    manager.pipeline.flush_interval = 0.05
+
+    async def run():
+        await manager.start()
+        for i in range(2):
+            await log(manager, f"entry {i}")
+        await log(manager, "waited")
+        assert manager.pipeline.shed == {}
+        await manager.close()
+    asyncio.run(run())
+
+def test_drop_oldest_drops_unwritten_records(tmp_path):
+    manager = open_manager(tmp_path, gps=IngestLimit(max_pending=5, policy="drop_oldest"))
+    pipeline = manager.pipeline
+
+    async def run():
+        for i in range(8):
+            async with pipeline.admission("gps"):
+                await manager.add_gps_data(fix(i))
+        assert pipeline.shed == {"gps": 3} and pipeline.pending["gps"] == 5
+        await manager.close()
+        assert [entry["latitude"] for entry in manager.gps_log.replay()] == [3.0, 4.0, 5.0, 6.0, 7.0]
+        # Only the write buffer is trimmed; the in-memory track keeps every fix
+        assert len(manager.tracks.recent("bike-1", 10)) == 8
+    asyncio.run(run())
+
+def test_drop_by_level_keeps_security_and_errors(tmp_path):
+    manager = open_manager(tmp_path, logs=IngestLimit(max_pending=2, policy="drop_by_level"))
+
+    async def run():
+        for i in range(2):
+            await log(manager, f"entry {i}")
+        with pytest.raises(IngestSaturated) as refused:
+            await log(manager, "chatter")
+        assert refused.value.retry_after == 1
+        await log(manager, "alcohol", level="SECURITY")
+        await log(manager, "sensor", level="ERROR")
+        assert manager.pipeline.shed == {"logs": 1}
+        await manager.close()
+        assert [entry["message"] for entry in manager.logs_log.replay()] == ["entry 0", "entry 1", "alcohol", "sensor"]
+    asyncio.run(run())
+
+def test_saturated_endpoints_answer_429_with_retry_after(tmp_path, monkeypatch):
+    manager = open_manager(tmp_path, logs=IngestLimit(max_pending=1, policy="drop_by_level"),
+                           gps=IngestLimit(max_pending=1, policy="block", block_timeout=0))
+    manager.pipeline.flush_interval = 2.5
+    monkeypatch.setattr(main, "data_manager", manager)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            body = {"device": "helmet-1", "level": "INFO", "message": "chatter"}
+            assert (await client.post("/log", json=body)).status_code == 200
+            response = await client.post("/PostLogs", json=body)
+            assert response.status_code == 429
+            assert response.headers["Retry-After"] == "3"
+            body["level"] = "SECURITY"
+            assert (await client.post("/log", json=body)).status_code == 200
+
+            fixes = [{"device": "bike-1", "latitude": 1.0, "longitude": 2.0}] * 2
+            assert (await client.post("/GPS/batch", json=fixes)).status_code == 200
+            response = await client.post("/GPS", params={"device": "bike-1", "latitude": 1.0, "longitude": 2.0,
+                                                         "timestamp": datetime.now().isoformat()})
+            assert response.status_code == 429 and "Retry-After" in response.headers
+            stats = (await client.get("/stats/ingest")).json()
+            assert stats["logs"]["shed"] == 1 and stats["gps"]["shed"] == 1
+            assert stats["gps"]["pending"] == 2 and stats["gps"]["reserved"] == 0
+        await manager.close()
+    asyncio.run(run())
@@ -0,0 +1,170 @@
+import asyncio
+import time
+import httpx
+import pytest
+from app import main
+from app.data_manager import DataManager
+from app.event_bus import EventBus
+from app.pubsub import PubSubUnavailable
+from app.storage import JSONLinesBackend
+
+HELMET = "helmet-latency"
+BIKE = "bike-latency"
+COMMAND_TIMEOUT = 0.5
+REQUESTS = 200
+MAX_P99 = 0.1
+
+class StalledSocket:
+    """A bike socket whose sends never complete"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+        await asyncio.Event().wait()
+
+class StallsOnceSocket(StalledSocket):
+    """A bike socket whose first send never completes"""
+
+    async def send_text(self, message: str):
+        if not self.sent:
+            await super().send_text(message)
+        self.sent.append(message)
+
+class DownBroker:
+    """A pub/sub transport that is unreachable until ``up`` is set"""
+
+    def __init__(self):
+        self.up = False
+        self.published = []
+
+    async def publish(self, channel: str, message: dict):
+        if not self.up:
+            raise PubSubUnavailable("broker down")
+        self.published.append(message["message"])
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, message: str):
+        self.sent.append(message)
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    """Serve the API over a private store, event bus and paired bike"""
+    manager = DataManager(tmp_path, backend=JSONLinesBackend(tmp_path))
+    bus = EventBus(command_timeout=COMMAND_TIMEOUT)
+    monkeypatch.setattr(main, "data_manager", manager)
+    monkeypatch.setattr(main, "event_bus", bus)
+    monkeypatch.setattr(main.connection_manager, "active_connections", {})
+    monkeypatch.setattr(main.connection_manager, "last_commands", {})
+    main.device_manager.pair(HELMET, BIKE)
+    yield manager, bus
+    main.device_manager.unpair(HELMET)
+
+async def serve(manager: DataManager, bus: EventBus):
+    await manager.start()
+    await bus.start()
+    transport = httpx.ASGITransport(app=main.app)
+    return httpx.AsyncClient(transport=transport, base_url="http://test")
+
+async def shut_down(client: httpx.AsyncClient, manager: DataManager, bus: EventBus):
+    await client.aclose()
+    await bus.stop(timeout=COMMAND_TIMEOUT * 2)
+    await manager.close()
+
+def test_stalled_bike_does_not_hold_up_alert(app_env):
+    manager, bus = app_env
+
+    async def run():
+        client = await serve(manager, bus)
+        socket = main.connection_manager.active_connections[BIKE] = StalledSocket()
+        started = time.perf_counter()
+        request = asyncio.create_task(client.post("/drunken", params={
+            "uuid": HELMET, "alcohol_level": 900, "timestamp": "2026-01-01T00:00:00"
+        }))
+
+        # The status is stored while the send to the bike is stuck
+        await asyncio.sleep(COMMAND_TIMEOUT / 2)
+        assert socket.sent == ["304"]
+        assert not request.done()
+        assert (await manager.get_device_status(HELMET)).status == "drunken"
+
+        # The command is given up and the alert is still answered and logged
+        response = await asyncio.wait_for(request, timeout=COMMAND_TIMEOUT * 4)
+        assert response.status_code == 200
+        assert time.perf_counter() - started < COMMAND_TIMEOUT * 2
+        assert bus.failed == 1
+
+        socket = main.connection_manager.active_connections[BIKE] = RecordingSocket()
+        response = await client.get("/not_drunken", params={"uuid": HELMET})
+        assert response.status_code == 200
+        assert socket.sent == ["302"]
+        assert (await manager.get_device_status(HELMET)).status == "not_drunken"
+        await shut_down(client, manager, bus)
+        assert [entry["level"] for entry in manager.log_index.recent(10)] == ["SECURITY", "ACTION"]
+    asyncio.run(run())
+
+def test_timed_out_release_is_sent_again(app_env):
+    manager, bus = app_env
+
+    async def run():
+        client = await serve(manager, bus)
+        socket = main.connection_manager.active_connections[BIKE] = StallsOnceSocket()
+        response = await client.get("/not_drunken", params={"uuid": HELMET})
+        assert response.status_code == 200
+        assert bus.failed == 1 and socket.sent == ["302"]
+
+        # The status is already recorded, but the bike never got its 302
+        response = await client.get("/not_drunken", params={"uuid": HELMET})
+        assert response.status_code == 200
+        assert socket.sent == ["302", "302"]
+
+        # Once delivered, a repeat report is not sent again
+        await client.get("/not_drunken", params={"uuid": HELMET})
+        assert socket.sent == ["302", "302"]
+        await shut_down(client, manager, bus)
+    asyncio.run(run())
+
+def test_release_dropped_by_broker_is_sent_again(app_env, monkeypatch):
+    manager, bus = app_env
+    broker = DownBroker()
+    monkeypatch.setattr(main.connection_manager, "transport", broker)
+
+    async def run():
+        client = await serve(manager, bus)
+        # The bike's socket is held by another worker and the broker is down
+        await client.get("/not_drunken", params={"uuid": HELMET})
+        assert broker.published == []
+
+        broker.up = True
+        await client.get("/not_drunken", params={"uuid": HELMET})
+        await client.get("/not_drunken", params={"uuid": HELMET})
+        assert broker.published == ["302"]
+        await shut_down(client, manager, bus)
+    asyncio.run(run())
+
+def test_alert_p99_latency(app_env):
+    manager, bus = app_env
+
+    async def run():
+        client = await serve(manager, bus)
+        socket = main.connection_manager.active_connections[BIKE] = RecordingSocket()
+        latencies = []
+        for i in range(REQUESTS):
+            started = time.perf_counter()
+            if i % 2:
+                response = await client.get("/not_drunken", params={"uuid": HELMET})
+            else:
+                response = await client.post("/drunken", params={"uuid": HELMET, "alcohol_level": 900,
+                                                                "timestamp": "2026-01-01T00:00:00"})
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+        latencies.sort()
+        assert latencies[int(len(latencies) * 0.99) - 1] < MAX_P99
+        await shut_down(client, manager, bus)
+        # Every alert and every release reached the bike, in order
+        assert socket.sent == ["304", "302"] * (REQUESTS // 2)
+    asyncio.run(run())
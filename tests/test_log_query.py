@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+import httpx
+import pytest
+from app import main
+from app.data_manager import DataManager
+from app.log_index import LogIndex
+from app.sqlite_storage import SQLiteBackend
+from app.storage import JSONLinesBackend
+
+START = datetime(2026, 1, 1)
+
+def entry(i: int, device: str = "helmet-1", level: str = "INFO", offset: int = None) -> dict:
+    timestamp = START + timedelta(seconds=i if offset is None else offset)
+    return {"device": device, "level": level, "message": f"entry {i}", "timestamp": timestamp.isoformat()}
+
+def messages(entries) -> list:
+    return [e["message"] for e in entries]
+
+def test_no_cursor_returns_newest_page():
+    index = LogIndex(retention=100)
+    for i in range(50):
+        index.add(entry(i))
+    assert messages(index.query(limit=3)) == ["entry 47", "entry 48", "entry 49"]
+
+def test_cursor_pages_forward_without_gaps():
+    index = LogIndex(retention=100)
+    for i in range(10):
+        index.add(entry(i, device=f"helmet-{i % 2}"))
+    cursor, seen = 0, []
+    while True:
+        page = index.query(device="helmet-1", cursor=cursor, limit=2)
+        if not page:
+            break
+        seen += messages(page)
+        cursor = page[-1]["seq"]
+    assert seen == [f"entry {i}" for i in range(1, 10, 2)]
+    index.add(entry(10, device="helmet-1"))
+    assert messages(index.query(device="helmet-1", cursor=cursor)) == ["entry 10"]
+
+def test_cursor_before_evicted_entries_starts_at_oldest_retained():
+    index = LogIndex(retention=5)
+    for i in range(12):
+        index.add(entry(i))
+    assert messages(index.query(cursor=1, limit=2)) == ["entry 7", "entry 8"]
+
+def test_time_range_follows_timestamps_not_ingest_order():
+    index = LogIndex(retention=100)
+    # A collapsed repeat stored late carries its earlier first timestamp
+    for i, offset in enumerate([10, 20, 5, 30, 15, 25]):
+        index.add(entry(i, level="WARNING" if i % 2 else "INFO", offset=offset))
+    since, until = (START + timedelta(seconds=10)).timestamp(), (START + timedelta(seconds=25)).timestamp()
+    assert messages(index.query(since=since, until=until)) == ["entry 0", "entry 1", "entry 4", "entry 5"]
+    assert messages(index.query(since=since, until=until, limit=2)) == ["entry 4", "entry 5"]
+    assert messages(index.query(since=since, until=until, cursor=1, limit=2)) == ["entry 1", "entry 4"]
+    assert messages(index.query(level="WARNING", since=since)) == ["entry 1", "entry 3", "entry 5"]
+
+def test_time_range_skips_evicted_entries():
+    index = LogIndex(retention=4)
+    for i in range(10):
+        index.add(entry(i))
+    assert messages(index.query(since=START.timestamp())) == ["entry 6", "entry 7", "entry 8", "entry 9"]
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    manager = DataManager(tmp_path, backend=JSONLinesBackend(tmp_path), log_dedupe_window=0)
+    monkeypatch.setattr(main, "data_manager", manager)
+    return manager
+
+def test_api_logs_tail_then_poll(manager):
+    async def run():
+        await manager.start()
+        for i in range(30):
+            await manager.add_log("helmet-1", "INFO", f"entry {i}")
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            body = (await client.get("/api/logs", params={"limit": 5})).json()
+            assert messages(body["logs"]) == [f"entry {i}" for i in range(25, 30)]
+
+            await manager.add_log("helmet-1", "INFO", "entry 30")
+            body = (await client.get("/api/logs", params={"cursor": body["cursor"]})).json()
+            assert messages(body["logs"]) == ["entry 30"]
+            body = (await client.get("/api/logs", params={"cursor": body["cursor"]})).json()
+            assert body["logs"] == [] and body["cursor"] is not None
+
+            response = await client.get("/api/logs", params={"since": "yesterday"})
+            assert response.status_code == 422
+        await manager.close()
+    asyncio.run(run())
+
+def test_shared_store_cursors_work_on_every_worker(tmp_path):
+    async def run():
+        workers = [DataManager(tmp_path, backend=SQLiteBackend(tmp_path / "helmet.db"), log_dedupe_window=0)
+                   for _ in range(2)]
+        for i in range(10):
+            worker = workers[i % 2]
+            await worker.add_log(f"helmet-{i % 3}", "ERROR" if i % 4 == 0 else "INFO", f"entry {i}")
+            await worker.pipeline.flush()
+
+        newest = await workers[0].query_logs(limit=3)
+        assert messages(newest) == ["entry 7", "entry 8", "entry 9"]
+
+        # Alternate workers behind a load balancer: nothing skipped or repeated
+        cursor, seen = 0, []
+        for page in range(6):
+            logs = await workers[page % 2].query_logs(cursor=cursor, limit=2)
+            seen += messages(logs)
+            cursor = logs[-1]["seq"] if logs else cursor
+        assert seen == [f"entry {i}" for i in range(10)]
+
+        assert messages(await workers[1].query_logs(device="helmet-1", level="INFO")) == ["entry 1", "entry 7"]
+        assert messages(await workers[1].query_logs(level="ERROR", cursor=1)) == ["entry 4", "entry 8"]
+        since = datetime.now() - timedelta(minutes=1)
+        assert len(await workers[0].query_logs(since=since.isoformat(), limit=1000)) == 10
+        assert await workers[0].query_logs(until=since.isoformat()) == []
+        for worker in workers:
+            await worker.close()
+    asyncio.run(run())
@@ -0,0 +1,45 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+from pathlib import Path
+from app.sqlite_storage import SQLiteBackend
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def migrate(data_dir: Path, *options: str) -> str:
+    """Run the migrate command as an operator would"""
+    result = subprocess.run(
+        [sys.executable, "-m", "app.sqlite_storage", "migrate", "--data-dir", str(data_dir), *options],
+        cwd=ROOT, env={**os.environ, "PYTHONPATH": str(ROOT)}, capture_output=True, text=True, check=True
+    )
+    return result.stdout
+
+def rows(data_dir: Path, name: str, key=None) -> list:
+    backend = SQLiteBackend(data_dir / "helmet.db")
+    records = list(backend.open_stream(name, key=key, keep_tail=False).replay())
+    asyncio.run(backend.close())
+    return records
+
+def test_migrate_imports_once_and_skips_populated_tables(tmp_path):
+    now = datetime.now().isoformat()
+    logs = [{"device": "helmet-1", "level": "INFO", "message": f"entry {i}", "timestamp": now} for i in range(3)]
+    (tmp_path / "logs.json").write_text(json.dumps(logs))
+    (tmp_path / "status.json").write_text(json.dumps([{"uuid": "helmet-1", "status": "drunken", "timestamp": now}]))
+
+    output = migrate(tmp_path)
+    assert "Imported 3 logs records" in output and "Imported 1 status records" in output
+    assert [entry["message"] for entry in rows(tmp_path, "logs")] == ["entry 0", "entry 1", "entry 2"]
+
+    # Running it again leaves tables that already hold records alone
+    output = migrate(tmp_path)
+    assert "Skipping logs: the table already holds records" in output
+    assert "Skipping status: the table already holds records" in output
+    assert "Imported 0 gps records" in output
+    assert len(rows(tmp_path, "logs")) == 3
+    assert len(rows(tmp_path, "status", key="uuid")) == 1
+
+    assert "Imported 3 logs records" in migrate(tmp_path, "--force")
+    assert len(rows(tmp_path, "logs")) == 6
@@ -0,0 +1,134 @@
+import asyncio
+import pytest
+from app.data_manager import DataManager
+from app.notifications import STREAM, FakeProvider, NotificationService
+from app.sqlite_storage import SQLiteBackend
+from app.storage import JSONLinesBackend
+
+async def wait_until(condition, timeout: float = 5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+def stored(service: NotificationService) -> list:
+    return sorted(service.stream.records(), key=lambda record: record["created"])
+
+@pytest.fixture
+def manager(tmp_path):
+    return DataManager(tmp_path, backend=JSONLinesBackend(tmp_path), log_dedupe_window=0)
+
+def service(manager: DataManager, provider: FakeProvider, **options) -> NotificationService:
+    options.setdefault("base_delay", 0.01)
+    return NotificationService(manager, provider, recipients=["+15550001"], **options)
+
+def test_failed_sends_are_retried(manager):
+    provider = FakeProvider(fail_times=2)
+    notifier = service(manager, provider)
+
+    async def run():
+        await notifier.start()
+        assert notifier.alert("helmet-1", "Alcohol detected") == 1
+        await wait_until(lambda: provider.sent)
+        await notifier.close()
+        await manager.close()
+        assert provider.sent == [("+15550001", "Alcohol detected")]
+        [message] = stored(notifier)
+        assert message["status"] == "sent" and message["attempts"] == 3
+        assert message["error"] == "fake provider failure"
+    asyncio.run(run())
+
+def test_gives_up_after_max_attempts(manager):
+    provider = FakeProvider(fail_times=10)
+    notifier = service(manager, provider, max_attempts=2)
+
+    async def run():
+        await notifier.start()
+        notifier.alert("helmet-1", "Alcohol detected")
+        await wait_until(lambda: not notifier.pending)
+        await notifier.close()
+        assert provider.sent == []
+        [message] = stored(notifier)
+        assert message["status"] == "failed" and message["attempts"] == 2
+        assert [log["level"] for log in manager.log_index.recent(10)] == ["ERROR"]
+        await manager.close()
+    asyncio.run(run())
+
+def test_repeat_alerts_are_suppressed_across_restarts(tmp_path, manager):
+    async def run():
+        notifier = service(manager, FakeProvider())
+        assert notifier.alert("helmet-1", "Alcohol detected") == 1
+        assert notifier.alert("helmet-1", "Alcohol detected again") == 0
+        assert notifier.alert("helmet-2", "Alcohol detected") == 1
+        assert notifier.suppressed == 1
+        await manager.close()
+
+        # The unsent messages and the dedupe window survive a restart
+        reopened = DataManager(tmp_path, backend=JSONLinesBackend(tmp_path), log_dedupe_window=0)
+        provider = FakeProvider()
+        notifier = service(reopened, provider)
+        assert notifier.alert("helmet-1", "Alcohol detected") == 0
+        await notifier.start()
+        await wait_until(lambda: not notifier.pending)
+        await notifier.close()
+        # Both messages for the recipient were combined into one send
+        assert provider.sent == [("+15550001", "Alcohol detected\nAlcohol detected")]
+        await reopened.close()
+    asyncio.run(run())
+
+def test_shared_store_sends_each_message_once(tmp_path):
+    async def run():
+        managers = [DataManager(tmp_path, backend=SQLiteBackend(tmp_path / "helmet.db"), log_dedupe_window=0)
+                    for _ in range(2)]
+        first = service(managers[0], FakeProvider())
+        for i in range(4):
+            first.alert(f"helmet-{i}", f"Alcohol detected on helmet-{i}")
+        await managers[0].backend.flush_stream(STREAM)
+
+        # Both workers load the same pending messages and race for them
+        providers = [first.provider, FakeProvider()]
+        notifiers = [first, service(managers[1], providers[1], batch_size=1)]
+        assert len(notifiers[1].pending) == 4
+
+        def delivered() -> list:
+            return sorted(line for provider in providers for _, body in provider.sent for line in body.split("\n"))
+
+        for notifier in notifiers:
+            await notifier.start()
+        # A worker that lost a claim keeps its copy until the lease runs out
+        await wait_until(lambda: len(delivered()) >= 4)
+        await asyncio.sleep(0.1)
+        for notifier in notifiers:
+            await notifier.close()
+        assert delivered() == [f"Alcohol detected on helmet-{i}" for i in range(4)]
+        for manager in managers:
+            await manager.close()
+        # A worker started afterwards finds every message sent
+        restarted = DataManager(tmp_path, backend=SQLiteBackend(tmp_path / "helmet.db"))
+        assert [message["status"] for message in stored(service(restarted, FakeProvider()))] == ["sent"] * 4
+        await restarted.close()
+    asyncio.run(run())
+
+def test_claim_held_by_another_worker_is_left_until_it_expires(tmp_path):
+    async def run():
+        managers = [DataManager(tmp_path, backend=SQLiteBackend(tmp_path / "helmet.db"), log_dedupe_window=0)
+                    for _ in range(2)]
+        holder = service(managers[0], FakeProvider(), claim_lease=0.3)
+        holder.alert("helmet-1", "Alcohol detected")
+        await managers[0].backend.flush_stream(STREAM)
+        # The holder claims the message and then stops without sending it
+        [claimed] = await holder._claim_batch(list(holder.pending.values()))
+        assert claimed["claimed_by"] == holder.worker_id
+
+        provider = FakeProvider()
+        other = service(managers[1], provider)
+        await other.start()
+        await asyncio.sleep(0.1)
+        assert provider.sent == []
+        await wait_until(lambda: provider.sent)
+        await other.close()
+        assert provider.sent == [("+15550001", "Alcohol detected")]
+        for manager in managers:
+            await manager.close()
+    asyncio.run(run())